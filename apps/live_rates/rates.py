@@ -3,16 +3,31 @@ import datetime
 from django.utils import timezone
 from django.conf import settings
 
+from helpers import metrics
 from helpers.logging import log_exception
 from .rate_providers import cleaned_rates_data, mg_link_provider
 from .data_cleaners import MGLinkStockRateDataCleaner
 from apps.stocks.models import Stock, Rate, MarketType
+from apps.stocks.helpers import invalidate_rates_dependents
+from apps.risk_management.incremental import advance_indicator_states
+
+
+RATES_INGESTED = metrics.counter(
+    "rates_ingested_total",
+    "Rates received from rate providers, by result (created, existing or invalid)",
+    ["result"],
+)
+RATES_INGEST_SECONDS = metrics.histogram(
+    "rates_ingest_duration_seconds",
+    "Time taken to fetch and save the latest rates from rate providers",
+)
 
 
 def save_mg_link_psx_rates_data(mg_link_rates_data: typing.List[typing.Dict]):
     # Load first to ensure the data is valid and the
     # and the values are casted to their proper types
     stocks_rates = []
+    existing = invalid = 0
 
     for data in cleaned_rates_data(mg_link_rates_data):
         try:
@@ -48,16 +63,24 @@ def save_mg_link_psx_rates_data(mg_link_rates_data: typing.List[typing.Dict]):
                     stock_id=stock.id, added_at=stock_rate.added_at
                 ).exists()
             ):
+                existing += 1
                 continue
         except Exception as exc:
             log_exception(exc)
+            invalid += 1
             continue
         else:
             stocks_rates.append(stock_rate)
 
-    return Rate.objects.bulk_create(
+    created_rates = Rate.objects.bulk_create(
         stocks_rates, batch_size=5000, ignore_conflicts=False
     )
+    invalidate_rates_dependents(*{rate.stock_id for rate in created_rates})
+    advance_indicator_states(created_rates)
+    RATES_INGESTED.inc(len(created_rates), result="created")
+    RATES_INGESTED.inc(existing, result="existing")
+    RATES_INGESTED.inc(invalid, result="invalid")
+    return created_rates
 
 
 def get_time_in_pst(hour: int, minute: int = 0, second: int = 0) -> datetime.time:
@@ -77,6 +100,7 @@ PSX_MARKET_HOURS = {
 """The PSX market hours in PST for each market day of the week"""
 
 
+@RATES_INGEST_SECONDS.time()
 def update_stock_rates(
     start_date: typing.Optional[datetime.date] = None,
     end_date: typing.Optional[datetime.date] = None,
@@ -1,14 +1,15 @@
-from concurrent.futures import ThreadPoolExecutor
 import datetime
 import decimal
 import functools
 import typing
 import asyncio
-from asgiref.sync import sync_to_async
+import numpy as np
+from asgiref.sync import async_to_sync
 from django.db import models
 
 from .models import Investment, Portfolio
-from apps.stocks.models import KSE100Rate, Stock
+from apps.stocks.models import Stock
+from apps.stocks.index_series import get_kse100_series
 from helpers.utils.colors import random_colors
 from helpers.utils.models import get_objects_within_datetime_range
 from helpers.utils.datetime import (
@@ -16,7 +17,8 @@ from helpers.utils.datetime import (
     split,
     timedelta_code_to_datetime_range,
 )
-from helpers.caching import ttl_cache
+from helpers.caching import ttl_cache, versioned_cache
+from helpers.models.db import executor_sync_to_async, get_database_executor
 from helpers.utils.misc import merge_dicts
 
 
@@ -125,69 +127,54 @@ def datetime_filter_to_date_range(
     return start.date(), end.date()
 
 
-@ttl_cache(ttl=60 * 5)
+@ttl_cache(ttl=60 * 5, stale_ttl=60 * 5)
 def get_kse_performance_data(
-    dt_filter: str, timezone: typing.Optional[str] = None
+    dt_filter: str, timezone: typing.Optional[str] = None, parts: int = 5
 ) -> typing.Dict[str, float]:
     """
     Returns the KSE100 performance data for the time period
     specified by the datetime filter.
 
+    All lookups are resolved against the in-memory KSE100 close series,
+    so non-trading days resolve to the previous trading day's close.
+
     :param dt_filter: The datetime filter to use.
     :param timezone: The preferred timezone to use.
+    :param parts: The number of periods to split the time period into.
+        Increase this for a higher resolution series.
     """
+    kse100_series = get_kse100_series()
     with activate_timezone(timezone):
         start_date, end_date = datetime_filter_to_date_range(dt_filter)
         if not start_date:
             # If the start date is None, use the date of the first KSE100Rate
-            earliest_rate = KSE100Rate.objects.only("date").order_by("date").first()
-            if earliest_rate:
-                start_date = earliest_rate.date
-
-        delta = None
-
-        def get_kse_performance_data_for_period(period_start, period_end):
-            nonlocal kse_performance_data, delta
-            if delta is None:
-                delta = period_end - period_start
-
-            pre_period_start = period_start - delta
+            start_date = kse100_series.start
 
-            pre_period_start_price = KSE100Rate.get_close_on_date(pre_period_start)
-            period_start_price = KSE100Rate.get_close_on_date(period_start)
-            period_end_price = KSE100Rate.get_close_on_date(period_end)
+    periods = list(split(start_date, end_date, parts=parts))
+    period_starts = np.array([start for start, _ in periods], dtype="datetime64[D]")
+    period_ends = np.array([end for _, end in periods], dtype="datetime64[D]")
+    # Each period's start is compared against the date one period-length before it
+    delta = period_ends[0] - period_starts[0]
+    pre_period_starts = period_starts - delta
 
-            percentage_change_at_period_start = 0.00
-            percentage_change_at_period_end = 0.00
-            if pre_period_start_price and period_start_price:
-                percentage_change_at_period_start = (
-                    (period_start_price - pre_period_start_price)
-                    / pre_period_start_price
-                ) * 100
-
-            if period_start_price and period_end_price:
-                percentage_change_at_period_end = (
-                    (period_end_price - period_start_price) / period_start_price
-                ) * 100
-
-            return {
-                period_start.isoformat(): percentage_change_at_period_start,
-                period_end.isoformat(): percentage_change_at_period_end,
-            }
-
-        async def main():
-            async_func = sync_to_async(get_kse_performance_data_for_period)
-            tasks = []
-            for periods in split(start_date, end_date, parts=5):
-                task = asyncio.create_task(async_func(*periods))
-                tasks.append(task)
+    percentage_changes_at_period_starts = kse100_series.percentage_changes(
+        pre_period_starts, period_starts
+    )
+    percentage_changes_at_period_ends = kse100_series.percentage_changes(
+        period_starts, period_ends
+    )
 
-            return await asyncio.gather(*tasks)
-
-        results = asyncio.run(main())
-        # Merge the results such that the most recent result updates the existing one
-        kse_performance_data = functools.reduce(merge_dicts, results)
-        return kse_performance_data
+    kse_performance_data = {}
+    # Iterate in order such that the most recent period's values
+    # update the values of the period before it
+    for (period_start, period_end), start_change, end_change in zip(
+        periods,
+        percentage_changes_at_period_starts.tolist(),
+        percentage_changes_at_period_ends.tolist(),
+    ):
+        kse_performance_data[period_start.isoformat()] = start_change
+        kse_performance_data[period_end.isoformat()] = end_change
+    return kse_performance_data
 
 
 def get_portfolio_percentage_return_on_dates(
@@ -196,33 +183,52 @@ def get_portfolio_percentage_return_on_dates(
     if not dates:
         raise ValueError()
 
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        result = executor.map(portfolio.get_percentage_return_on_investments, dates)
+    result = get_database_executor().map(
+        portfolio.get_percentage_return_on_investments, dates
+    )
     return list(result)
 
 
-@ttl_cache
+@versioned_cache(
+    depends_on=lambda investment, *dates: [
+        investment,
+        ("stocks.Stock", investment.stock_id),
+    ],
+    timeout=60 * 60 * 6,
+    vary_on_timezone=True,
+)
 def get_investment_percentage_return_on_dates(
     investment: Investment, *dates: datetime.date
 ):
     if not dates:
         raise ValueError()
 
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        result = executor.map(
-            lambda date: investment.get_percentage_return_on_date(date)
-            or decimal.Decimal(0),
-            dates,
-        )
+    result = get_database_executor().map(
+        lambda date: investment.get_percentage_return_on_date(date)
+        or decimal.Decimal(0),
+        dates,
+    )
     return list(result)
 
 
-def get_portfolio_performance_data(
+async def aget_portfolio_performance_data(
     portfolio: Portfolio,
     dt_filter: str,
     timezone: str = None,
     stocks: typing.Optional[typing.List[str]] = None,
 ) -> typing.Dict[str, typing.Dict[str, float]]:
+    """
+    Returns the percentage returns of the portfolio, or of its investments
+    in the given stocks, over the time period specified by the datetime filter.
+
+    The time period is split into periods whose returns are calculated
+    concurrently, in the database executor (see `helpers.models.db`).
+
+    :param portfolio: The portfolio to get performance data for.
+    :param dt_filter: The datetime filter to use.
+    :param timezone: The preferred timezone to use.
+    :param stocks: Limit performance data to investments in these stocks (ticker symbols).
+    """
     portfolio_investments = (
         portfolio.investments.only(
             "transaction_type",
@@ -281,16 +287,10 @@ def get_portfolio_performance_data(
         else:
             func = get_portfolio_percentage_return_values_for_period
 
-        async def main():
-            async_func = sync_to_async(func)
-            tasks = []
-            for period in split(start_date, end_date, parts=5):
-                task = asyncio.create_task(async_func(*period))
-                tasks.append(task)
-
-            return await asyncio.gather(*tasks)
-
-        results = asyncio.run(main())
+        async_func = executor_sync_to_async(func)
+        results = await asyncio.gather(
+            *(async_func(*period) for period in split(start_date, end_date, parts=5))
+        )
         # Merge the results such that the most recent result updates the existing one
         percentage_return_values = functools.reduce(merge_dicts, results)
         if stocks:
@@ -298,7 +298,27 @@ def get_portfolio_performance_data(
         return {"all": percentage_return_values}
 
 
-def get_portfolio_performance_graph_data(
+def get_portfolio_performance_data(
+    portfolio: Portfolio,
+    dt_filter: str,
+    timezone: str = None,
+    stocks: typing.Optional[typing.List[str]] = None,
+) -> typing.Dict[str, typing.Dict[str, float]]:
+    """Synchronous version of `aget_portfolio_performance_data`."""
+    return async_to_sync(aget_portfolio_performance_data)(
+        portfolio=portfolio, dt_filter=dt_filter, timezone=timezone, stocks=stocks
+    )
+
+
+async def _value_or_empty(awaitable: typing.Awaitable[typing.Dict]) -> typing.Dict:
+    """Returns the awaited value, or an empty dictionary on `ValueError`"""
+    try:
+        return await awaitable
+    except ValueError:
+        return {}
+
+
+async def aget_portfolio_performance_graph_data(
     portfolio: Portfolio,
     dt_filter: str = "5D",
     timezone: str = None,
@@ -308,22 +328,27 @@ def get_portfolio_performance_graph_data(
     Returns an aggregates the portfolio investments and
     KSE100 performance data to be plotted on a line graph
 
+    The KSE100 and portfolio performance data are fetched concurrently.
+
     :param portfolio: The portfolio to get performance data for.
     :param dt_filter: The datetime filter to use.
     :param timezone: The preferred timezone to use.
     :param stocks: Limit performance data aggregation to include
         only investments in these stocks(stocks with the ticker symbol).
     """
-    try:
-        kse_performance_data = get_kse_performance_data(dt_filter, timezone)
-    except ValueError:
-        kse_performance_data = {}
-    try:
-        portfolio_performance_data = get_portfolio_performance_data(
-            portfolio=portfolio, dt_filter=dt_filter, timezone=timezone, stocks=stocks
-        )
-    except ValueError:
-        portfolio_performance_data = {}
+    kse_performance_data, portfolio_performance_data = await asyncio.gather(
+        _value_or_empty(
+            executor_sync_to_async(get_kse_performance_data)(dt_filter, timezone)
+        ),
+        _value_or_empty(
+            aget_portfolio_performance_data(
+                portfolio=portfolio,
+                dt_filter=dt_filter,
+                timezone=timezone,
+                stocks=stocks,
+            )
+        ),
+    )
 
     colors = {}
     colors["KSE100"] = next(random_colors())
@@ -337,6 +362,18 @@ def get_portfolio_performance_graph_data(
     }
 
 
+def get_portfolio_performance_graph_data(
+    portfolio: Portfolio,
+    dt_filter: str = "5D",
+    timezone: str = None,
+    stocks: typing.Optional[typing.List[str]] = None,
+) -> typing.Dict[str, float]:
+    """Synchronous version of `aget_portfolio_performance_graph_data`."""
+    return async_to_sync(aget_portfolio_performance_graph_data)(
+        portfolio=portfolio, dt_filter=dt_filter, timezone=timezone, stocks=stocks
+    )
+
+
 def get_stocks_invested_from_portfolio(portfolio: Portfolio) -> typing.List[str]:
     stock_tickers = (
         portfolio.investments.only("stock")
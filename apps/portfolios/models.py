@@ -8,11 +8,11 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from django.core.exceptions import ValidationError
-from concurrent.futures import ThreadPoolExecutor
 from asgiref.sync import sync_to_async
 import asyncio
 
-from helpers.caching import ttl_cache
+from helpers.caching import versioned_cache
+from helpers.models.db import get_database_executor
 from helpers.utils.time import timeit
 
 
@@ -85,9 +85,7 @@ class Portfolio(models.Model):
         def get_cost(investment):
             return investment.cost
 
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            costs = executor.map(get_cost, self.investments.all())
-        return costs
+        return get_database_executor().map(get_cost, self.investments.all())
 
     @functools.cached_property
     def invested_capital(self):
@@ -152,14 +150,16 @@ class Portfolio(models.Model):
                 return decimal.Decimal(0.00)
             return return_value
 
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            return_values = executor.map(
-                get_return_value,
-                self.investments.all(),
-            )
-        return return_values
+        return get_database_executor().map(get_return_value, self.investments.all())
 
-    @ttl_cache(ttl=30)
+    @versioned_cache(
+        depends_on=lambda portfolio, *args, **kwargs: [
+            portfolio,
+            ("stocks.Rate", None),
+        ],
+        timeout=60 * 30,
+        vary_on_timezone=True,
+    )
     def get_total_return_on_investments(
         self, date: typing.Optional[datetime.date] = None
     ):
@@ -436,7 +436,14 @@ class Investment(models.Model):
             decimal.Decimal("0.01"), rounding=decimal.ROUND_HALF_UP
         )
 
-    @ttl_cache(ttl=30)
+    @versioned_cache(
+        depends_on=lambda investment, *args, **kwargs: [
+            investment,
+            ("stocks.Stock", investment.stock_id),
+        ],
+        timeout=60 * 60 * 6,
+        vary_on_timezone=True,
+    )
     def get_value_on_date(
         self, date: datetime.date
     ) -> typing.Optional[decimal.Decimal]:
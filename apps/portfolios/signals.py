@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Portfolio, Investment
+from helpers.caching import bump_versions
+
+
+@receiver([post_save, post_delete], sender=Portfolio)
+def invalidate_portfolio_dependents(sender, instance: Portfolio, **kwargs):
+    bump_versions(instance)
+
+
+@receiver([post_save, post_delete], sender=Investment)
+def invalidate_investment_dependents(sender, instance: Investment, **kwargs):
+    # Portfolio values are computed from its investments
+    bump_versions(instance, ("portfolios.Portfolio", instance.portfolio_id))
@@ -3,7 +3,6 @@ import typing
 import decimal
 import functools
 import attrs
-from concurrent.futures import ThreadPoolExecutor
 from django.db import models
 
 from .helpers import datetime_filter_to_date_range, get_stocks_invested_from_investments
@@ -11,6 +10,7 @@ from .models import TransactionType, Portfolio, Investment
 from apps.stocks.models import Rate
 from helpers.utils.decimals import to_n_decimal_places
 from helpers.utils.datetime import activate_timezone
+from helpers.models.db import get_database_executor
 
 
 convert_to_2dp_decimal = functools.partial(to_n_decimal_places, n=2)
@@ -135,15 +135,14 @@ def generate_portfolio_stocks_summary(
         return [StockSummary(symbol="TOTAL")]
 
     stocks_invested_in = get_stocks_invested_from_investments(portfolio_investments)
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        stocks_summaries = list(
-            executor.map(
-                lambda stock: get_stock_summary_from_investments(
-                    stock, portfolio_investments
-                ),
-                stocks_invested_in,
-            )
+    stocks_summaries = list(
+        get_database_executor().map(
+            lambda stock: get_stock_summary_from_investments(
+                stock, portfolio_investments
+            ),
+            stocks_invested_in,
         )
+    )
 
     net_total_quantity_of_stocks_invested_in = math.fsum(
         summary.net_quantity for summary in stocks_summaries
@@ -12,6 +12,7 @@ from apps.stocks.models import Stock
 from apps.accounts.models import UserAccount
 from .data_cleaners import InvestmentDataCleaner
 from helpers.utils.misc import comma_separated_to_int_float
+from helpers.caching import bump_versions
 
 
 EXPECTED_TRANSACTION_COLUMNS = [
@@ -147,6 +148,14 @@ def handle_transactions_file(transactions_file: File, user: UserAccount) -> None
             ) from exc
 
     Investment.objects.bulk_create(new_investments, batch_size=5000)
+    # Bulk creates do not send `post_save`, so the cached values of the
+    # portfolios the investments were added to are invalidated here
+    portfolio_ids = {investment.portfolio_id for investment in new_investments}
+    transaction.on_commit(
+        lambda: bump_versions(
+            *(("portfolios.Portfolio", portfolio_id) for portfolio_id in portfolio_ids)
+        )
+    )
     return None
 
 
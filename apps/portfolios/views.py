@@ -2,7 +2,7 @@ from typing import Any, Dict
 import json
 from django.db.models.base import Model as Model
 from django.db.models.query import QuerySet
-from django.shortcuts import get_object_or_404, redirect
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect
 from django.urls import reverse
 from django.views import generic
 from django.http import JsonResponse, HttpResponse
@@ -14,9 +14,10 @@ from apps.stocks.models import Stock
 from .forms import PortfolioCreateForm, InvestmentAddForm, PortfolioUpdateForm
 from helpers.exceptions import capture
 from helpers.logging import log_exception
+from helpers.views.mixins import AsyncLoginRequiredMixin
 from .helpers import (
+    aget_portfolio_performance_graph_data,
     get_investments_allocation_piechart_data,
-    get_portfolio_performance_graph_data,
     get_stocks_invested_from_investments,
 )
 from .transactions_upload import (
@@ -167,25 +168,25 @@ class PortfolioDetailView(LoginRequiredMixin, generic.ListView):
 
 @capture.enable
 @capture.capture(content="Oops! An error occurred")
-class PortfolioPerformanceDataView(LoginRequiredMixin, generic.View):
+class PortfolioPerformanceDataView(AsyncLoginRequiredMixin, generic.View):
     http_method_names = ["post"]
 
-    def get_object(self):
+    async def aget_object(self):
         # Note that the portfolio queryset is used not the model.
         # This is because the queryset has prefetched and selected related data
         # Making it way more efficient that using the model
-        return get_object_or_404(
+        return await aget_object_or_404(
             portfolio_qs.prefetch_related("investments", "investments__stock"),
             id=self.kwargs["portfolio_id"],
         )
 
-    def post(self, request, *args: Any, **kwargs: Any) -> JsonResponse:
+    async def post(self, request, *args: Any, **kwargs: Any) -> JsonResponse:
         data: Dict = json.loads(request.body)
         dt_filter = data.get("dt_filter", "5D")
         stocks = data.get("stocks", None)
         timezone = data.get("timezone", str(request.user.timezone))
-        portfolio = self.get_object()
-        data = get_portfolio_performance_graph_data(
+        portfolio = await self.aget_object()
+        data = await aget_portfolio_performance_graph_data(
             portfolio=portfolio,
             dt_filter=dt_filter,
             stocks=stocks,
@@ -7,6 +7,10 @@ class RiskManagementConfig(AppConfig):
 
     def ready(self) -> None:
         import apps.risk_management.function_evaluators  # noqa
+        from apps.risk_management.functions_schema import load_functions_schema
+
+        # Evaluators are registered on import, so the schema is complete by now
+        load_functions_schema()
         # import rich
         # from apps.risk_management.criteria.functions import FUNCTIONS_REGISTRY
         # rich.print(FUNCTIONS_REGISTRY)
@@ -1,95 +1,114 @@
 """
 A collection of argument evaluators for TA-LIB functions
+
+Time series arguments are ordered chronologically (oldest first),
+as expected by TA-LIB, so the latest value of a result is its last element.
 """
 
 import typing
 import datetime
+import numpy as np
 from django.db import models
 from django.utils import timezone
 
-from apps.stocks.models import Stock, Rate, StockIndices
-from apps.stocks.helpers import get_stocks_by_indices
+from apps.stocks.models import Stock, Rate
+from apps.stocks.index_series import get_kse100_series
+from apps.stocks.ohlcv import (
+    StockOHLCV,
+    get_rate_dates,
+    get_rate_values,
+    latest_on_each_date,
+)
 from .criteria.functions import FunctionSpec, ensure_ndarray
 
 
+def get_timeperiod_start_date(
+    timeperiod: typing.Optional[float],
+) -> typing.Optional[datetime.date]:
+    """Returns the date from which rates within the provided timeperiod (in days) start."""
+    if timeperiod is None:
+        return None
+    delta = datetime.timedelta(days=float(timeperiod))
+    return timezone.now().date() - delta
+
+
 def filter_rate_qs_by_timeperiod(
     rates: models.QuerySet[Rate], timeperiod: typing.Optional[float]
 ) -> models.QuerySet[Rate]:
     """Returns a filtered Rate queryset based on the provided timeperiod."""
-    delta = datetime.timedelta(days=float(timeperiod))
-    start_date = timezone.now().date() - delta
-    return rates.filter(added_at__date__gte=start_date).distinct("added_at")
+    start_date = get_timeperiod_start_date(timeperiod)
+    return (
+        rates.filter(added_at__date__gte=start_date)
+        .order_by("added_at")
+        .distinct("added_at")
+    )
+
+
+def _rate_values(
+    stock: typing.Union[Stock, StockOHLCV], spec: FunctionSpec, field: str
+):
+    """
+    Returns the chronologically ordered (oldest first) values of the stock's rate field,
+    within the spec's `timeperiod` (in days), if any.
+    """
+    since = get_timeperiod_start_date(spec.kwargs.get("timeperiod", None))
+    return get_rate_values(stock, field, since=since)
 
 
 @ensure_ndarray(array_dtype=float)
 def OPEN_VALUES(stock: Stock, /, spec: FunctionSpec) -> typing.List[float]:
     """Returns a list containing `open` values of a stock rate"""
-    rates = stock.rates
-    timeperiod = spec.kwargs.get("timeperiod", None)
-
-    if timeperiod is not None:
-        rates = filter_rate_qs_by_timeperiod(rates, timeperiod)
-    return rates.only("open").values_list("open", flat=True)
+    return _rate_values(stock, spec, "open")
 
 
 @ensure_ndarray(array_dtype=float)
 def HIGH_VALUES(stock: Stock, /, spec: FunctionSpec) -> typing.List[float]:
     """Returns a list containing `high` values of a stock rate"""
-    rates = stock.rates
-    timeperiod = spec.kwargs.get("timeperiod", None)
-
-    if timeperiod is not None:
-        rates = filter_rate_qs_by_timeperiod(rates, timeperiod)
-    return rates.only("high").values_list("high", flat=True)
+    return _rate_values(stock, spec, "high")
 
 
 @ensure_ndarray(array_dtype=float)
 def LOW_VALUES(stock: Stock, /, spec: FunctionSpec) -> typing.List[float]:
     """Returns a list containing `low` values of a stock rate"""
-    rates = stock.rates
-    timeperiod = spec.kwargs.get("timeperiod", None)
-
-    if timeperiod is not None:
-        rates = filter_rate_qs_by_timeperiod(rates, timeperiod)
-    return rates.only("low").values_list("low", flat=True)
+    return _rate_values(stock, spec, "low")
 
 
 @ensure_ndarray(array_dtype=float)
 def CLOSE_VALUES(stock: Stock, /, spec: FunctionSpec) -> typing.List[float]:
     """Returns a list containing `close` values of a stock rate"""
-    rates = stock.rates
-    timeperiod = spec.kwargs.get("timeperiod", None)
-
-    if timeperiod is not None:
-        rates = filter_rate_qs_by_timeperiod(rates, timeperiod)
-    return rates.only("close").values_list("close", flat=True)
+    return _rate_values(stock, spec, "close")
 
 
 @ensure_ndarray(array_dtype=float)
 def VOLUME_VALUES(stock: Stock, /, spec: FunctionSpec) -> typing.List[float]:
     """Returns a list containing `volume` values of a stock rate"""
-    rates = stock.rates
-    timeperiod = spec.kwargs.get("timeperiod", None)
+    return _rate_values(stock, spec, "volume")
+
 
-    if timeperiod is not None:
-        rates = filter_rate_qs_by_timeperiod(rates, timeperiod)
-    return rates.only("volume").values_list("volume", flat=True)
+@ensure_ndarray(array_dtype=float)
+def DAILY_CLOSE_VALUES(stock: Stock, /, spec: FunctionSpec) -> np.ndarray:
+    """
+    Returns the `close` values of the stock's latest rate on each date (in the current timezone),
+    aligned with `KSE100_CLOSE_VALUES`.
+    """
+    since = get_timeperiod_start_date(spec.kwargs.get("timeperiod", None))
+    closes = np.asarray(get_rate_values(stock, "close", since=since), dtype=float)
+    return closes[latest_on_each_date(get_rate_dates(stock, since=since))]
 
 
 @ensure_ndarray(array_dtype=float)
-def KSE100_CLOSE_VALUES(stock: Stock, /, spec: FunctionSpec) -> typing.List[float]:
-    """Returns a list containing latest `close` values of KSE100 stocks"""
-    kse100_stocks = get_stocks_by_indices(StockIndices.KSE100)
+def KSE100_CLOSE_VALUES(stock: Stock, /, spec: FunctionSpec) -> np.ndarray:
+    """
+    Returns the KSE100 index `close` values on the dates of the stock's rates,
+    aligned with `DAILY_CLOSE_VALUES`.
 
-    latest_close_values = []
-    for kse100_stock in kse100_stocks:
-        try:
-            latest_rate = kse100_stock.rates.only("close", "added_at").latest("added_at")
-        except Rate.DoesNotExist:
-            latest_close_values.append(0.0)
-        else:
-            latest_close_values.append(latest_rate.close)
-    return latest_close_values
+    The index has one close per date, so the stock's rates are taken per date too.
+    Each value is the index close on or before the date, looked up in the
+    (process-wide) KSE100 series, and NaN where there is no such close.
+    """
+    since = get_timeperiod_start_date(spec.kwargs.get("timeperiod", None))
+    dates = np.unique(get_rate_dates(stock, since=since))
+    return get_kse100_series().closes_as_of(dates)
 
 
 ###########
@@ -102,7 +121,8 @@ Low = LOW_VALUES
 Close = CLOSE_VALUES
 Volume = VOLUME_VALUES
 KSE100Close = KSE100_CLOSE_VALUES
+DailyClose = DAILY_CLOSE_VALUES
 
 Real = Close
 Real0 = KSE100Close
-Real1 = Close
+Real1 = DailyClose
@@ -0,0 +1,401 @@
+"""
+Vectorized historical backtest of criteria.
+
+Instead of evaluating a criteria once per date and stock, each distinct function spec
+is evaluated once per stock, over the stock's full daily history, keeping the whole
+TA-LIB output array rather than just its latest value (as `function_evaluators` does).
+Each criterion is then compared at every date at once, giving a (dates x criteria)
+pass/fail matrix per stock, from which the EK score at each date, and the returns
+following each signal (a date on which the EK score reaches a threshold), are derived.
+
+A stock's daily history is its latest rate on each trading date. Indicators are
+evaluated over the full history up to each date (from the criteria's lookback before
+the first backtested date, if any), while live evaluations only see the rates within
+the spec's `timeperiod` (in days), so values of recursive indicators (e.g. EMA), and
+of indicators whose `timeperiod` spans fewer rates than it has days, may differ from
+those of live evaluations at the same date.
+"""
+
+import datetime
+import typing
+import attrs
+import numpy as np
+import talib
+from django.utils import timezone
+
+from apps.stocks.index_series import get_kse100_series
+from apps.stocks.ohlcv import StockOHLCV, latest_on_each_date, load_ohlcv
+from helpers.utils.datetime import activate_timezone
+from .models import RiskProfile
+from . import arg_evaluators as arg_ev
+from .criteria import functions
+from .criteria.criteria import Criteria
+from .criteria.exceptions import FunctionEvaluationError, UnsupportedFunction
+from .stock_profiling import (
+    resolve_stockset,
+    get_criteria_lookback,
+    get_risk_profile_criteria,
+)
+from .vectorized import PRICE_FUNCTIONS, _COMPARISONS
+
+
+DEFAULT_HORIZONS = (1, 5, 20)
+"""Default number of trading days after a signal forward returns are calculated over"""
+
+_SERIES_ARG_EVALUATORS: typing.Dict[
+    typing.Callable, typing.Callable[[StockOHLCV, np.ndarray], np.ndarray]
+] = {
+    arg_ev.OPEN_VALUES: lambda stock, dates: stock.field("open"),
+    arg_ev.HIGH_VALUES: lambda stock, dates: stock.field("high"),
+    arg_ev.LOW_VALUES: lambda stock, dates: stock.field("low"),
+    arg_ev.CLOSE_VALUES: lambda stock, dates: stock.field("close"),
+    arg_ev.VOLUME_VALUES: lambda stock, dates: stock.field("volume"),
+    arg_ev.DAILY_CLOSE_VALUES: lambda stock, dates: stock.field("close"),
+    arg_ev.KSE100_CLOSE_VALUES: (
+        lambda stock, dates: get_kse100_series().closes_as_of(dates)
+    ),
+}
+"""Full history equivalents of argument evaluators"""
+
+
+def daily_history(snapshot: StockOHLCV) -> StockOHLCV:
+    """
+    Returns the daily history of the stock, that is, its latest rate
+    on each date (in the current timezone).
+    """
+    if not len(snapshot):
+        return snapshot
+
+    latest = latest_on_each_date(snapshot.dates())
+    return StockOHLCV(
+        snapshot.pk,
+        snapshot.ticker,
+        snapshot.timestamps[latest],
+        snapshot.values[:, latest],
+    )
+
+
+def evaluate_series(
+    stock: StockOHLCV,
+    spec: functions.FunctionSpec,
+    dates: np.ndarray,
+    *,
+    results: typing.Optional[typing.Dict[typing.Any, typing.Any]] = None,
+) -> np.ndarray:
+    """
+    Evaluate the spec over the full history of the stock.
+
+    :param stock: The stock's (daily) history
+    :param spec: The function spec to evaluate
+    :param dates: The dates of the stock's history
+    :param results: TA-LIB results shared by the outputs of functions with multiple outputs
+    :return: The value of the spec at each date, NaN where it has none
+    :raises UnsupportedFunction: If the function cannot be evaluated over a history
+    :raises FunctionEvaluationError: If the evaluation fails
+    """
+    if spec.name in PRICE_FUNCTIONS:
+        return np.asarray(stock.field(PRICE_FUNCTIONS[spec.name]), dtype=float)
+
+    function_data = functions.FUNCTIONS_REGISTRY.get(spec.name, None)
+    if function_data is None:
+        raise UnsupportedFunction(f"Unsupported function: {spec.name}")
+    evaluator = function_data["evaluator"]
+    arg_evaluators = getattr(evaluator, "arg_evaluators", ())
+    if not arg_evaluators or any(
+        arg_evaluator not in _SERIES_ARG_EVALUATORS for arg_evaluator in arg_evaluators
+    ):
+        raise UnsupportedFunction(f"{spec.name} cannot be backtested")
+
+    kwargs = dict(spec.kwargs)
+    outputs = getattr(evaluator, "outputs", None)
+    output = (kwargs.pop("output", None) or outputs[0]) if outputs else None
+
+    key = (evaluator.__name__, repr(kwargs))
+    if results is None or key not in results:
+        args = [
+            np.asarray(_SERIES_ARG_EVALUATORS[arg_evaluator](stock, dates), dtype=float)
+            for arg_evaluator in arg_evaluators
+        ]
+        try:
+            result = getattr(talib, evaluator.__name__)(*args, **kwargs)
+        except Exception as exc:
+            result = FunctionEvaluationError(exc)
+        if results is not None:
+            results[key] = result
+    else:
+        result = results[key]
+
+    if isinstance(result, FunctionEvaluationError):
+        raise result
+    if isinstance(result, tuple):
+        result = result[outputs.index(output) if outputs else 0]
+    return np.asarray(result, dtype=float)
+
+
+@attrs.define(slots=True)
+class StockBacktest:
+    """Backtest of a criteria on a stock"""
+
+    stock_id: typing.Any
+    ticker: str
+    dates: np.ndarray
+    """Trading dates (`datetime64[D]`), oldest first"""
+    statuses: np.ndarray
+    """(dates x criteria) matrix of the criterion statuses (1 for passed, 0 for failed)"""
+    closes: np.ndarray
+    """Close price at each date"""
+
+    @property
+    def ek_scores(self) -> np.ndarray:
+        """EK score (percentage of the criteria passed) at each date"""
+        if not self.statuses.shape[1]:
+            return np.zeros(len(self.dates), dtype=int)
+        return np.round(self.statuses.mean(axis=1) * 100).astype(int)
+
+    def signals(self, threshold: int = 100) -> np.ndarray:
+        """Returns a boolean array of the dates on which the EK score reached the threshold"""
+        return self.ek_scores >= threshold
+
+    def forward_returns(self, horizon: int) -> np.ndarray:
+        """
+        Returns the percentage return from the close at each date to the close
+        `horizon` trading dates later, NaN where there is no such close.
+        """
+        returns = np.full(len(self.closes), np.nan)
+        if horizon < len(self.closes):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                returns[:-horizon] = (
+                    self.closes[horizon:] / self.closes[:-horizon] - 1
+                ) * 100
+        returns[~np.isfinite(returns)] = np.nan
+        return returns
+
+    def as_dict(
+        self,
+        *,
+        threshold: int = 100,
+        horizons: typing.Iterable[int] = DEFAULT_HORIZONS,
+    ) -> typing.Dict[str, typing.Any]:
+        """
+        Returns the stock's criterion statuses, EK scores, signals
+        and forward returns at each date, as JSON serializable values.
+        """
+        return {
+            "ticker": self.ticker,
+            "dates": [str(date) for date in self.dates],
+            "statuses": self.statuses.tolist(),
+            "ek_scores": self.ek_scores.tolist(),
+            "signals": self.signals(threshold).tolist(),
+            "forward_returns": {
+                str(horizon): [
+                    None if np.isnan(value) else round(float(value), 4)
+                    for value in self.forward_returns(horizon)
+                ]
+                for horizon in horizons
+            },
+        }
+
+
+def backtest_stock(
+    snapshot: StockOHLCV,
+    criteria: Criteria,
+    *,
+    since: typing.Optional[datetime.date] = None,
+    unsupported: typing.Optional[typing.Set[str]] = None,
+) -> StockBacktest:
+    """
+    Backtest the criteria on the stock.
+
+    Criteria with functions that cannot be evaluated over the stock's history,
+    or whose evaluation fails, are failed at every date.
+
+    :param snapshot: The stock's rates
+    :param criteria: The criteria to backtest
+    :param since: If provided, only dates on or after this date are kept.
+        Indicators are still evaluated over the full history.
+    :param unsupported: Collects the names of functions that cannot be backtested
+    """
+    history = daily_history(snapshot)
+    dates = history.dates()
+
+    series: typing.Dict[str, typing.Optional[np.ndarray]] = {}
+    results = {}
+    for criterion in criteria:
+        for spec in (criterion.func1, criterion.func2):
+            key = repr(spec)
+            if key in series:
+                continue
+            try:
+                values = evaluate_series(history, spec, dates, results=results)
+            except UnsupportedFunction:
+                if unsupported is not None:
+                    unsupported.add(spec.name)
+                values = None
+            except FunctionEvaluationError:
+                values = None
+            if values is not None and len(values) != len(dates):
+                values = None
+            series[key] = values
+
+    statuses = np.zeros((len(dates), len(criteria)), dtype=np.int8)
+    for column, criterion in enumerate(criteria):
+        a = series[repr(criterion.func1)]
+        b = series[repr(criterion.func2)]
+        if a is None or b is None:
+            continue
+        with np.errstate(invalid="ignore"):
+            statuses[:, column] = _COMPARISONS[criterion.op](a, b)
+
+    closes = np.asarray(history.field("close"), dtype=float)
+    if since is not None:
+        start = np.searchsorted(dates, np.datetime64(since, "D"), side="left")
+        dates, statuses, closes = dates[start:], statuses[start:], closes[start:]
+    return StockBacktest(snapshot.pk, snapshot.ticker, dates, statuses, closes)
+
+
+@attrs.define(slots=True)
+class Backtest:
+    """Backtest of a criteria on many stocks"""
+
+    criteria: Criteria
+    stocks: typing.List[StockBacktest]
+    unsupported: typing.List[str] = attrs.field(factory=list)
+    """Names of functions that could not be backtested"""
+
+    def summary(
+        self,
+        *,
+        threshold: int = 100,
+        horizons: typing.Iterable[int] = DEFAULT_HORIZONS,
+    ) -> typing.Dict[str, typing.Any]:
+        """
+        Returns the hit rate and returns of the signals, over all stocks.
+
+        A signal hits if the forward return following it is positive.
+
+        :param threshold: The EK score from which a date is a signal
+        :param horizons: Numbers of trading dates forward returns are calculated over
+        """
+        signals = [stock.signals(threshold) for stock in self.stocks]
+        horizon_summaries = {}
+        for horizon in horizons:
+            returns = np.concatenate(
+                [
+                    stock.forward_returns(horizon)[stock_signals]
+                    for stock, stock_signals in zip(self.stocks, signals)
+                ]
+                or [np.array([])]
+            )
+            returns = returns[~np.isnan(returns)]
+            horizon_summaries[str(horizon)] = _returns_summary(returns)
+
+        statuses = [stock.statuses for stock in self.stocks if len(stock.dates)]
+        pass_rates = (
+            np.concatenate(statuses).mean(axis=0) * 100
+            if statuses
+            else np.zeros(len(self.criteria))
+        )
+        return {
+            "stocks": len(self.stocks),
+            "dates": sum(len(stock.dates) for stock in self.stocks),
+            "threshold": threshold,
+            "signals": int(sum(stock_signals.sum() for stock_signals in signals)),
+            "horizons": horizon_summaries,
+            "pass_rates": [
+                {"criterion": str(criterion), "pass_rate": round(float(rate), 2)}
+                for criterion, rate in zip(self.criteria, pass_rates)
+            ],
+            "unsupported": self.unsupported,
+        }
+
+    def ek_score_series(self, *, threshold: int = 100) -> typing.Dict[str, list]:
+        """
+        Returns the mean EK score of the stocks, and their number of signals, at each date.
+
+        :param threshold: The EK score from which a date is a signal
+        """
+        stocks = [stock for stock in self.stocks if len(stock.dates)]
+        if not stocks:
+            return {"dates": [], "mean_ek_scores": [], "signals": []}
+
+        dates = np.unique(np.concatenate([stock.dates for stock in stocks]))
+        totals = np.zeros(len(dates))
+        counts = np.zeros(len(dates))
+        signals = np.zeros(len(dates), dtype=int)
+        for stock in stocks:
+            positions = np.searchsorted(dates, stock.dates)
+            totals[positions] += stock.ek_scores
+            counts[positions] += 1
+            signals[positions] += stock.signals(threshold)
+        return {
+            "dates": [str(date) for date in dates],
+            "mean_ek_scores": np.round(totals / counts, 2).tolist(),
+            "signals": signals.tolist(),
+        }
+
+
+def _returns_summary(returns: np.ndarray) -> typing.Dict[str, typing.Any]:
+    if not len(returns):
+        return {
+            "signals": 0,
+            "hit_rate": None,
+            "mean_return": None,
+            "median_return": None,
+        }
+    return {
+        "signals": int(len(returns)),
+        "hit_rate": round(float((returns > 0).mean() * 100), 2),
+        "mean_return": round(float(returns.mean()), 4),
+        "median_return": round(float(np.median(returns)), 4),
+    }
+
+
+def backtest_criteria(
+    snapshots: typing.Iterable[StockOHLCV],
+    criteria: Criteria,
+    *,
+    since: typing.Optional[datetime.date] = None,
+) -> Backtest:
+    """
+    Backtest the criteria on the stocks, at every date of their histories.
+
+    Should be called with the timezone the dates should be in activated.
+
+    :param snapshots: The stocks' rates
+    :param criteria: The criteria to backtest
+    :param since: If provided, only dates on or after this date are kept
+    """
+    unsupported = set()
+    stocks = [
+        backtest_stock(snapshot, criteria, since=since, unsupported=unsupported)
+        for snapshot in snapshots
+    ]
+    return Backtest(criteria, stocks, sorted(unsupported))
+
+
+def backtest_risk_profile(
+    risk_profile: RiskProfile,
+    stockset: str,
+    *,
+    since: typing.Optional[datetime.date] = None,
+) -> Backtest:
+    """
+    Backtest the risk profile's criteria on the stocks of the stockset,
+    with dates in the risk profile owner's timezone.
+
+    :param risk_profile: The risk profile to backtest
+    :param stockset: The stockset to backtest the profile on
+    :param since: If provided, only dates on or after this date are kept
+    """
+    criteria = get_risk_profile_criteria(risk_profile)
+    stocks = resolve_stockset(stockset, risk_profile)
+    with activate_timezone(risk_profile.owner.timezone):
+        # Dates from `since` only need the rates within the criteria's lookback before it
+        rates_since = None
+        lookback = get_criteria_lookback(criteria)
+        if since is not None and lookback is not None:
+            rates_since = timezone.make_aware(
+                datetime.datetime.combine(since - lookback, datetime.time.min)
+            )
+        snapshots = load_ohlcv(stocks, since=rates_since).values() if stocks else []
+        return backtest_criteria(snapshots, criteria, since=since)
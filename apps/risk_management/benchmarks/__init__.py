@@ -0,0 +1,11 @@
+"""
+Benchmarks of the criteria evaluation engine.
+
+`market` generates deterministic synthetic OHLCV series for a market of stocks,
+either as in-memory (columnar) snapshots or loaded into a (test) database.
+`suite` times the evaluation of every registered evaluator group, and of
+full profile runs over KSE100 and KSE_ALLSHR sized stocksets, and builds
+JSON reports that can be compared across runs.
+
+Run with the `benchmark_criteria` management command.
+"""
@@ -0,0 +1,303 @@
+"""
+Deterministic synthetic market generator.
+
+Each stock's daily closes follow a geometric random walk with its own drift,
+volatility and price level. Within a day, rates are taken as snapshots of the
+day's running OHLCV (as live rates are), along a bridge from the day's open to
+its close. The series of a stock depends only on the seed and the stock's index,
+so markets of different sizes generated with the same seed share their stocks.
+"""
+
+import datetime
+import typing
+import uuid
+import attrs
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from apps.stocks.models import (
+    KSE100Rate,
+    MarketType,
+    Rate,
+    Stock,
+    StockIndices,
+)
+from apps.stocks.helpers import get_trend
+from apps.stocks.ohlcv import OHLCV_FIELDS, StockOHLCV
+
+
+TRADING_DAYS_PER_YEAR = 252
+MARKET_OPEN = datetime.time(9, 30)
+MARKET_CLOSE = datetime.time(15, 30)
+KSE100_SIZE = 100
+"""Number of stocks in the KSE100 index"""
+KSE100_BASE = 40_000.0
+"""Level of the synthetic KSE100 index on its first day"""
+
+
+@attrs.define(slots=True)
+class SyntheticMarket:
+    """A synthetic market, its stocks' rates and its (KSE100) index"""
+
+    seed: int
+    snapshots_per_day: int
+    dates: np.ndarray
+    """Trading dates (`datetime64[D]`), oldest first"""
+    snapshots: typing.List[StockOHLCV]
+    indices: typing.List[typing.List[int]]
+    """Stock indices each stock belongs to, aligned with `snapshots`"""
+    index_values: np.ndarray
+    """Daily OHLCV values of the KSE100 index, aligned with `dates`"""
+
+    @property
+    def bars(self) -> int:
+        """Number of rates of each stock"""
+        return len(self.snapshots[0]) if self.snapshots else 0
+
+    def stockset(self, size: int) -> typing.List[StockOHLCV]:
+        """Returns the snapshots of the first `size` stocks"""
+        return self.snapshots[:size]
+
+
+def synthetic_stock_id(seed: int, index: int) -> uuid.UUID:
+    """Returns the (stable) ID of the synthetic stock at the index"""
+    return uuid.uuid5(uuid.NAMESPACE_URL, f"ekg-global/benchmarks/{seed}/{index}")
+
+
+def trading_dates(
+    years: float, *, end: typing.Optional[datetime.date] = None
+) -> np.ndarray:
+    """
+    Returns the weekdays in the given number of (trading) years, up to `end`.
+
+    :param years: Number of years of trading days
+    :param end: The last date. Defaults to today, in the market's timezone.
+    """
+    end = end or timezone.localdate(timezone=settings.PAKISTAN_TIMEZONE)
+    periods = max(round(years * TRADING_DAYS_PER_YEAR), 1)
+    return pd.bdate_range(end=end, periods=periods).values.astype("datetime64[D]")
+
+
+def snapshot_timestamps(dates: np.ndarray, snapshots_per_day: int) -> np.ndarray:
+    """
+    Returns the (UTC) timestamps, in seconds, of the rate snapshots on each date.
+
+    Snapshots are evenly spread over market hours, in the market's timezone,
+    the last one being taken at the close.
+
+    :return: An int64 array of shape (dates, snapshots_per_day)
+    """
+    open_seconds = MARKET_OPEN.hour * 3600 + MARKET_OPEN.minute * 60
+    close_seconds = MARKET_CLOSE.hour * 3600 + MARKET_CLOSE.minute * 60
+    offsets = np.linspace(
+        close_seconds, open_seconds, snapshots_per_day, endpoint=False
+    )
+    offsets = np.sort(offsets).astype("timedelta64[s]")
+
+    local = dates.astype("datetime64[s]")[:, None] + offsets[None, :]
+    aware = pd.DatetimeIndex(local.ravel()).tz_localize(
+        str(settings.PAKISTAN_TIMEZONE)
+    )
+    seconds = aware.tz_convert("UTC").values.astype("datetime64[s]").astype(np.int64)
+    return seconds.reshape(local.shape)
+
+
+def _generate_stock_values(
+    rng: np.random.Generator, days: int, snapshots_per_day: int
+) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Generate the rates of a stock.
+
+    :return: The (5, days * snapshots_per_day) OHLCV values of the snapshots,
+        and the daily closes
+    """
+    drift = rng.normal(0.0003, 0.0005)
+    volatility = rng.uniform(0.01, 0.04)
+    price = float(np.exp(rng.normal(4.0, 1.0)))
+    volume_level = rng.normal(11.0, 1.5)
+
+    returns = rng.normal(drift - volatility**2 / 2, volatility, days)
+    closes = price * np.exp(np.cumsum(returns))
+    previous_closes = np.concatenate(([price], closes[:-1]))
+    opens = previous_closes * np.exp(rng.normal(0.0, volatility / 4, days))
+
+    # Bridge from each day's open to its close, through the day's snapshots
+    progress = np.arange(1, snapshots_per_day + 1) / snapshots_per_day
+    steps = rng.normal(
+        0.0, volatility / np.sqrt(snapshots_per_day), (days, snapshots_per_day)
+    )
+    walk = np.cumsum(steps, axis=1)
+    bridge = walk - progress * walk[:, -1:]
+    log_open = np.log(opens)[:, None]
+    path = np.exp(log_open + progress * (np.log(closes)[:, None] - log_open) + bridge)
+    path[:, -1] = closes
+
+    path = np.round(path, 2)
+    day_opens = np.round(opens, 2)[:, None]
+    highs = np.maximum.accumulate(np.maximum(path, day_opens), axis=1)
+    lows = np.minimum.accumulate(np.minimum(path, day_opens), axis=1)
+    daily_volumes = np.exp(rng.normal(volume_level, 0.5, days)) * (
+        1 + 20 * np.abs(returns)
+    )
+    volumes = np.round(daily_volumes[:, None] * progress)
+
+    values = np.stack(
+        [
+            np.broadcast_to(day_opens, path.shape),
+            highs,
+            lows,
+            path,
+            volumes,
+        ]
+    ).reshape(len(OHLCV_FIELDS), -1)
+    return values, np.round(closes, 2)
+
+
+def _generate_index_values(daily_closes: np.ndarray) -> np.ndarray:
+    """
+    Generate the daily OHLCV values of an equally weighted index of the stocks.
+
+    :param daily_closes: The (stocks, days) daily closes of the index's stocks
+    """
+    returns = np.diff(np.log(daily_closes), axis=1).mean(axis=0)
+    closes = KSE100_BASE * np.exp(np.concatenate(([0.0], np.cumsum(returns))))
+    opens = np.concatenate(([KSE100_BASE], closes[:-1]))
+    spread = np.abs(closes - opens) * 0.5
+    return np.round(
+        np.stack(
+            [
+                opens,
+                np.maximum(opens, closes) + spread,
+                np.minimum(opens, closes) - spread,
+                closes,
+                np.full(len(closes), 1e8),
+            ]
+        ),
+        2,
+    )
+
+
+def generate_market(
+    stocks: int,
+    *,
+    years: float = 1,
+    snapshots_per_day: int = 1,
+    seed: int = 0,
+    end: typing.Optional[datetime.date] = None,
+) -> SyntheticMarket:
+    """
+    Generate a synthetic market.
+
+    The first `KSE100_SIZE` stocks are in the KSE100 index,
+    and all stocks are in the KSE_ALLSHR index.
+
+    :param stocks: Number of stocks
+    :param years: Number of years of daily rates
+    :param snapshots_per_day: Number of (intraday) rate snapshots per day
+    :param seed: Seed of the generator
+    :param end: The last trading date. Defaults to today, in the market's timezone.
+    """
+    if stocks < 1:
+        raise ValueError("At least one stock is required")
+    if snapshots_per_day < 1:
+        raise ValueError("At least one snapshot per day is required")
+
+    dates = trading_dates(years, end=end)
+    timestamps = snapshot_timestamps(dates, snapshots_per_day).ravel()
+
+    snapshots = []
+    indices = []
+    daily_closes = []
+    for index in range(stocks):
+        rng = np.random.default_rng([seed, index])
+        values, closes = _generate_stock_values(rng, len(dates), snapshots_per_day)
+        snapshots.append(
+            StockOHLCV(
+                synthetic_stock_id(seed, index),
+                f"SYN{index:04d}",
+                timestamps,
+                values,
+            )
+        )
+        if index < KSE100_SIZE:
+            indices.append([StockIndices.KSE100, StockIndices.KSE_ALLSHR])
+            daily_closes.append(closes)
+        else:
+            indices.append([StockIndices.KSE_ALLSHR])
+
+    return SyntheticMarket(
+        seed=seed,
+        snapshots_per_day=snapshots_per_day,
+        dates=dates,
+        snapshots=snapshots,
+        indices=indices,
+        index_values=_generate_index_values(np.array(daily_closes)),
+    )
+
+
+@transaction.atomic
+def load_market(market: SyntheticMarket, *, batch_size: int = 5000) -> None:
+    """
+    Load the synthetic market's stocks, rates and KSE100 rates into the database.
+
+    Only use on a test database, as the market's stocks are saved alongside
+    (and their KSE100 rates in place of) any real ones.
+    """
+    Stock.objects.bulk_create(
+        [
+            Stock(
+                id=snapshot.pk,
+                ticker=snapshot.ticker,
+                title=f"Synthetic stock {snapshot.ticker}",
+                indices=[int(index) for index in stock_indices],
+            )
+            for snapshot, stock_indices in zip(market.snapshots, market.indices)
+        ],
+        batch_size=batch_size,
+    )
+
+    for snapshot in market.snapshots:
+        closes = snapshot.field("close")
+        # The close of each day's last snapshot is the close of the day
+        day_closes = closes[market.snapshots_per_day - 1 :: market.snapshots_per_day]
+        previous_closes = np.repeat(
+            np.concatenate((snapshot.field("open")[:1], day_closes[:-1])),
+            market.snapshots_per_day,
+        )
+        Rate.objects.bulk_create(
+            (
+                Rate(
+                    stock_id=snapshot.pk,
+                    market=MarketType.REGULAR,
+                    previous_close=float(previous_close),
+                    open=float(open_),
+                    high=float(high),
+                    low=float(low),
+                    close=float(close),
+                    volume=float(volume),
+                    trend=get_trend(float(previous_close), float(close)),
+                    added_at=datetime.datetime.fromtimestamp(
+                        int(timestamp), tz=datetime.timezone.utc
+                    ),
+                )
+                for timestamp, previous_close, (open_, high, low, close, volume) in zip(
+                    snapshot.timestamps, previous_closes, snapshot.values.T
+                )
+            ),
+            batch_size=batch_size,
+        )
+
+    KSE100Rate.objects.all().delete()
+    KSE100Rate.objects.bulk_create(
+        [
+            KSE100Rate(
+                date=date.item(),
+                **dict(zip(OHLCV_FIELDS, map(float, values))),
+            )
+            for date, values in zip(market.dates, market.index_values.T)
+        ],
+        batch_size=batch_size,
+    )
@@ -0,0 +1,337 @@
+"""
+Benchmarks of evaluator groups and full profile runs, and their JSON reports.
+
+Evaluator group benchmarks evaluate each registered function of a group, with its
+default keyword arguments, on every stock through `functions.evaluate`, that is,
+straight through TA-LIB. Profile benchmarks generate the profile of a criteria
+made of every benchmarked function, as risk profile generation does, but with
+the shared caches bypassed (see `criteria.profiling`), so every run does the same work.
+"""
+
+import platform
+import statistics
+import time
+import typing
+import django
+import numpy as np
+import talib
+from django.conf import settings
+from django.utils import timezone
+
+from apps.accounts.models import UserAccount
+from apps.stocks.ohlcv import StockOHLCV, load_ohlcv
+from apps.risk_management.models import RiskProfile
+from apps.risk_management.criteria import functions
+from apps.risk_management.criteria.criteria import Criteria, load_criteria_from_list
+from apps.risk_management.criteria.profiling import EvaluationProfiler, profiling
+from apps.risk_management.function_evaluators import EVALUATOR_GROUPS
+from apps.risk_management.stock_profiling import (
+    generate_stock_profiles,
+    get_rates_since,
+    resolve_stockset,
+)
+from .market import SyntheticMarket
+
+
+REPORT_VERSION = 1
+
+STOCKSET_SIZES = {
+    "kse100": 100,
+    "kse_allshr": 571,
+}
+"""Number of stocks in the stocksets full profile runs are benchmarked on"""
+
+PROFILE_TOP_FUNCTIONS = 10
+"""Number of slowest functions reported for each profile benchmark"""
+
+
+def timing_stats(timings: typing.Sequence[float]) -> typing.Dict[str, float]:
+    """Returns statistics of the timings (in seconds) of repeated runs"""
+    return {
+        "repeat": len(timings),
+        "min": round(min(timings), 6),
+        "median": round(statistics.median(timings), 6),
+        "mean": round(statistics.fmean(timings), 6),
+        "max": round(max(timings), 6),
+    }
+
+
+def default_kwargs(name: str) -> typing.Dict[str, typing.Any]:
+    """Returns the default keyword arguments of the registered function"""
+    schema = functions.generate_function_schema(name)["kwargs"]
+    if not schema:
+        return {}
+    return {
+        argument: argument_schema["default"]
+        for argument, argument_schema in schema["arguments"].items()
+    }
+
+
+def get_benchmark_specs(
+    groups: typing.Iterable[str] = EVALUATOR_GROUPS,
+) -> typing.Tuple[
+    typing.Dict[str, typing.List[functions.FunctionSpec]], typing.Dict[str, str]
+]:
+    """
+    Returns the specs of the registered functions of each group,
+    with their default keyword arguments.
+
+    :return: The specs by group, and the reason each function whose spec
+        could not be made is skipped, by function name
+    """
+    groups = list(groups)
+    specs = {group: [] for group in groups}
+    skipped = {}
+    for name, function_data in sorted(functions.FUNCTIONS_REGISTRY.items()):
+        group = function_data["group"]
+        if group not in specs:
+            continue
+        try:
+            spec = functions.make_function_spec(name, **default_kwargs(name))
+        except Exception as exc:
+            skipped[name] = str(exc)
+        else:
+            specs[group].append(spec)
+    return specs, skipped
+
+
+def benchmark_evaluator_groups(
+    snapshots: typing.Sequence[StockOHLCV],
+    specs: typing.Dict[str, typing.List[functions.FunctionSpec]],
+    *,
+    repeat: int = 3,
+) -> typing.Dict[str, typing.Any]:
+    """
+    Time the evaluation of each group's functions on every stock.
+
+    :param snapshots: The stocks to evaluate the functions on
+    :param specs: The specs of each group's functions. See `get_benchmark_specs`.
+    :param repeat: Number of times each group is evaluated
+    :return: Timings of each group, and of each of its functions (median, in seconds)
+    """
+    results = {}
+    for group, group_specs in specs.items():
+        function_timings = {spec.name: [] for spec in group_specs}
+        group_timings = []
+        for _ in range(repeat):
+            group_time = 0.0
+            for spec in group_specs:
+                start = time.perf_counter()
+                for snapshot in snapshots:
+                    functions.evaluate(snapshot, spec)
+                elapsed = time.perf_counter() - start
+                function_timings[spec.name].append(elapsed)
+                group_time += elapsed
+            group_timings.append(group_time)
+
+        evaluations = len(group_specs) * len(snapshots)
+        result = {"functions": len(group_specs), "evaluations": evaluations}
+        if group_specs and snapshots:
+            result["wall_time"] = timing_stats(group_timings)
+            result["per_evaluation_us"] = round(
+                statistics.median(group_timings) / evaluations * 1e6, 3
+            )
+            result["function_wall_times"] = {
+                name: round(statistics.median(timings), 6)
+                for name, timings in function_timings.items()
+            }
+        results[group] = result
+    return results
+
+
+def make_benchmark_criteria(
+    specs: typing.Dict[str, typing.List[functions.FunctionSpec]],
+) -> Criteria:
+    """Returns a criteria comparing every benchmarked function to the close price"""
+    return load_criteria_from_list(
+        [
+            {
+                "func1": {"name": spec.name, "kwargs": spec.kwargs},
+                "op": ">",
+                "func2": {"name": "CLOSE", "kwargs": {}},
+            }
+            for group_specs in specs.values()
+            for spec in group_specs
+        ]
+    )
+
+
+def make_benchmark_risk_profile() -> RiskProfile:
+    """Returns an unsaved risk profile, of an unsaved user in the market's timezone"""
+    owner = UserAccount(timezone=settings.PAKISTAN_TIMEZONE)
+    return RiskProfile(owner=owner, name="Benchmark", criteria=[])
+
+
+def benchmark_profile(
+    snapshots: typing.Optional[typing.Sequence[StockOHLCV]],
+    criteria: Criteria,
+    *,
+    stockset: typing.Optional[str] = None,
+    repeat: int = 3,
+    max_workers: typing.Optional[int] = None,
+) -> typing.Dict[str, typing.Any]:
+    """
+    Time full profile runs of the criteria on the stocks.
+
+    Profiles are generated in threads (see `stock_profiling.generate_stock_profiles`),
+    with function evaluations profiled and the shared caches bypassed.
+
+    :param snapshots: The stocks to generate the profile of. If not provided,
+        the stocks of the stockset are loaded from the database on each run.
+    :param criteria: The criteria to evaluate
+    :param stockset: The stockset to load the stocks of, if `snapshots` is not provided
+    :param repeat: Number of runs
+    :param max_workers: Number of threads.
+        Defaults to `settings.RISK_PROFILE_GENERATION_WORKERS`.
+    :return: Timings of the runs, and the slowest functions of the last run
+    """
+    risk_profile = make_benchmark_risk_profile()
+    load_timings = []
+    timings = []
+    stocks = 0
+    profiler = None
+    for _ in range(repeat):
+        profiler = EvaluationProfiler(use_cache=False)
+        start = time.perf_counter()
+        run_snapshots = snapshots
+        if run_snapshots is None:
+            run_snapshots = list(
+                load_ohlcv(
+                    resolve_stockset(stockset, risk_profile),
+                    since=get_rates_since(risk_profile, criteria),
+                ).values()
+            )
+            load_timings.append(time.perf_counter() - start)
+            start = time.perf_counter()
+
+        with profiling(profiler):
+            profiles = list(
+                generate_stock_profiles(
+                    run_snapshots,
+                    criteria,
+                    risk_profile,
+                    executor="thread",
+                    max_workers=max_workers,
+                )
+            )
+        timings.append(time.perf_counter() - start)
+        stocks = len(profiles)
+
+    result = {
+        "stocks": stocks,
+        "criteria": len(criteria),
+        "wall_time": timing_stats(timings),
+    }
+    if load_timings:
+        result["load_wall_time"] = timing_stats(load_timings)
+    if profiler is not None:
+        summary = profiler.summary()
+        result["slowest_functions"] = dict(
+            list(summary["functions"].items())[:PROFILE_TOP_FUNCTIONS]
+        )
+    return result
+
+
+def run_benchmarks(
+    market: SyntheticMarket,
+    *,
+    groups: typing.Iterable[str] = EVALUATOR_GROUPS,
+    repeat: int = 3,
+    profiles: bool = True,
+    from_database: bool = False,
+    max_workers: typing.Optional[int] = None,
+) -> typing.Dict[str, typing.Any]:
+    """
+    Run the benchmarks on the synthetic market, and return their report.
+
+    :param market: The synthetic market to run the benchmarks on
+    :param groups: The evaluator groups to benchmark
+    :param repeat: Number of times each benchmark is run
+    :param profiles: Whether to benchmark full profile runs
+    :param from_database: Whether profile runs load the stocks from the database
+        (see `market.load_market`), instead of using the market's snapshots
+    :param max_workers: Number of threads profile runs are generated in
+    """
+    specs, skipped = get_benchmark_specs(groups)
+    with timezone.override(settings.PAKISTAN_TIMEZONE):
+        group_results = benchmark_evaluator_groups(
+            market.stockset(STOCKSET_SIZES["kse100"]), specs, repeat=repeat
+        )
+
+    profile_results = {}
+    if profiles:
+        criteria = make_benchmark_criteria(specs)
+        for stockset, size in STOCKSET_SIZES.items():
+            if size > len(market.snapshots):
+                continue
+            profile_results[stockset] = benchmark_profile(
+                None if from_database else market.stockset(size),
+                criteria,
+                stockset=stockset,
+                repeat=repeat,
+                max_workers=max_workers,
+            )
+
+    return {
+        "version": REPORT_VERSION,
+        "meta": {
+            "created_at": timezone.now().isoformat(),
+            "seed": market.seed,
+            "stocks": len(market.snapshots),
+            "trading_days": len(market.dates),
+            "snapshots_per_day": market.snapshots_per_day,
+            "bars_per_stock": market.bars,
+            "end_date": str(market.dates[-1]) if len(market.dates) else None,
+            "source": "database" if from_database else "memory",
+            "repeat": repeat,
+            "versions": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "numpy": np.__version__,
+                "talib": talib.__version__,
+            },
+        },
+        "groups": group_results,
+        "profiles": profile_results,
+        "skipped": skipped,
+    }
+
+
+def _median_wall_times(report: typing.Dict[str, typing.Any]) -> typing.Dict[str, float]:
+    """Returns the median wall time of each benchmark in the report, by name"""
+    wall_times = {}
+    for group, result in report.get("groups", {}).items():
+        if "wall_time" in result:
+            wall_times[f"groups/{group}"] = result["wall_time"]["median"]
+    for stockset, result in report.get("profiles", {}).items():
+        wall_times[f"profiles/{stockset}"] = result["wall_time"]["median"]
+    return wall_times
+
+
+def compare_reports(
+    before: typing.Dict[str, typing.Any], after: typing.Dict[str, typing.Any]
+) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    """
+    Compare the median wall times of the benchmarks in both reports.
+
+    :param before: The report of the baseline run
+    :param after: The report of the run to compare to the baseline
+    :return: The median wall times before and after, and the change (%),
+        of each benchmark in both reports
+    """
+    before_times = _median_wall_times(before)
+    after_times = _median_wall_times(after)
+    comparison = {}
+    for name, before_time in before_times.items():
+        if name not in after_times:
+            continue
+        after_time = after_times[name]
+        change = None
+        if before_time:
+            change = round((after_time - before_time) / before_time * 100, 2)
+        comparison[name] = {
+            "before": before_time,
+            "after": after_time,
+            "change (%)": change,
+        }
+    return comparison
@@ -209,7 +209,12 @@ def update_criterion(criterion: Criterion, **kwds) -> Criterion:
 
 
 def evaluate_criterion(
-    o: T, /, criterion: Criterion, *, ignore_unsupported_func: bool = False
+    o: T,
+    /,
+    criterion: Criterion,
+    *,
+    ignore_unsupported_func: bool = False,
+    evaluate: typing.Callable[[T, FunctionSpec], typing.Any] = evaluate_function,
 ):
     """
     Run a criterion evaluation on an object
@@ -219,11 +224,13 @@ def evaluate_criterion(
     :param ignore_unsupported_func: If True, an exception will not be raised
         if any function in the criterion is not supported.
         The criterion will be evaluated as failed
+    :param evaluate: The function used to evaluate the criterion's function specs on the object.
+        Defaults to `functions.evaluate`. Can be replaced to add caching, profiling, etc.
     :return: The status of the criterion evaluation
     """
     try:
-        a = evaluate_function(o, criterion.func1)
-        b = evaluate_function(o, criterion.func2)
+        a = evaluate(o, criterion.func1)
+        b = evaluate(o, criterion.func2)
     except UnsupportedFunction:
         if ignore_unsupported_func:
             return CriterionStatus.FAILED
@@ -272,7 +279,12 @@ def evaluate_criterion(
 
 # @timeit
 def evaluate_criteria(
-    o: T, /, criteria: Criteria, *, ignore_unsupported_func: bool = False
+    o: T,
+    /,
+    criteria: Criteria,
+    *,
+    ignore_unsupported_func: bool = False,
+    evaluate: typing.Callable[[T, FunctionSpec], typing.Any] = evaluate_function,
 ) -> typing.Dict[str, CriterionStatus]:
     """
     Run multiple criterion evaluations on an object.
@@ -282,6 +294,8 @@ def evaluate_criteria(
     :param criteria: The criteria containing the criterions to evaluate
     :param ignore_unsupported_func: If True, an exception will not be raised if any
         function in a criterion is not supported. The criterion will be evaluated as failed
+    :param evaluate: The function used to evaluate the criterions' function specs on the object.
+        Defaults to `functions.evaluate`.
     :return: A dictionary of the criterion and their evaluation status
     """
     if not criteria:
@@ -290,7 +304,10 @@ def evaluate_criteria(
     statuses = []
     for criterion in criteria:
         status = evaluate_criterion(
-            o, criterion, ignore_unsupported_func=ignore_unsupported_func
+            o,
+            criterion,
+            ignore_unsupported_func=ignore_unsupported_func,
+            evaluate=evaluate,
         )
         statuses.append(status)
 
@@ -15,6 +15,7 @@ from .exceptions import (
     FunctionEvaluationError,
 )
 from .kwargs_schemas import BaseKwargsSchema, kwargs_schema_to_json_schema
+from .profiling import profiled_function, profiled_arg_evaluator
 from . import converter, type_cast
 
 
@@ -71,17 +72,74 @@ class _FunctionData(typing.TypedDict):
 
 FUNCTIONS_REGISTRY: typing.Dict[_FunctionName, _FunctionData] = {}
 
+MAX_INTERNED_FUNCTION_SPECS = 4096
+"""Maximum number of function specs kept in the interning cache"""
+_interned_function_specs: typing.Dict[typing.Hashable, FunctionSpec] = {}
+
+
+def _freeze(value: typing.Any) -> typing.Hashable:
+    """Returns a hashable equivalent of the (keyword argument) value"""
+    if isinstance(value, typing.Mapping):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return (type(value).__name__, tuple(_freeze(item) for item in value))
+    hash(value)
+    return value
+
+
+def _function_spec_key(
+    name: str, kwargs: typing.Mapping[str, typing.Any]
+) -> typing.Optional[typing.Hashable]:
+    try:
+        return (name, _freeze(kwargs))
+    except TypeError:
+        # Unhashable keyword argument values cannot be interned
+        return None
+
+
+def intern_function_spec(spec: FunctionSpec) -> FunctionSpec:
+    """
+    Returns the interned function spec equal to the given spec,
+    interning the spec if there is none yet.
+
+    Interned specs are shared, so they (and their kwargs) must not be modified.
+    """
+    key = _function_spec_key(spec.name, spec.kwargs)
+    if key is None:
+        return spec
+
+    interned = _interned_function_specs.get(key, None)
+    if interned is None:
+        if len(_interned_function_specs) >= MAX_INTERNED_FUNCTION_SPECS:
+            _interned_function_specs.clear()
+        interned = _interned_function_specs.setdefault(key, spec)
+    return interned
+
 
 def make_function_spec(name: str, **kwargs) -> FunctionSpec:
     """
     Helper function to create a TA-LIB function specification
 
+    Validated specs are interned, so creating a spec with the same
+    name and keyword arguments again skips validation.
+
     :param name: The name or alias of the function
     :param kwargs: Keyword arguments for the TA-LIB function.
         These should match the schema of the function's `kwargs_schema`
         in the functions registry
     :return: A new function specification
     """
+    key = _function_spec_key(name, kwargs)
+    if key is not None and key in _interned_function_specs:
+        return _interned_function_specs[key]
+
+    spec = intern_function_spec(_make_function_spec(name, **kwargs))
+    if key is not None:
+        _interned_function_specs[key] = spec
+    return spec
+
+
+def _make_function_spec(name: str, **kwargs) -> FunctionSpec:
     if name not in FUNCTIONS_REGISTRY:
         raise UnsupportedFunction(f"Unsupported function: {name}")
 
@@ -229,7 +287,8 @@ def ensure_ndarray(
 
         @functools.wraps(arg_evaluator)
         def _wrapper(*args, **kwargs) -> np.ndarray[typing.Type[_dtype]]:
-            result = arg_evaluator(*args, **kwargs)
+            with profiled_arg_evaluator(arg_evaluator.__name__):
+                result = arg_evaluator(*args, **kwargs)
 
             if not isinstance(result, np.ndarray):
                 result = np.array(list(result), dtype=array_dtype)
@@ -268,9 +327,9 @@ def build_evaluator(
         raise ValueError("At least one argument evaluator is required")
 
     def _evaluator(o: T, /, spec: FunctionSpec) -> SupportsRichComparison:
-        args = [arg_evaluator(o, spec) for arg_evaluator in arg_evaluators]
-
+        # Argument evaluation failures (e.g. missing rates) fail the evaluation too
         try:
+            args = [arg_evaluator(o, spec) for arg_evaluator in arg_evaluators]
             result = getattr(talib, talib_target)(*args, **spec.kwargs)
         except Exception as exc:
             # log_exception(exc)
@@ -281,6 +340,7 @@ def build_evaluator(
         return result
 
     _evaluator.__name__ = talib_target
+    _evaluator.arg_evaluators = tuple(arg_evaluators)
     return _evaluator
 
 
@@ -367,7 +427,8 @@ def evaluate(o: T, /, spec: FunctionSpec) -> _SupportRichComparison:
     """
     try:
         evaluator = FUNCTIONS_REGISTRY[spec.name]["evaluator"]
-        return evaluator(o, spec)
+        with profiled_function(spec.name, o):
+            return evaluator(o, spec)
     except KeyError as exc:
         raise UnsupportedFunction(f"Unsupported function: {spec.name}") from exc
 
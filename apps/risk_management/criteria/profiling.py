@@ -0,0 +1,244 @@
+"""
+Opt-in profiler for function evaluations.
+
+Within `profiling`, evaluations of functions (`functions.evaluate`) and of their
+argument evaluators are measured, and the wall time, number of database queries
+and rows fetched are aggregated per function name and per stock. Outside of it,
+evaluations are not measured at all.
+"""
+
+import collections
+import contextlib
+import contextvars
+import threading
+import time
+import typing
+import attrs
+from django.db import connection
+
+
+@attrs.define(auto_attribs=True, slots=True)
+class EvaluationStats:
+    """Aggregated measurements of evaluations"""
+
+    calls: int = 0
+    wall_time: float = 0.0
+    """Total wall time, in seconds"""
+    queries: int = 0
+    rows: int = 0
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "calls": self.calls,
+            "wall_time": round(self.wall_time, 6),
+            "queries": self.queries,
+            "rows": self.rows,
+        }
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting the queries executed, and the rows they fetched.
+
+    Rows are counted as reported by the database driver (`cursor.rowcount`).
+    Drivers which do not report rows for SELECT queries (e.g. SQLite's) count none.
+    """
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        rowcount = getattr(context["cursor"], "rowcount", -1)
+        if rowcount and rowcount > 0:
+            self.rows += rowcount
+        return result
+
+
+def _stats_dict(
+    stats: typing.Dict[str, EvaluationStats], top: typing.Optional[int] = None
+) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    """Returns the stats as dictionaries, slowest first"""
+    ordered = sorted(stats.items(), key=lambda item: item[1].wall_time, reverse=True)
+    return {name: item.as_dict() for name, item in ordered[:top]}
+
+
+class EvaluationProfiler:
+    """
+    Aggregates measurements of function and argument evaluations.
+
+    Measurements are inclusive, so a function's measurements include those
+    of its argument evaluators, which are also aggregated on their own.
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, *, use_cache: bool = True) -> None:
+        """
+        :param use_cache: Whether cached indicator values, indicator states,
+            criterion statuses and returns may be used. If False, everything
+            is evaluated (and measured) afresh, and nothing is cached.
+        """
+        self.use_cache = use_cache
+        self.functions: typing.DefaultDict[str, EvaluationStats] = (
+            collections.defaultdict(EvaluationStats)
+        )
+        self.arg_evaluators: typing.DefaultDict[str, EvaluationStats] = (
+            collections.defaultdict(EvaluationStats)
+        )
+        self.stocks: typing.DefaultDict[str, EvaluationStats] = (
+            collections.defaultdict(EvaluationStats)
+        )
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(
+        self,
+        targets: typing.Iterable[typing.Tuple[typing.Dict[str, EvaluationStats], str]],
+        *,
+        calls: int = 1,
+    ):
+        """
+        Measure the evaluations within the context.
+
+        :param targets: (stats, key) pairs the measurements are aggregated into
+        :param calls: Number of evaluations the context accounts for
+        """
+        counter = QueryCounter()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(counter):
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                for stats, key in targets:
+                    item = stats[key]
+                    item.calls += calls
+                    item.wall_time += elapsed
+                    item.queries += counter.queries
+                    item.rows += counter.rows
+
+    def measure_function(
+        self, name: str, o: typing.Any = None, *, calls: int = 1
+    ) -> typing.ContextManager:
+        """
+        Measure the evaluation of a function within the context.
+
+        :param name: The name of the function
+        :param o: The object (stock) the function is evaluated on, if evaluated on one
+        :param calls: Number of evaluations the context accounts for
+        """
+        targets = [(self.functions, name)]
+        if o is not None:
+            targets.append((self.stocks, _label(o)))
+        return self.measure(targets, calls=calls)
+
+    def measure_arg_evaluator(self, name: str) -> typing.ContextManager:
+        """Measure the evaluation of an argument evaluator within the context."""
+        return self.measure([(self.arg_evaluators, name)])
+
+    def summary(
+        self, *, top: typing.Optional[int] = None
+    ) -> typing.Dict[str, typing.Any]:
+        """
+        Returns a summary of the measurements, slowest first.
+
+        :param top: Number of slowest stocks to include. Includes all stocks if not provided.
+        """
+        with self._lock:
+            return {
+                "functions": _stats_dict(self.functions),
+                "arg_evaluators": _stats_dict(self.arg_evaluators),
+                "stocks": _stats_dict(self.stocks, top),
+            }
+
+
+def _label(o: typing.Any) -> str:
+    """Returns the label of the object (stock) in profiler summaries"""
+    return str(getattr(o, "ticker", None) or getattr(o, "pk", None) or o)
+
+
+_active_profiler: contextvars.ContextVar[typing.Optional[EvaluationProfiler]] = (
+    contextvars.ContextVar("active_profiler", default=None)
+)
+
+
+def get_profiler() -> typing.Optional[EvaluationProfiler]:
+    """Returns the profiler active in the current context, if any."""
+    return _active_profiler.get()
+
+
+@contextlib.contextmanager
+def profiling(profiler: typing.Optional[EvaluationProfiler] = None):
+    """
+    Profile function evaluations within the context.
+
+    Evaluations in other threads are only profiled if they run in a copy of this context
+    (see `contextvars.copy_context`). Evaluations in other processes are not profiled.
+
+    :param profiler: The profiler to use. A new profiler is used if not provided.
+    :return: The active profiler
+
+    Example:
+    ```python
+    with profiling() as profiler:
+        evaluate_criteria(stock, criteria)
+    print(profiler.summary())
+    ```
+    """
+    profiler = profiler or EvaluationProfiler()
+    token = _active_profiler.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _active_profiler.reset(token)
+
+
+def is_bypassing_cache() -> bool:
+    """Returns True if profiling without the cache in the current context."""
+    profiler = _active_profiler.get()
+    return profiler is not None and not profiler.use_cache
+
+
+def profiled_function(
+    name: str, o: typing.Any = None, *, calls: int = 1
+) -> typing.ContextManager:
+    """
+    Measure the evaluation of a function within the context, if profiling.
+
+    See `EvaluationProfiler.measure_function`.
+    """
+    profiler = _active_profiler.get()
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.measure_function(name, o, calls=calls)
+
+
+def profiled_arg_evaluator(name: str) -> typing.ContextManager:
+    """Measure the evaluation of an argument evaluator within the context, if profiling."""
+    profiler = _active_profiler.get()
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.measure_arg_evaluator(name)
+
+
+def format_summary(summary: typing.Dict[str, typing.Any], *, top: int = 5) -> str:
+    """
+    Format the slowest functions in a profiler summary on a single line
+    (e.g. for a response header), in the `Server-Timing` header syntax.
+
+    Wall times are formatted in milliseconds.
+
+    :param summary: The profiler summary. See `EvaluationProfiler.summary`.
+    :param top: Number of slowest functions to include
+    """
+    entries = []
+    for name, stats in list(summary.get("functions", {}).items())[:top]:
+        token = "".join(char if char.isalnum() else "_" for char in name)
+        entries.append(
+            f"{token};dur={stats['wall_time'] * 1000:.1f};calls={stats['calls']}"
+            f";queries={stats['queries']};rows={stats['rows']}"
+        )
+    return ", ".join(entries)
@@ -6,6 +6,12 @@ from django.utils.itercompat import is_iterable
 from .models import RiskProfile
 from .criteria import converter
 from .criteria.criteria import Criteria, make_criterion
+from .backtest import DEFAULT_HORIZONS
+from .result_sets import (
+    MAX_RESULT_SET_PAGE_SIZE,
+    RESULT_SET_PAGE_SIZE,
+    parse_filter,
+)
 
 
 def criterion_data(data: typing.Iterable[typing.Dict]):
@@ -131,3 +137,68 @@ class RiskProfileUpdateForm(forms.ModelForm):
                     }
                 )
         return cleaned_data
+
+
+class RiskProfileBacktestForm(forms.Form):
+    """Validates the query parameters of a risk profile backtest"""
+
+    stockset = forms.CharField(required=False)
+    threshold = forms.IntegerField(required=False, min_value=0, max_value=100)
+    horizons = forms.CharField(required=False)
+    since = forms.DateField(required=False)
+    stock = forms.CharField(required=False)
+
+    def clean_stockset(self) -> str:
+        return self.cleaned_data.get("stockset") or "kse100"
+
+    def clean_threshold(self) -> int:
+        threshold = self.cleaned_data.get("threshold", None)
+        return 100 if threshold is None else threshold
+
+    def clean_horizons(self) -> typing.Tuple[int, ...]:
+        horizons = self.cleaned_data.get("horizons", None)
+        if not horizons:
+            return DEFAULT_HORIZONS
+        try:
+            horizons = tuple(sorted({int(horizon) for horizon in horizons.split(",")}))
+        except ValueError:
+            raise forms.ValidationError(
+                "Horizons must be comma-separated numbers of trading days"
+            )
+        if horizons[0] < 1:
+            raise forms.ValidationError("Horizons must be positive")
+        return horizons
+
+
+class RiskProfileResultSetForm(forms.Form):
+    """Validates the query parameters of a risk profile result set query"""
+
+    run = forms.CharField(required=False)
+    stockset = forms.CharField(required=False)
+    sort = forms.CharField(required=False)
+    order = forms.ChoiceField(
+        required=False, choices=(("asc", "Ascending"), ("desc", "Descending"))
+    )
+    top = forms.IntegerField(required=False, min_value=1)
+    page = forms.IntegerField(required=False, min_value=1)
+    page_size = forms.IntegerField(
+        required=False, min_value=1, max_value=MAX_RESULT_SET_PAGE_SIZE
+    )
+
+    def clean_stockset(self) -> str:
+        return self.cleaned_data.get("stockset") or "kse100"
+
+    def clean(self) -> typing.Dict[str, typing.Any]:
+        cleaned_data = super().clean()
+        filters = []
+        for expression in self.data.getlist("filter"):
+            try:
+                filters.append(parse_filter(expression))
+            except ValueError as exc:
+                self.add_error(None, forms.ValidationError(str(exc)))
+        cleaned_data["filters"] = filters
+        cleaned_data["page"] = cleaned_data.get("page") or 1
+        cleaned_data["page_size"] = (
+            cleaned_data.get("page_size") or RESULT_SET_PAGE_SIZE
+        )
+        return cleaned_data
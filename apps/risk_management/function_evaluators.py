@@ -1,15 +1,21 @@
 """Collection of TA-LIB function evaluators for use in criteria"""
 
 import typing
+import contextlib
+import contextvars
 import numpy as np
 import functools
 import attrs
+import talib
+from talib import abstract as talib_abstract
 from django.utils.itercompat import is_iterable
 
 from apps.stocks.models import Rate, Stock
+from apps.stocks.ohlcv import StockOHLCV
 
 from .criteria import functions
-from .criteria.kwargs_schemas import KwargsSchema, MergeKwargsSchemas
+from .criteria.kwargs_schemas import BaseKwargsSchema, KwargsSchema, MergeKwargsSchemas
+from .criteria.exceptions import FunctionEvaluationError
 from . import kwargs_schemas as ks
 from . import arg_evaluators as arg_ev
 
@@ -22,21 +28,29 @@ EVALUATOR_GROUPS = (
     "Math Operators",
     "Overlap Studies",
     "Statistic Functions",
+    "Volume Indicators",
+    "Cycle Indicators",
 )
 
 
 _T = typing.TypeVar("_T")
 
 
-def _return_first_value(result: typing.Iterable[_T]) -> _T:
+def _return_latest_value(result: typing.Iterable[_T]) -> _T:
     """
-    Returns only the first value of the result set.
+    Returns only the latest value of the result set.
 
-    Since based on the stock rates data ordering,
-    the latest rate data is always the first element of the result set.
+    Since the arguments passed to TA-LIB functions are ordered chronologically,
+    the latest value is always the last element of the result set.
+    For functions with multiple outputs, the latest value of the first output is returned.
     """
+    if isinstance(result, tuple):
+        if not result:
+            return 0
+        return _return_latest_value(result[0])
+
     if isinstance(result, np.ndarray):
-        if not result.any():
+        if not result.size:
             return 0
     else:
         if not result:
@@ -44,7 +58,7 @@ def _return_first_value(result: typing.Iterable[_T]) -> _T:
 
     if not is_iterable(result):
         return result
-    return _return_first_value(result[0])
+    return _return_latest_value(result[-1])
 
 
 ####################
@@ -52,17 +66,26 @@ def _return_first_value(result: typing.Iterable[_T]) -> _T:
 ####################
 
 
+def _latest_rate_value(stock: typing.Union[Stock, StockOHLCV], field: str):
+    """Returns the value of the field on the stock's latest rate"""
+    if isinstance(stock, StockOHLCV):
+        value = stock.latest(field)
+        return functions.Error() if value is None else value
+
+    try:
+        latest_rate: Rate = stock.rates.only(field, "added_at").latest("added_at")
+    except Rate.DoesNotExist:
+        return functions.Error()
+    return getattr(latest_rate, field)
+
+
 @functions.evaluator(
     alias="OPEN",
     description="The opening price of the latest stock rate.",
     group="Price Indicators",
 )
 def OPEN(stock: Stock, spec: functions.FunctionSpec):
-    try:
-        latest_rate: Rate = stock.rates.latest("added_at")
-    except Rate.DoesNotExist:
-        return functions.Error()
-    return latest_rate.open
+    return _latest_rate_value(stock, "open")
 
 
 @functions.evaluator(
@@ -71,11 +94,7 @@ def OPEN(stock: Stock, spec: functions.FunctionSpec):
     group="Price Indicators",
 )
 def HIGH(stock: Stock, spec: functions.FunctionSpec):
-    try:
-        latest_rate: Rate = stock.rates.latest("added_at")
-    except Rate.DoesNotExist:
-        return functions.Error()
-    return latest_rate.high
+    return _latest_rate_value(stock, "high")
 
 
 @functions.evaluator(
@@ -84,11 +103,7 @@ def HIGH(stock: Stock, spec: functions.FunctionSpec):
     group="Price Indicators",
 )
 def LOW(stock: Stock, spec: functions.FunctionSpec):
-    try:
-        latest_rate: Rate = stock.rates.latest("added_at")
-    except Rate.DoesNotExist:
-        return functions.Error()
-    return latest_rate.low
+    return _latest_rate_value(stock, "low")
 
 
 @functions.evaluator(
@@ -97,11 +112,7 @@ def LOW(stock: Stock, spec: functions.FunctionSpec):
     group="Price Indicators",
 )
 def CLOSE(stock: Stock, spec: functions.FunctionSpec):
-    try:
-        latest_rate: Rate = stock.rates.latest("added_at")
-    except Rate.DoesNotExist:
-        return functions.Error()
-    return latest_rate.close
+    return _latest_rate_value(stock, "close")
 
 
 @functions.evaluator(
@@ -110,22 +121,115 @@ def CLOSE(stock: Stock, spec: functions.FunctionSpec):
     group="Price Indicators",
 )
 def VOLUME(stock: Stock, spec: functions.FunctionSpec):
-    try:
-        latest_rate: Rate = stock.rates.latest("added_at")
-    except Rate.DoesNotExist:
-        return functions.Error()
-    return latest_rate.volume
+    return _latest_rate_value(stock, "volume")
 
 
-# TA-LIB function evaluators built by this builder return only the first result in a result set
+# TA-LIB function evaluators built by this builder return only the latest result in a result set
 build_evaluator = functools.partial(
-    functions.build_evaluator, result_handler=_return_first_value
+    functions.build_evaluator, result_handler=_return_latest_value
 )
 # `functions.new_evaluator` with custom evaluator builder predefined
 new_evaluator = functools.partial(
     functions.new_evaluator, evaluator_builder=build_evaluator
 )
 
+_shared_results: contextvars.ContextVar[typing.Optional[dict]] = (
+    contextvars.ContextVar("shared_results", default=None)
+)
+
+
+@contextlib.contextmanager
+def sharing_results():
+    """
+    Share the results of TA-LIB functions with multiple outputs within the context.
+
+    Each such function is then called once per object and keyword arguments,
+    and the result is shared by all evaluations of the function's outputs.
+    Has no effect if results are already being shared in the current context.
+    """
+    if _shared_results.get() is not None:
+        yield
+        return
+
+    token = _shared_results.set({})
+    try:
+        yield
+    finally:
+        _shared_results.reset(token)
+
+
+def build_multi_output_evaluator(
+    talib_target: str, arg_evaluators: typing.List[typing.Callable]
+) -> functions.FunctionEvaluator:
+    """
+    Builds a TA-LIB function evaluator for a function with multiple outputs.
+
+    The evaluator returns the latest value of the output selected by the spec's
+    `output` keyword argument, or of the first output if none is selected.
+    Within `sharing_results`, the TA-LIB function is called once per object and
+    keyword arguments (other than `output`), for all outputs.
+    """
+    outputs = tuple(talib_abstract.Function(talib_target).output_names)
+
+    def _call(o: typing.Any, spec: functions.FunctionSpec) -> tuple:
+        try:
+            args = [arg_evaluator(o, spec) for arg_evaluator in arg_evaluators]
+            return getattr(talib, talib_target)(*args, **spec.kwargs)
+        except Exception as exc:
+            raise FunctionEvaluationError(exc)
+
+    def _evaluator(o: typing.Any, /, spec: functions.FunctionSpec):
+        kwargs = dict(spec.kwargs)
+        output = kwargs.pop("output", None) or outputs[0]
+        spec = functions.FunctionSpec(spec.name, kwargs)
+
+        results = _shared_results.get()
+        if results is None:
+            return _return_latest_value(_call(o, spec)[outputs.index(output)])
+
+        key = (type(o).__name__, o.pk, repr(spec))
+        if key not in results:
+            try:
+                results[key] = _call(o, spec)
+            except FunctionEvaluationError as exc:
+                results[key] = exc
+
+        result = results[key]
+        if isinstance(result, FunctionEvaluationError):
+            raise result
+        return _return_latest_value(result[outputs.index(output)])
+
+    _evaluator.__name__ = talib_target
+    _evaluator.arg_evaluators = tuple(arg_evaluators)
+    _evaluator.outputs = outputs
+    return _evaluator
+
+
+def new_multi_output_evaluator(
+    talib_target: str,
+    *,
+    kwargs_schema: typing.Optional[typing.Type[BaseKwargsSchema]] = None,
+    **kwargs: typing.Any,
+) -> functions.FunctionEvaluator:
+    """
+    Same as `new_evaluator`, but for TA-LIB functions with multiple outputs.
+
+    The function's kwargs schema is extended with an `output` keyword argument,
+    for selecting the output to return.
+    """
+    outputs = talib_abstract.Function(talib_target).output_names
+    output_schema = ks.Output(*outputs)
+    return new_evaluator(
+        talib_target,
+        kwargs_schema=(
+            MergeKwargsSchemas(kwargs_schema, output_schema)
+            if kwargs_schema
+            else output_schema
+        ),
+        evaluator_builder=build_multi_output_evaluator,
+        **kwargs,
+    )
+
 #########################
 # VOLATILITY INDICATORS #
 #########################
@@ -743,7 +847,7 @@ APO = new_evaluator(
     description="Absolute Price Oscillator: Shows the difference between two moving averages of a security's price.",
 )
 
-AROON = new_evaluator(
+AROON = new_multi_output_evaluator(
     "AROON",
     arg_evaluators=[arg_ev.High, arg_ev.Low],
     kwargs_schema=ks.TimePeriod,
@@ -797,7 +901,7 @@ DX = new_evaluator(
     description="Directional Movement Index: Indicates the strength of a trend by comparing positive and negative movement.",
 )
 
-MACD = new_evaluator(
+MACD = new_multi_output_evaluator(
     "MACD",
     arg_evaluators=[arg_ev.Real],
     kwargs_schema=MergeKwargsSchemas(ks.FastandSlowPeriod, ks.SignalPeriod),
@@ -806,7 +910,7 @@ MACD = new_evaluator(
     description="Moving Average Convergence Divergence: A trend-following momentum indicator that shows the relationship between two moving averages.",
 )
 
-MACDEXT = new_evaluator(
+MACDEXT = new_multi_output_evaluator(
     "MACDEXT",
     arg_evaluators=[arg_ev.Real],
     kwargs_schema=MergeKwargsSchemas(
@@ -817,7 +921,7 @@ MACDEXT = new_evaluator(
     description="MACD with controllable moving average types: A more flexible version of MACD that allows for different types of moving averages.",
 )
 
-MACDFIX = new_evaluator(
+MACDFIX = new_multi_output_evaluator(
     "MACDFIX",
     arg_evaluators=[arg_ev.Real],
     kwargs_schema=ks.SignalPeriod,
@@ -934,7 +1038,7 @@ RSI = new_evaluator(
     description="Relative Strength Index: A momentum oscillator that measures the speed and change of price movements.",
 )
 
-STOCH = new_evaluator(
+STOCH = new_multi_output_evaluator(
     "STOCH",
     arg_evaluators=[arg_ev.High, arg_ev.Low, arg_ev.Close],
     kwargs_schema=MergeKwargsSchemas(
@@ -949,7 +1053,7 @@ STOCH = new_evaluator(
     description="Stochastic Oscillator: Compares a particular closing price to a range of prices over a certain period.",
 )
 
-STOCHF = new_evaluator(
+STOCHF = new_multi_output_evaluator(
     "STOCHF",
     arg_evaluators=[arg_ev.High, arg_ev.Low, arg_ev.Close],
     kwargs_schema=MergeKwargsSchemas(ks.FastK_Period, ks.FastD_Period, ks.FastD_MAType),
@@ -958,7 +1062,7 @@ STOCHF = new_evaluator(
     description="Stochastic Fast: A faster version of the Stochastic Oscillator.",
 )
 
-STOCHRSI = new_evaluator(
+STOCHRSI = new_multi_output_evaluator(
     "STOCHRSI",
     arg_evaluators=[arg_ev.Real],
     kwargs_schema=MergeKwargsSchemas(
@@ -1062,7 +1166,7 @@ MININDEX = new_evaluator(
     group="Math Operators",
 )
 
-MINMAX = new_evaluator(
+MINMAX = new_multi_output_evaluator(
     "MINMAX",
     arg_evaluators=[arg_ev.Real],
     kwargs_schema=ks.TimePeriod,
@@ -1071,7 +1175,7 @@ MINMAX = new_evaluator(
     group="Math Operators",
 )
 
-MINMAXINDEX = new_evaluator(
+MINMAXINDEX = new_multi_output_evaluator(
     "MINMAXINDEX",
     arg_evaluators=[arg_ev.Real],
     kwargs_schema=ks.TimePeriod,
@@ -1198,7 +1302,7 @@ VAR = new_evaluator(
 # OVERLAP STUDIES FUNCTIONS #
 #############################
 
-BBANDS = new_evaluator(
+BBANDS = new_multi_output_evaluator(
     "BBANDS",
     arg_evaluators=[arg_ev.Real],
     kwargs_schema=MergeKwargsSchemas(ks.TimePeriod, ks.NbDevUpAndDown, ks.MAType),
@@ -1252,7 +1356,7 @@ MA = new_evaluator(
     group="Overlap Studies",
 )
 
-MAMA = new_evaluator(
+MAMA = new_multi_output_evaluator(
     "MAMA",
     arg_evaluators=[arg_ev.Real],
     kwargs_schema=ks.FastandSlowLimit,
@@ -1366,3 +1470,40 @@ WMA = new_evaluator(
     description="Weighted Moving Average (gives more weight to recent data)",
     group="Overlap Studies",
 )
+
+
+#####################
+# VOLUME INDICATORS #
+#####################
+
+OBV = new_evaluator(
+    "OBV",
+    arg_evaluators=[arg_ev.Real, arg_ev.Volume],
+    kwargs_schema=None,
+    alias="OBV",
+    description="On Balance Volume (running total of volume, added on up closes and subtracted on down closes)",
+    group="Volume Indicators",
+)
+
+
+####################
+# CYCLE INDICATORS #
+####################
+
+HT_PHASOR = new_multi_output_evaluator(
+    "HT_PHASOR",
+    arg_evaluators=[arg_ev.Real],
+    kwargs_schema=None,
+    alias="HT_PHASOR",
+    description="Hilbert Transform - Phasor Components (in-phase and quadrature components of the price cycle)",
+    group="Cycle Indicators",
+)
+
+HT_SINE = new_multi_output_evaluator(
+    "HT_SINE",
+    arg_evaluators=[arg_ev.Real],
+    kwargs_schema=None,
+    alias="HT_SINE",
+    description="Hilbert Transform - SineWave (sine and lead sine of the dominant price cycle)",
+    group="Cycle Indicators",
+)
@@ -0,0 +1,46 @@
+"""
+Precomputed functions schema.
+
+The functions schema only changes when the functions registry does, that is,
+when the app is (re)started. So it is generated once, when the app is ready,
+serialized, and served as is, with a hash of its content as its ETag.
+"""
+
+import hashlib
+import json
+import typing
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .criteria.functions import generate_functions_schema
+
+
+class FunctionsSchema(typing.NamedTuple):
+    content: bytes
+    """The serialized (JSON) response body holding the grouped functions schema"""
+    etag: str
+    """Hash of the content"""
+
+
+_functions_schema: typing.Optional[FunctionsSchema] = None
+
+
+def load_functions_schema() -> FunctionsSchema:
+    """(Re)generates and serializes the grouped functions schema."""
+    global _functions_schema
+
+    content = json.dumps(
+        {
+            "status": "success",
+            "detail": "Functions schema retrieved successfully",
+            "data": generate_functions_schema(grouped=True),
+        },
+        cls=DjangoJSONEncoder,
+    ).encode()
+    etag = hashlib.md5(content, usedforsecurity=False).hexdigest()
+    _functions_schema = FunctionsSchema(content, etag)
+    return _functions_schema
+
+
+def get_functions_schema() -> FunctionsSchema:
+    """Returns the precomputed functions schema, generating it if it has not been yet."""
+    return _functions_schema or load_functions_schema()
@@ -0,0 +1,550 @@
+"""
+Incremental indicator states.
+
+Recursive and rolling indicators (SMA, EMA, RSI, ATR and OBV) only need a small
+running state (running sums, the last average, Wilder averages, ...) to be updated
+with a new rate in constant time. States are kept per stock and function spec in the
+(Redis) cache, advanced as new rates are ingested, and read during criteria evaluation,
+instead of recomputing the indicators over the stock's rates on every evaluation.
+
+Missing or outdated states are rebuilt with the TA-LIB function, and seeded from its
+outputs, so the values read right after a rebuild are TA-LIB's. States are then advanced
+with TA-LIB's recurrence for the indicator, so advanced values match TA-LIB's up to
+floating point rounding, until the state is next rebuilt.
+"""
+
+import collections
+import datetime
+import hashlib
+import math
+import typing
+import attrs
+import numpy as np
+import pandas as pd
+import talib
+from django.core.cache import cache
+from django.utils import timezone
+
+from apps.stocks.models import Stock, Rate
+from apps.stocks.ohlcv import StockOHLCV, get_rate_values, get_rate_watermark
+from helpers.caching import get_versions
+from .arg_evaluators import get_timeperiod_start_date
+from .criteria import functions
+from .criteria.profiling import is_bypassing_cache, profiled_function
+
+
+INDICATOR_STATE_TIMEOUT = 60 * 60 * 24
+"""How long (in seconds) indicator states are kept, if not advanced or rebuilt"""
+
+MAX_TIMEPERIOD = 100_000
+
+_TRACKED_SPECS_KEY = "indicator_states:tracked"
+"""Cache key of the specs (and timezones) states are kept for"""
+
+
+@attrs.define(slots=True)
+class IndicatorState:
+    """Running state of an indicator on a stock's (chronologically ordered) rates"""
+
+    fields: typing.ClassVar[typing.Tuple[str, ...]] = ("close",)
+    """The rate fields the indicator is evaluated on, in the order TA-LIB expects them"""
+    params: typing.ClassVar[typing.Tuple[str, ...]] = ("timeperiod",)
+    """The function kwargs the state is parameterized by"""
+
+    count: int = 0
+    """Number of rates the state has been updated with"""
+    latest: float = math.nan
+    """The value of the indicator on the latest rate"""
+
+    @classmethod
+    def from_kwargs(cls, kwargs: typing.Mapping[str, typing.Any]) -> "IndicatorState":
+        """Create a new state for a function spec's kwargs"""
+        return cls(**{name: kwargs[name] for name in cls.params if name in kwargs})
+
+    @classmethod
+    def build(
+        cls, kwargs: typing.Mapping[str, typing.Any], *columns: np.ndarray
+    ) -> "IndicatorState":
+        """
+        Build the state for a function spec's kwargs from the values of the `fields` of a stock's rates.
+
+        The state is seeded from TA-LIB's outputs on the values. Until there are enough values
+        for a first output, the (few) values are replayed instead.
+        """
+        state = cls.from_kwargs(kwargs)
+        count = len(columns[0])
+        if count < state.warmup:
+            for values in zip(*(column.tolist() for column in columns)):
+                state.update(*values)
+        else:
+            state.seed(*columns)
+            state.count = count
+        return state
+
+    @property
+    def warmup(self) -> int:
+        """Number of rates the indicator needs for a first output"""
+        return 1
+
+    @property
+    def value(self) -> float:
+        """
+        The latest value, as returned by the TA-LIB function evaluator.
+
+        NaN until there are enough rates for a first output,
+        0 if there are no rates at all (TA-LIB returns an empty result).
+        """
+        if not self.count:
+            return 0
+        return self.latest
+
+    def seed(self, *columns: np.ndarray) -> None:
+        """Set the state from TA-LIB's outputs on the values of the `fields` (at least `warmup` of them)"""
+        raise NotImplementedError
+
+    def update(self, *values: float) -> None:
+        """Update the state with the values of the `fields` of a new rate"""
+        self.count += 1
+        self.latest = self.step(*values)
+
+    def step(self, *values: float) -> float:
+        """Advance the state by one rate and return the indicator's value on it"""
+        raise NotImplementedError
+
+
+@attrs.define(slots=True, frozen=True)
+class _IncrementalIndicator:
+    state_class: typing.Type[IndicatorState]
+    supports: typing.Callable[[typing.Mapping[str, typing.Any]], bool]
+    """Returns True if the state can reproduce the function for the kwargs"""
+
+
+INCREMENTAL_INDICATORS: typing.Dict[str, _IncrementalIndicator] = {}
+
+
+def incremental(
+    name: str,
+    *,
+    supports: typing.Callable[
+        [typing.Mapping[str, typing.Any]], bool
+    ] = lambda kwargs: True,
+):
+    """
+    Register an incremental implementation of a (TA-LIB) function.
+
+    :param name: The name of the function in the functions registry, and in TA-LIB
+    :param supports: Returns True if the implementation can reproduce the function
+        for the given kwargs. Otherwise, the function is left to TA-LIB,
+        for example, to raise on invalid parameters.
+    """
+
+    def _decorator(state_class: typing.Type[IndicatorState]):
+        INCREMENTAL_INDICATORS[name] = _IncrementalIndicator(state_class, supports)
+        return state_class
+
+    return _decorator
+
+
+def _supports_timeperiod(kwargs: typing.Mapping[str, typing.Any]) -> bool:
+    # Period 1 is special-cased (or rejected) by TA-LIB, so leave it to TA-LIB
+    timeperiod = kwargs.get("timeperiod", 2)
+    return (
+        isinstance(timeperiod, (int, float))
+        and timeperiod == int(timeperiod)
+        and 2 <= timeperiod <= MAX_TIMEPERIOD
+    )
+
+
+@incremental("SMA", supports=_supports_timeperiod)
+@attrs.define(slots=True)
+class SMAState(IndicatorState):
+    timeperiod: int = attrs.field(default=30, converter=int)
+    total: float = 0.0
+    """Running sum of the latest `timeperiod - 1` values"""
+    window: typing.Deque[float] = attrs.Factory(collections.deque)
+    """The latest `timeperiod - 1` values"""
+
+    @property
+    def warmup(self) -> int:
+        return self.timeperiod
+
+    def seed(self, close: np.ndarray) -> None:
+        self.latest = float(talib.SMA(close, timeperiod=self.timeperiod)[-1])
+        self.window = collections.deque(
+            close[len(close) - self.timeperiod + 1 :].tolist()
+        )
+        self.total = math.fsum(self.window)
+
+    def step(self, close: float) -> float:
+        self.window.append(close)
+        self.total += close
+        if self.count < self.timeperiod:
+            return math.nan
+
+        value = self.total / self.timeperiod
+        self.total -= self.window.popleft()
+        return value
+
+
+@incremental("EMA", supports=_supports_timeperiod)
+@attrs.define(slots=True)
+class EMAState(IndicatorState):
+    timeperiod: int = attrs.field(default=30, converter=int)
+    total: float = 0.0
+    """Sum of the first `timeperiod` values, whose average seeds the EMA"""
+    ema: float = math.nan
+
+    @property
+    def warmup(self) -> int:
+        return self.timeperiod
+
+    def seed(self, close: np.ndarray) -> None:
+        self.ema = self.latest = float(
+            talib.EMA(close, timeperiod=self.timeperiod)[-1]
+        )
+
+    def step(self, close: float) -> float:
+        if self.count <= self.timeperiod:
+            self.total += close
+            if self.count < self.timeperiod:
+                return math.nan
+            self.ema = self.total / self.timeperiod
+        else:
+            k = 2.0 / (self.timeperiod + 1)
+            self.ema = (close - self.ema) * k + self.ema
+        return self.ema
+
+
+def _wilder_rsi(gain: float, loss: float) -> float:
+    total = gain + loss
+    if -0.00000001 < total < 0.00000001:
+        return 0.0
+    return 100.0 * (gain / total)
+
+
+def _wilder_average(values: np.ndarray, timeperiod: int) -> float:
+    """Returns the latest Wilder average of the values, seeded with the average of the first `timeperiod` values"""
+    seeded = np.concatenate(([values[:timeperiod].mean()], values[timeperiod:]))
+    return float(
+        pd.Series(seeded).ewm(alpha=1 / timeperiod, adjust=False).mean().iloc[-1]
+    )
+
+
+@incremental("RSI", supports=_supports_timeperiod)
+@attrs.define(slots=True)
+class RSIState(IndicatorState):
+    timeperiod: int = attrs.field(default=14, converter=int)
+    previous: float = math.nan
+    gain: float = 0.0
+    """Wilder average of gains (the sum of gains, before the first output)"""
+    loss: float = 0.0
+    """Wilder average of losses (the sum of losses, before the first output)"""
+
+    @property
+    def warmup(self) -> int:
+        return self.timeperiod + 1
+
+    def seed(self, close: np.ndarray) -> None:
+        self.latest = float(talib.RSI(close, timeperiod=self.timeperiod)[-1])
+        # TA-LIB does not output the averages, so compute them the way it does
+        changes = np.diff(close)
+        self.gain = _wilder_average(np.maximum(changes, 0), self.timeperiod)
+        self.loss = _wilder_average(np.maximum(-changes, 0), self.timeperiod)
+        self.previous = float(close[-1])
+
+    def step(self, close: float) -> float:
+        if self.count == 1:
+            self.previous = close
+            return math.nan
+
+        change = close - self.previous
+        self.previous = close
+        if self.count <= self.timeperiod + 1:
+            if change < 0:
+                self.loss -= change
+            else:
+                self.gain += change
+            if self.count <= self.timeperiod:
+                return math.nan
+            self.loss /= self.timeperiod
+            self.gain /= self.timeperiod
+            return _wilder_rsi(self.gain, self.loss)
+
+        if change < 0:
+            self.loss = self.loss * (self.timeperiod - 1) - change
+            self.gain *= self.timeperiod - 1
+        else:
+            self.gain = self.gain * (self.timeperiod - 1) + change
+            self.loss *= self.timeperiod - 1
+        self.loss /= self.timeperiod
+        self.gain /= self.timeperiod
+        return _wilder_rsi(self.gain, self.loss)
+
+
+def _true_range(high: float, low: float, previous_close: float) -> float:
+    greatest = high - low
+    value = abs(previous_close - high)
+    if value > greatest:
+        greatest = value
+    value = abs(previous_close - low)
+    if value > greatest:
+        greatest = value
+    return greatest
+
+
+@incremental("ATR", supports=_supports_timeperiod)
+@attrs.define(slots=True)
+class ATRState(IndicatorState):
+    fields = ("high", "low", "close")
+
+    timeperiod: int = attrs.field(default=14, converter=int)
+    previous_close: float = math.nan
+    total: float = 0.0
+    """Sum of the first `timeperiod` true ranges, whose average seeds the ATR"""
+    atr: float = math.nan
+
+    @property
+    def warmup(self) -> int:
+        return self.timeperiod + 1
+
+    def seed(self, high: np.ndarray, low: np.ndarray, close: np.ndarray) -> None:
+        self.atr = self.latest = float(
+            talib.ATR(high, low, close, timeperiod=self.timeperiod)[-1]
+        )
+        self.previous_close = float(close[-1])
+
+    def step(self, high: float, low: float, close: float) -> float:
+        if self.count == 1:
+            self.previous_close = close
+            return math.nan
+
+        true_range = _true_range(high, low, self.previous_close)
+        self.previous_close = close
+        if self.count <= self.timeperiod + 1:
+            self.total += true_range
+            if self.count <= self.timeperiod:
+                return math.nan
+            self.atr = self.total / self.timeperiod
+            return self.atr
+
+        self.atr = (self.atr * (self.timeperiod - 1) + true_range) / self.timeperiod
+        return self.atr
+
+
+@incremental("OBV")
+@attrs.define(slots=True)
+class OBVState(IndicatorState):
+    fields = ("close", "volume")
+    params = ()
+
+    previous: float = math.nan
+    obv: float = math.nan
+
+    def seed(self, close: np.ndarray, volume: np.ndarray) -> None:
+        self.obv = self.latest = float(talib.OBV(close, volume)[-1])
+        self.previous = float(close[-1])
+
+    def step(self, close: float, volume: float) -> float:
+        if self.count == 1:
+            self.obv = volume
+        elif close > self.previous:
+            self.obv += volume
+        elif close < self.previous:
+            self.obv -= volume
+        self.previous = close
+        return self.obv
+
+
+@attrs.define(slots=True)
+class _StateRecord:
+    """An indicator state, as stored in the cache"""
+
+    state: IndicatorState
+    since: typing.Optional[datetime.date]
+    """Start date of the rates the state covers. None if it covers all of the stock's rates"""
+    watermark: int
+    """Timestamp of the latest rate the state was updated with"""
+    version: int
+    """Version of the stock (its rates) the state was last updated at"""
+
+
+def is_incremental(spec: functions.FunctionSpec) -> bool:
+    """
+    Returns True if the spec can be evaluated from an incremental indicator state.
+
+    No spec is, while profiling without the cache, as states are kept in the cache.
+    """
+    indicator = INCREMENTAL_INDICATORS.get(spec.name, None)
+    return (
+        indicator is not None
+        and not is_bypassing_cache()
+        and indicator.supports(spec.kwargs)
+    )
+
+
+def _spec_suffix(spec: functions.FunctionSpec, tzname: str) -> str:
+    # Specs with a `timeperiod` cover the rates since a date relative to today,
+    # whose bounds depend on the timezone, so keep a state per timezone.
+    digest = hashlib.md5(repr(spec).encode(), usedforsecurity=False).hexdigest()
+    if "timeperiod" in spec.kwargs:
+        return f"{digest}@{tzname}"
+    return digest
+
+
+def _state_key(stock_id: typing.Any, suffix: str) -> str:
+    return f"indicator_states:{stock_id}:{suffix}"
+
+
+def _track_specs(
+    specs: typing.Iterable[functions.FunctionSpec], tzname: str
+) -> None:
+    """Have the states of the specs advanced as new rates are ingested"""
+    tracked = cache.get(_TRACKED_SPECS_KEY, None) or {}
+    untracked = {
+        suffix: (spec.name, dict(spec.kwargs), tzname)
+        for spec in specs
+        if (suffix := _spec_suffix(spec, tzname)) not in tracked
+    }
+    if untracked:
+        tracked.update(untracked)
+        cache.set(_TRACKED_SPECS_KEY, tracked, timeout=INDICATOR_STATE_TIMEOUT)
+
+
+def _build_record(
+    stock: typing.Union[Stock, StockOHLCV],
+    spec: functions.FunctionSpec,
+    since: typing.Optional[datetime.date],
+    version: int,
+) -> _StateRecord:
+    """Build the spec's state from the stock's rates, with TA-LIB"""
+    state_class = INCREMENTAL_INDICATORS[spec.name].state_class
+    columns = [
+        np.asarray(get_rate_values(stock, field, since=since), dtype=float)
+        for field in state_class.fields
+    ]
+    state = state_class.build(spec.kwargs, *columns)
+    return _StateRecord(state, since, get_rate_watermark(stock), version)
+
+
+def evaluate_many(
+    pairs: typing.Sequence[
+        typing.Tuple[typing.Union[Stock, StockOHLCV], functions.FunctionSpec]
+    ],
+) -> typing.List[typing.Any]:
+    """
+    Evaluate each (stock, spec) pair.
+
+    Specs with an incremental implementation are read from the stocks' indicator states,
+    fetched in one round trip. Missing or outdated states are rebuilt from the stocks' rates,
+    with TA-LIB.
+    Other specs are evaluated with `functions.evaluate`.
+
+    :return: The value of each pair
+    """
+    results = [None] * len(pairs)
+    incremental_indices = []
+    for index, (stock, spec) in enumerate(pairs):
+        if is_incremental(spec):
+            incremental_indices.append(index)
+        else:
+            results[index] = functions.evaluate(stock, spec)
+    if not incremental_indices:
+        return results
+
+    tzname = timezone.get_current_timezone_name()
+    keys = {
+        index: _state_key(pairs[index][0].pk, _spec_suffix(pairs[index][1], tzname))
+        for index in incremental_indices
+    }
+    records = cache.get_many(set(keys.values()))
+    stock_ids = list({pairs[index][0].pk for index in incremental_indices})
+    versions = dict(
+        zip(stock_ids, get_versions(*(("stocks.Stock", pk) for pk in stock_ids)))
+    )
+
+    rebuilt = {}
+    for index in incremental_indices:
+        stock, spec = pairs[index]
+        key = keys[index]
+        since = get_timeperiod_start_date(spec.kwargs.get("timeperiod", None))
+        with profiled_function(spec.name, stock):
+            record = rebuilt.get(key, None) or records.get(key, None)
+            if (
+                record is None
+                or record.since != since
+                or record.version != versions[stock.pk]
+                or record.watermark != get_rate_watermark(stock)
+            ):
+                record = _build_record(stock, spec, since, versions[stock.pk])
+                rebuilt[key] = record
+            results[index] = record.state.value
+
+    if rebuilt:
+        cache.set_many(rebuilt, timeout=INDICATOR_STATE_TIMEOUT)
+        _track_specs([pairs[index][1] for index in incremental_indices], tzname)
+    return results
+
+
+def evaluate(
+    stock: typing.Union[Stock, StockOHLCV], /, spec: functions.FunctionSpec
+) -> typing.Any:
+    """Same as `functions.evaluate`, but reads incremental specs from the stock's indicator state"""
+    return evaluate_many([(stock, spec)])[0]
+
+
+def advance_indicator_states(rates: typing.Iterable[Rate]) -> None:
+    """
+    Advance the indicator states of the rates' stocks with the new rates, in constant time per rate.
+
+    Should be called right after new rates are ingested and `invalidate_rates_dependents`
+    is called for them. States that cannot be advanced, because the rates are not newer than
+    the state's latest rate, the stock's rates were otherwise modified, or the state's
+    timeperiod window has moved on, are left as they are, and rebuilt when next read.
+    """
+    tracked = cache.get(_TRACKED_SPECS_KEY, None)
+    if not tracked:
+        return
+
+    stock_rates: typing.Dict[typing.Any, typing.Dict[int, Rate]] = (
+        collections.defaultdict(dict)
+    )
+    for rate in rates:
+        # Rates of the same stock added at the same time are deduplicated, the last one wins
+        stock_rates[rate.stock_id][int(rate.added_at.timestamp())] = rate
+
+    keys = {
+        _state_key(stock_id, suffix): (stock_id, functions.FunctionSpec(name, kwargs))
+        for stock_id in stock_rates
+        for suffix, (name, kwargs, _) in tracked.items()
+    }
+    records = cache.get_many(keys.keys())
+    if not records:
+        return
+
+    stock_ids = list(stock_rates)
+    versions = dict(
+        zip(stock_ids, get_versions(*(("stocks.Stock", pk) for pk in stock_ids)))
+    )
+    advanced = {}
+    for key, record in records.items():
+        stock_id, spec = keys[key]
+        since = get_timeperiod_start_date(spec.kwargs.get("timeperiod", None))
+        new_rates = sorted(stock_rates[stock_id].items())
+        if (
+            record.since != since
+            # The stock's version is bumped once when the new rates are ingested
+            or record.version + 1 != versions[stock_id]
+            or new_rates[0][0] <= record.watermark
+        ):
+            continue
+
+        for _, rate in new_rates:
+            record.state.update(
+                *(float(getattr(rate, field)) for field in record.state.fields)
+            )
+        record.watermark = new_rates[-1][0]
+        record.version = versions[stock_id]
+        advanced[key] = record
+
+    if advanced:
+        cache.set_many(advanced, timeout=INDICATOR_STATE_TIMEOUT)
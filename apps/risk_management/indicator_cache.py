@@ -0,0 +1,164 @@
+"""
+Shared (Redis) cache of indicator values.
+
+Indicator values are cached per stock and function spec, keyed by the stock's
+rate watermark (the timestamp of its latest rate) and rate version. Once newer rates
+are ingested for a stock, its watermark advances, and once its rates are otherwise
+written (e.g. corrected in place, or backfilled), its version is bumped. Either way,
+its previously cached values are no longer looked up, so no explicit invalidation
+is needed. Stale entries simply expire.
+"""
+
+import hashlib
+import typing
+from django.core.cache import cache
+from django.utils import timezone
+
+from apps.stocks.models import Stock
+from apps.stocks.ohlcv import StockOHLCV, get_rate_versions, get_rate_watermark
+from . import arg_evaluators as arg_ev, incremental
+from .criteria import functions
+from .criteria.profiling import is_bypassing_cache
+
+
+INDICATOR_CACHE_TIMEOUT = 60 * 60 * 24
+"""How long (in seconds) cached indicator values are kept"""
+
+_ERROR = "__error__"
+"""Cached in place of `functions.Error` results"""
+
+_MARKET_ARG_EVALUATORS = (arg_ev.KSE100_CLOSE_VALUES,)
+"""Argument evaluators whose values depend on market (index) rates, not just the stock's own"""
+
+
+def is_cacheable(spec: functions.FunctionSpec) -> bool:
+    """
+    Returns True if the value of the spec on a stock depends only on the stock's own rates,
+    and so can be cached by the stock's watermark.
+
+    Nothing is cacheable while profiling without the cache (see `profiling.EvaluationProfiler`).
+    """
+    if is_bypassing_cache():
+        return False
+    function_data = functions.FUNCTIONS_REGISTRY.get(spec.name, None)
+    if function_data is None:
+        return False
+    arg_evaluators = getattr(function_data["evaluator"], "arg_evaluators", ())
+    return not any(
+        arg_evaluator in _MARKET_ARG_EVALUATORS for arg_evaluator in arg_evaluators
+    )
+
+
+def indicator_key(
+    stock_id: typing.Any, spec: functions.FunctionSpec, watermark: int, version: int
+) -> str:
+    """
+    Returns the cache key for the value of the spec on a stock, at the watermark
+    and version of the stock's rates (see `get_rate_versions`).
+
+    Specs with a `timeperiod` are evaluated on the rates since a date relative to today,
+    in the current timezone, so that date and timezone are part of the key.
+    """
+    digest = hashlib.md5(repr(spec).encode(), usedforsecurity=False).hexdigest()
+    key = f"indicators:{stock_id}:{digest}:{watermark}:{version}"
+    since = arg_ev.get_timeperiod_start_date(spec.kwargs.get("timeperiod", None))
+    if since is not None:
+        key = f"{key}:{since.isoformat()}@{timezone.get_current_timezone_name()}"
+    return key
+
+
+def _dump(value: typing.Any) -> typing.Any:
+    if isinstance(value, functions.Error):
+        return _ERROR
+    return value
+
+
+def _load(value: typing.Any) -> typing.Any:
+    if isinstance(value, str) and value == _ERROR:
+        return functions.Error()
+    return value
+
+
+def get_many_indicator_values(
+    stocks: typing.Sequence[typing.Union[Stock, StockOHLCV]],
+    specs: typing.Sequence[functions.FunctionSpec],
+    *,
+    versions: typing.Optional[typing.Mapping[typing.Any, int]] = None,
+) -> typing.Dict[typing.Tuple[int, int], typing.Any]:
+    """
+    Fetch the cached values of the specs on the stocks, in a single round trip.
+
+    :param versions: The stocks' rate versions, by ID (see `get_rate_versions`).
+        Fetched (in another round trip) if not provided.
+    :return: A mapping of (stock index, spec index) to the cached value, for values found in the cache
+    """
+    if not any(is_cacheable(spec) for spec in specs):
+        return {}
+    if versions is None:
+        versions = get_rate_versions(stock.pk for stock in stocks)
+    keys = {}
+    for stock_index, stock in enumerate(stocks):
+        watermark = get_rate_watermark(stock)
+        for spec_index, spec in enumerate(specs):
+            if is_cacheable(spec):
+                key = indicator_key(stock.pk, spec, watermark, versions[stock.pk])
+                keys[key] = (stock_index, spec_index)
+
+    if not keys:
+        return {}
+    found = cache.get_many(keys.keys())
+    return {keys[key]: _load(value) for key, value in found.items()}
+
+
+def set_many_indicator_values(
+    values: typing.Iterable[
+        typing.Tuple[typing.Union[Stock, StockOHLCV], functions.FunctionSpec, typing.Any]
+    ],
+    *,
+    versions: typing.Optional[typing.Mapping[typing.Any, int]] = None,
+) -> None:
+    """
+    Cache the values of specs on stocks, in a single round trip
+
+    :param versions: The stocks' rate versions, by ID (see `get_rate_versions`).
+        Fetched (in another round trip) if not provided.
+    """
+    values = [
+        (stock, spec, value) for stock, spec, value in values if is_cacheable(spec)
+    ]
+    if not values:
+        return
+    if versions is None:
+        versions = get_rate_versions(stock.pk for stock, _, _ in values)
+    mapping = {
+        indicator_key(
+            stock.pk, spec, get_rate_watermark(stock), versions[stock.pk]
+        ): _dump(value)
+        for stock, spec, value in values
+    }
+    if mapping:
+        cache.set_many(mapping, timeout=INDICATOR_CACHE_TIMEOUT)
+
+
+def cached_evaluate(
+    stock: typing.Union[Stock, StockOHLCV], /, spec: functions.FunctionSpec
+) -> typing.Any:
+    """
+    Same as `functions.evaluate`, but returns the cached value of the spec on the stock,
+    if any, and caches the evaluated value otherwise.
+
+    Values are evaluated with `incremental.evaluate`, so indicators with
+    incremental states are read from the stock's state.
+    """
+    if not is_cacheable(spec):
+        return incremental.evaluate(stock, spec)
+
+    version = get_rate_versions([stock.pk])[stock.pk]
+    key = indicator_key(stock.pk, spec, get_rate_watermark(stock), version)
+    value = cache.get(key, None)
+    if value is not None:
+        return _load(value)
+
+    value = incremental.evaluate(stock, spec)
+    cache.set(key, _dump(value), timeout=INDICATOR_CACHE_TIMEOUT)
+    return value
@@ -0,0 +1,248 @@
+"""
+Background (django-q) risk profile generation jobs.
+
+A job evaluates the stocks in a stockset in chunks, each chunk in its own task,
+and stores each stock's profile in the cache as soon as it is generated.
+This allows clients to poll for the rows generated so far, and the job's progress,
+instead of waiting on the whole profile to be generated in a single request.
+"""
+
+import typing
+import uuid
+from django.core.cache import cache
+from django.utils import timezone
+from django_q.tasks import async_task
+
+from apps.stocks.models import Stock
+from apps.stocks.ohlcv import load_ohlcv
+from helpers.logging import log_exception
+from .models import RiskProfile
+from .stock_profiling import (
+    generate_stock_profile,
+    get_rates_since,
+    get_risk_profile_criteria,
+    resolve_stockset,
+)
+
+
+PROFILE_JOB_TIMEOUT = 60 * 60
+"""How long (in seconds) a job's state and results are kept in the cache."""
+PROFILE_JOB_CHUNK_SIZE = 25
+"""Number of stocks evaluated per task."""
+
+
+class ProfileJobStatus:
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    CANCELLED = "cancelled"
+
+
+def _job_key(job_id: str, *parts: typing.Any) -> str:
+    return ":".join(("risk_management", "profile_job", str(job_id), *map(str, parts)))
+
+
+def get_job(job_id: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    """Returns the job's state, or None if the job does not exist or has expired."""
+    return cache.get(_job_key(job_id))
+
+
+def start_profile_job(
+    risk_profile: RiskProfile,
+    stockset: str,
+    *,
+    chunk_size: int = PROFILE_JOB_CHUNK_SIZE,
+) -> typing.Dict[str, typing.Any]:
+    """
+    Start a job that generates the risk profile for the given stockset in the background.
+
+    :param risk_profile: The risk profile to generate
+    :param stockset: The stockset to evaluate the profile against
+    :param chunk_size: Number of stocks evaluated per task
+    :return: The job's state
+    """
+    stocks = resolve_stockset(stockset, risk_profile)
+    stock_ids = [str(stock.pk) for stock in stocks]
+    job_id = uuid.uuid4().hex
+    job = {
+        "id": job_id,
+        "owner_id": risk_profile.owner_id,
+        "risk_profile_id": str(risk_profile.id),
+        "stockset": stockset,
+        "total": len(stock_ids),
+        "created_at": timezone.now().isoformat(),
+    }
+    cache.set_many(
+        {
+            _job_key(job_id): job,
+            _job_key(job_id, "completed"): 0,
+            _job_key(job_id, "failed"): 0,
+        },
+        timeout=PROFILE_JOB_TIMEOUT,
+    )
+
+    for position in range(0, len(stock_ids), chunk_size):
+        async_task(
+            "apps.risk_management.jobs.run_profile_job_chunk",
+            job_id,
+            position,
+            stock_ids[position : position + chunk_size],
+            group=f"profile_job:{job_id}",
+            q_options={"save": False},
+        )
+    return job
+
+
+def cancel_profile_job(job_id: str) -> None:
+    """
+    Cancel the job.
+
+    Stocks that are being evaluated when the job is cancelled still complete,
+    but no further stocks are evaluated.
+    """
+    cache.set(_job_key(job_id, "cancelled"), True, timeout=PROFILE_JOB_TIMEOUT)
+
+
+def is_cancelled(job_id: str) -> bool:
+    return bool(cache.get(_job_key(job_id, "cancelled"), False))
+
+
+def _increment(key: str) -> int:
+    # `incr` raises `ValueError` if the counter has expired or been evicted
+    cache.add(key, 0, timeout=PROFILE_JOB_TIMEOUT)
+    return cache.incr(key)
+
+
+def _record_stock(
+    job_id: str, index: int, stock_profile: typing.Optional[dict] = None
+) -> None:
+    """
+    Record the stock at the index in the stockset as evaluated,
+    with its profile, or as failed if it has none.
+
+    Evaluated stocks are numbered in completion order, and their rows stored under that number,
+    so that pollers can fetch only the rows completed since their last poll (see `get_job_rows`).
+    """
+    sequence = _increment(_job_key(job_id, "completed"))
+    cache.set(
+        _job_key(job_id, "row", sequence),
+        {"position": index, "profile": stock_profile},
+        timeout=PROFILE_JOB_TIMEOUT,
+    )
+    if stock_profile is None:
+        _increment(_job_key(job_id, "failed"))
+
+
+def run_profile_job_chunk(
+    job_id: str, position: int, stock_ids: typing.List[str]
+) -> None:
+    """
+    Generate the profiles of a chunk of the job's stocks.
+
+    Stocks the chunk fails to evaluate (e.g. if the risk profile no longer exists)
+    are recorded as failed, so that the job still completes.
+
+    :param job_id: The ID of the job
+    :param position: The position of the chunk's first stock in the stockset
+    :param stock_ids: The IDs of the stocks in the chunk
+    """
+    job = get_job(job_id)
+    if job is None or is_cancelled(job_id):
+        return
+
+    # Positions of the chunk's stocks that are not recorded yet
+    pending = dict(enumerate(stock_ids, start=position))
+    try:
+        risk_profile = RiskProfile.objects.select_related("owner").get(
+            id=job["risk_profile_id"]
+        )
+        criteria = get_risk_profile_criteria(risk_profile)
+        snapshots = load_ohlcv(
+            Stock.objects.filter(id__in=stock_ids),
+            since=get_rates_since(risk_profile, criteria),
+        )
+
+        for index, stock_id in list(pending.items()):
+            if is_cancelled(job_id):
+                return
+
+            stock = snapshots.get(uuid.UUID(stock_id))
+            try:
+                if stock is None:
+                    raise Stock.DoesNotExist(f"Stock {stock_id} does not exist")
+                stock_profile = generate_stock_profile(stock, criteria, risk_profile)
+            except Exception as exc:
+                log_exception(exc)
+                stock_profile = None
+            _record_stock(job_id, index, stock_profile)
+            del pending[index]
+    finally:
+        if pending and not is_cancelled(job_id):
+            for index in pending:
+                _record_stock(job_id, index)
+
+
+def get_job_progress(job: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    """Returns the status and progress of the job."""
+    job_id = job["id"]
+    counters = cache.get_many(
+        [
+            _job_key(job_id, "completed"),
+            _job_key(job_id, "failed"),
+            _job_key(job_id, "cancelled"),
+        ]
+    )
+    completed = counters.get(_job_key(job_id, "completed"), 0)
+    failed = counters.get(_job_key(job_id, "failed"), 0)
+    total = job["total"]
+
+    if completed >= total:
+        status = ProfileJobStatus.COMPLETED
+    elif counters.get(_job_key(job_id, "cancelled"), False):
+        status = ProfileJobStatus.CANCELLED
+    elif completed:
+        status = ProfileJobStatus.RUNNING
+    else:
+        status = ProfileJobStatus.PENDING
+
+    return {
+        "status": status,
+        "total": total,
+        "completed": completed,
+        "failed": failed,
+        "percentage": round((completed / total) * 100) if total else 100,
+    }
+
+
+def get_job_rows(
+    job: typing.Dict[str, typing.Any], *, since: int = 0
+) -> typing.Tuple[typing.List[typing.Dict[str, typing.Any]], int]:
+    """
+    Returns the stock profiles generated by the job since the given cursor,
+    in the stockset's order, and the cursor to fetch the next rows from.
+
+    Rows are returned in completion order up to the first row that is not stored yet
+    (its stock's evaluation is being recorded), so that no row is skipped by the next poll.
+
+    :param job: The job
+    :param since: The cursor returned by the previous call. 0 to fetch all rows generated so far.
+    """
+    job_id = job["id"]
+    completed = cache.get(_job_key(job_id, "completed"), 0)
+    keys = [
+        _job_key(job_id, "row", sequence)
+        for sequence in range(since + 1, completed + 1)
+    ]
+    records = cache.get_many(keys)
+
+    cursor = since
+    rows = []
+    for key in keys:
+        record = records.get(key, None)
+        if record is None:
+            break
+        cursor += 1
+        if record["profile"] is not None:
+            rows.append(record)
+    rows.sort(key=lambda record: record["position"])
+    return [record["profile"] for record in rows], cursor
@@ -10,7 +10,7 @@ import typing
 import attrs
 import numpy as np
 
-from .criteria.kwargs_schemas import KwargsSchema
+from .criteria.kwargs_schemas import BaseKwargsSchema, KwargsSchema
 
 
 TimePeriod = KwargsSchema(
@@ -133,8 +133,8 @@ NbDevUpAndDown = KwargsSchema(
 FastandSlowLimit = KwargsSchema(
     "FastandSlowLimit",
     {
-        "fastlimit": attrs.field(type=int, default=0),
-        "slowlimit": attrs.field(type=int, default=0),
+        "fastlimit": attrs.field(type=float, default=0.5),
+        "slowlimit": attrs.field(type=float, default=0.05),
     },
 )
 
@@ -168,6 +168,28 @@ VFactor = KwargsSchema(
 )
 
 
+def Output(*outputs: str) -> typing.Type[BaseKwargsSchema]:
+    """
+    Make a schema for selecting which output of a TA-LIB function
+    with multiple outputs is returned. Defaults to the first output.
+
+    :param outputs: Names of the function's outputs, in the order TA-LIB returns them
+    """
+    return KwargsSchema(
+        "Output",
+        {
+            "output": attrs.field(
+                type=str,
+                default=outputs[0],
+                validator=attrs.validators.optional(attrs.validators.in_(outputs)),
+                metadata={
+                    "description": f"The output to return. One of: {', '.join(outputs)}"
+                },
+            ),
+        },
+    )
+
+
 def punctuated_string_to_list(value: str, punctuator: str = ",") -> typing.List[str]:
     """Converts a punctuated string to a list of strings"""
     return value.split(punctuator)
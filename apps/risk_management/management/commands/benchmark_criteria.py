@@ -0,0 +1,159 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.risk_management.function_evaluators import EVALUATOR_GROUPS
+from apps.risk_management.benchmarks.market import generate_market, load_market
+from apps.risk_management.benchmarks.suite import (
+    STOCKSET_SIZES,
+    compare_reports,
+    run_benchmarks,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the criteria evaluation engine on a synthetic market, "
+        "and write a JSON report that can be compared across runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stocks",
+            type=int,
+            default=max(STOCKSET_SIZES.values()),
+            help="Number of stocks in the synthetic market.",
+        )
+        parser.add_argument(
+            "--years",
+            type=float,
+            default=1,
+            help="Number of years of daily rates per stock.",
+        )
+        parser.add_argument(
+            "--snapshots-per-day",
+            type=int,
+            default=1,
+            help="Number of (intraday) rate snapshots per day.",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the market generator."
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Number of times each benchmark is run.",
+        )
+        parser.add_argument(
+            "--groups",
+            nargs="+",
+            choices=EVALUATOR_GROUPS,
+            default=list(EVALUATOR_GROUPS),
+            help="Evaluator groups to benchmark. Defaults to all groups.",
+        )
+        parser.add_argument(
+            "--no-profiles",
+            action="store_true",
+            help="Do not benchmark full profile runs.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of threads profile runs are generated in.",
+        )
+        parser.add_argument(
+            "--test-db",
+            action="store_true",
+            help="""
+            Load the market into a (new) test database, and load the stocks
+            of profile runs from it, instead of using in-memory snapshots.
+            The test database is destroyed afterwards.
+            """,
+        )
+        parser.add_argument(
+            "--output",
+            type=str,
+            default=None,
+            help="Path to write the JSON report to. Printed if not provided.",
+        )
+        parser.add_argument(
+            "--compare",
+            type=str,
+            default=None,
+            help="Path to the JSON report of a previous run to compare this run to.",
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            try:
+                with open(options["compare"], "r") as file:
+                    baseline = json.load(file)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read report to compare to: {exc}")
+
+        self.stderr.write(
+            f"Generating a synthetic market of {options['stocks']} stocks, "
+            f"{options['years']} year(s) of {options['snapshots_per_day']} "
+            "snapshot(s) per day..."
+        )
+        market = generate_market(
+            options["stocks"],
+            years=options["years"],
+            snapshots_per_day=options["snapshots_per_day"],
+            seed=options["seed"],
+        )
+
+        benchmark_options = {
+            "groups": options["groups"],
+            "repeat": options["repeat"],
+            "profiles": not options["no_profiles"],
+            "max_workers": options["workers"],
+        }
+        if options["test_db"]:
+            report = self.run_on_test_db(market, **benchmark_options)
+        else:
+            self.stderr.write("Running benchmarks...")
+            report = run_benchmarks(market, **benchmark_options)
+
+        if baseline is not None:
+            report["comparison"] = compare_reports(baseline, report)
+            self.write_comparison(report["comparison"])
+
+        content = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(content)
+            self.stderr.write(
+                self.style.SUCCESS(f"Report written to {options['output']}.")
+            )
+        else:
+            self.stdout.write(content)
+
+    def run_on_test_db(self, market, **options):
+        old_name = connection.settings_dict["NAME"]
+        self.stderr.write("Creating test database...")
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            self.stderr.write("Loading the market into the test database...")
+            load_market(market)
+            self.stderr.write("Running benchmarks...")
+            return run_benchmarks(market, from_database=True, **options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def write_comparison(self, comparison: dict):
+        self.stderr.write(self.style.MIGRATE_HEADING("Comparison (median wall time)"))
+        for name, item in comparison.items():
+            change = item["change (%)"]
+            line = f"  {name:<36} {item['before']:>10.4f}s -> {item['after']:>10.4f}s"
+            if change is None:
+                self.stderr.write(line)
+            elif change > 0:
+                self.stderr.write(self.style.ERROR(f"{line} (+{change}%)"))
+            else:
+                self.stderr.write(self.style.SUCCESS(f"{line} ({change}%)"))
@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.risk_management.models import RiskProfile
+from apps.risk_management.stock_profiling import (
+    get_risk_profile_criteria,
+    profile_risk_profile,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a saved risk profile with function evaluations profiled, "
+        "and print a summary of the slowest functions and stocks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "risk_profile_id", type=str, help="ID of the risk profile to replay."
+        )
+        parser.add_argument(
+            "--stockset",
+            type=str,
+            default="kse100",
+            help="Stockset to evaluate the risk profile against.",
+        )
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="Evaluate all functions afresh, instead of using cached values.",
+        )
+        parser.add_argument(
+            "--no-save",
+            action="store_true",
+            help="Do not save the profiled run.",
+        )
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=10,
+            help="Number of slowest functions, argument evaluators and stocks to print.",
+        )
+
+    def handle(self, *args, **options):
+        risk_profile = (
+            RiskProfile.objects.select_related("owner")
+            .filter(id=options["risk_profile_id"])
+            .first()
+        )
+        if risk_profile is None:
+            raise CommandError(f"Risk profile {options['risk_profile_id']} not found.")
+
+        self.stdout.write(
+            f"Profiling risk profile '{risk_profile.name}' on {options['stockset']}..."
+        )
+        criteria = get_risk_profile_criteria(risk_profile)
+        _, run = profile_risk_profile(
+            risk_profile,
+            options["stockset"],
+            criteria,
+            use_cache=not options["no_cache"],
+            save=not options["no_save"],
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Profiled {run.stock_count} stocks in {run.wall_time:.3f} seconds "
+                f"({run.queries} queries in the calling thread)."
+            )
+        )
+        for section in ("functions", "arg_evaluators", "stocks"):
+            self.write_section(section, run.summary[section], top=options["top"])
+        if not options["no_save"]:
+            self.stdout.write(f"Run saved as {run.pk}.")
+
+    def write_section(self, title: str, stats: dict, *, top: int):
+        heading = title.replace("_", " ").title()
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{heading}"))
+        if not stats:
+            self.stdout.write("  (none)")
+            return
+
+        self.stdout.write(
+            f"  {'name':<24} {'calls':>8} {'wall time (ms)':>16} "
+            f"{'queries':>8} {'rows':>10}"
+        )
+        for name, item in list(stats.items())[:top]:
+            self.stdout.write(
+                f"  {name:<24} {item['calls']:>8} {item['wall_time'] * 1000:>16.1f} "
+                f"{item['queries']:>8} {item['rows']:>10}"
+            )
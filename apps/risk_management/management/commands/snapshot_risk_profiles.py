@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+
+from apps.risk_management.snapshots import generate_risk_profile_snapshots
+from apps.risk_management.scheduled_tasks import schedule_risk_profile_snapshots
+
+
+class Command(BaseCommand):
+    help = "Generate or schedule generation of snapshots of all saved risk profiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--schedule",
+            action="store_true",
+            help="""
+            Schedule a task to generate snapshots of all saved risk profiles.
+
+            Deletes the existing schedule if it already exists.
+
+            Defaults to repeating indefinitely every weekday after the market settles.
+            """,
+        )
+        parser.add_argument(
+            "--repeats",
+            type=int,
+            default=-1,
+            help="Number of times to repeat the task. -1 to repeat indefinitely.",
+        )
+        parser.add_argument(
+            "--cron",
+            type=str,
+            default="0 13 * * 1-5",
+            help="Cron expression defining the interval at which the task should run.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["schedule"]:
+            self.generate_now()
+        else:
+            self.schedule_generation(repeats=options["repeats"], cron=options["cron"])
+
+    def generate_now(self):
+        try:
+            self.stdout.write("Queueing risk profile snapshots generation...")
+            count = generate_risk_profile_snapshots()
+            self.stdout.write(
+                self.style.SUCCESS(f"{count} risk profile snapshots queued.")
+            )
+        except Exception as exc:
+            self.stdout.write(
+                self.style.ERROR(f"Error generating risk profile snapshots: {exc}")
+            )
+
+    def schedule_generation(self, **kwargs):
+        try:
+            self.stdout.write(
+                f"Scheduling risk profile snapshots to run every {kwargs.get('cron')}..."
+            )
+            schedule_risk_profile_snapshots(**kwargs)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Risk profile snapshots scheduled to run every {kwargs.get('cron')}."
+                )
+            )
+        except Exception as exc:
+            self.stdout.write(
+                self.style.ERROR(f"Error scheduling risk profile snapshots: {exc}")
+            )
@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-19 12:54
+
+import django.core.serializers.json
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("risk_management", "0006_riskprofile_period_return_end_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RiskProfileSnapshot",
+            fields=[
+                ("id", models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ("stockset", models.CharField(max_length=100)),
+                ("profile_version", models.DateTimeField(help_text="When the risk profile was last updated, as of the snapshot")),
+                ("data_date", models.DateField(help_text="Date of the latest rates the snapshot was generated from")),
+                ("rates_version", models.PositiveBigIntegerField(default=0, help_text="Version of the rates the snapshot was generated from")),
+                ("rows", models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("risk_profile", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="snapshots", to="risk_management.riskprofile")),
+            ],
+            options={
+                "verbose_name": "Risk Profile Snapshot",
+                "verbose_name_plural": "Risk Profile Snapshots",
+                "ordering": ["-created_at"],
+                "unique_together": {("risk_profile", "stockset", "profile_version", "data_date")},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-19 13:05
+
+import django.core.serializers.json
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("risk_management", "0007_riskprofilesnapshot"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RiskProfileRun",
+            fields=[
+                ("id", models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ("stockset", models.CharField(max_length=100)),
+                ("stock_count", models.PositiveIntegerField(default=0)),
+                ("wall_time", models.FloatField(default=0.0, help_text="Wall time of the run, in seconds")),
+                ("queries", models.PositiveIntegerField(default=0, help_text="Number of database queries made by the run in the calling thread")),
+                ("used_cache", models.BooleanField(default=True, help_text="Whether cached indicator values and criterion statuses were used")),
+                ("summary", models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, help_text="Measurements per function, argument evaluator and stock")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("risk_profile", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="runs", to="risk_management.riskprofile")),
+            ],
+            options={
+                "verbose_name": "Risk Profile Run",
+                "verbose_name_plural": "Risk Profile Runs",
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
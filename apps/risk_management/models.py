@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.translation import gettext_lazy as _
 
 
@@ -22,3 +23,72 @@ class RiskProfile(models.Model):
         verbose_name_plural = _("Risk Profiles")
         ordering = ["created_at"]
         unique_together = ["name", "owner"]
+
+
+class RiskProfileSnapshot(models.Model):
+    """Precomputed rows of a risk profile, generated for a stockset on a data date"""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    risk_profile = models.ForeignKey(
+        RiskProfile, related_name="snapshots", on_delete=models.CASCADE
+    )
+    stockset = models.CharField(max_length=100)
+    profile_version = models.DateTimeField(
+        help_text=_("When the risk profile was last updated, as of the snapshot")
+    )
+    data_date = models.DateField(
+        help_text=_("Date of the latest rates the snapshot was generated from")
+    )
+    rates_version = models.PositiveBigIntegerField(
+        default=0,
+        help_text=_("Version of the rates the snapshot was generated from"),
+    )
+    rows = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Risk Profile Snapshot")
+        verbose_name_plural = _("Risk Profile Snapshots")
+        ordering = ["-created_at"]
+        unique_together = ["risk_profile", "stockset", "profile_version", "data_date"]
+
+    def __str__(self) -> str:
+        return f"{self.risk_profile.name} - {self.stockset} ({self.data_date})"
+
+
+class RiskProfileRun(models.Model):
+    """Profiled run (generation) of a risk profile, for a stockset"""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    risk_profile = models.ForeignKey(
+        RiskProfile, related_name="runs", on_delete=models.CASCADE
+    )
+    stockset = models.CharField(max_length=100)
+    stock_count = models.PositiveIntegerField(default=0)
+    wall_time = models.FloatField(
+        default=0.0, help_text=_("Wall time of the run, in seconds")
+    )
+    queries = models.PositiveIntegerField(
+        default=0,
+        help_text=_("Number of database queries made by the run in the calling thread"),
+    )
+    used_cache = models.BooleanField(
+        default=True,
+        help_text=_("Whether cached indicator values and criterion statuses were used"),
+    )
+    summary = models.JSONField(
+        default=dict,
+        encoder=DjangoJSONEncoder,
+        help_text=_("Measurements per function, argument evaluator and stock"),
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Risk Profile Run")
+        verbose_name_plural = _("Risk Profile Runs")
+        ordering = ["-created_at"]
+
+    def __str__(self) -> str:
+        return f"{self.risk_profile.name} - {self.stockset} ({self.created_at})"
@@ -0,0 +1,245 @@
+"""
+Multi-process stock profile generation.
+
+TA-LIB evaluations are CPU bound, so evaluating stocks in threads does not scale
+beyond one core. Here, the stocks' OHLCV snapshots are packed into a single
+shared memory block, and a process-wide pool of worker processes evaluates
+chunks of the stocks, read from that block.
+
+Workers are started with the "forkserver" (or "spawn") method, rather than forked
+from the (multithreaded) web process, as locks held by its other threads at the time
+of the fork (e.g. by database or Redis clients) would never be released in the workers.
+"""
+
+import functools
+import math
+import typing
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from django.conf import settings
+
+from apps.stocks.ohlcv import StockOHLCV, OHLCV_FIELDS
+from helpers.utils.misc import process_local
+from .models import RiskProfile
+from .criteria.criteria import Criteria
+from .vectorized import CriteriaPlan, compile_criteria
+from .returns import ReturnWindow
+
+
+class SharedOHLCV:
+    """
+    OHLCV snapshots of many stocks, packed into a single shared memory block.
+
+    The block holds all stocks' timestamps (int64), followed by all stocks' values (float64),
+    laid out as a (5, total number of rates) array. Each stock occupies a contiguous slice
+    of both, delimited by `offsets`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        offsets: typing.List[int],
+        stocks: typing.List[typing.Tuple[typing.Any, str]],
+    ) -> None:
+        self.name = name
+        self.offsets = offsets
+        self.stocks = stocks
+        """(ID, ticker) of each stock, in the order they are packed"""
+
+    @property
+    def size(self) -> int:
+        """Total number of rates packed"""
+        return self.offsets[-1]
+
+    @classmethod
+    def create(
+        cls, snapshots: typing.Iterable[StockOHLCV]
+    ) -> typing.Tuple["SharedOHLCV", SharedMemory]:
+        """
+        Packs the snapshots into a new shared memory block.
+
+        The caller owns the returned block and should `close` and `unlink` it when done.
+        """
+        snapshots = list(snapshots)
+        offsets = [0]
+        for snapshot in snapshots:
+            offsets.append(offsets[-1] + len(snapshot))
+
+        size = offsets[-1]
+        # Shared memory blocks cannot be empty
+        nbytes = max(size * (1 + len(OHLCV_FIELDS)) * 8, 1)
+        memory = SharedMemory(create=True, size=nbytes)
+        shared = cls(
+            memory.name,
+            offsets,
+            [(snapshot.id, snapshot.ticker) for snapshot in snapshots],
+        )
+
+        timestamps, values = shared.arrays(memory)
+        for snapshot, start, end in zip(snapshots, offsets, offsets[1:]):
+            timestamps[start:end] = snapshot.timestamps
+            values[:, start:end] = snapshot.values
+        return shared, memory
+
+    def arrays(self, memory: SharedMemory) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """Returns the (timestamps, values) arrays backed by the shared memory block."""
+        timestamps = np.ndarray((self.size,), dtype=np.int64, buffer=memory.buf)
+        values = np.ndarray(
+            (len(OHLCV_FIELDS), self.size),
+            dtype=float,
+            buffer=memory.buf,
+            offset=self.size * 8,
+        )
+        return timestamps, values
+
+    def snapshots(self, memory: SharedMemory) -> typing.List[StockOHLCV]:
+        """Returns the stocks' snapshots, as views of the shared memory block."""
+        timestamps, values = self.arrays(memory)
+        return [
+            StockOHLCV(stock_id, ticker, timestamps[start:end], values[:, start:end])
+            for (stock_id, ticker), start, end in zip(
+                self.stocks, self.offsets, self.offsets[1:]
+            )
+        ]
+
+
+def _init_worker() -> None:
+    from django.apps import apps
+
+    if not apps.ready:
+        # Workers started with the "spawn" or "forkserver" methods
+        # do not inherit the parent's (set up) Django state
+        import django
+
+        django.setup()
+
+
+@functools.lru_cache(maxsize=8)
+def _compile_criteria(criteria: Criteria) -> CriteriaPlan:
+    # Workers evaluate many chunks of the same criteria
+    return compile_criteria(criteria)
+
+
+def _generate_profiles(
+    shared: SharedOHLCV,
+    indices: typing.List[int],
+    criteria: Criteria,
+    risk_profile: RiskProfile,
+    windows: typing.List[ReturnWindow],
+) -> typing.List[dict]:
+    from .stock_profiling import generate_chunk_profiles
+
+    # The chunk's snapshots are copied out of the block, so that it is not kept
+    # mapped by the worker once the chunk is done
+    memory = SharedMemory(name=shared.name)
+    try:
+        views = shared.snapshots(memory)
+        snapshots = [
+            StockOHLCV(
+                views[index].id,
+                views[index].ticker,
+                views[index].timestamps.copy(),
+                views[index].values.copy(),
+            )
+            for index in indices
+        ]
+        del views
+    finally:
+        memory.close()
+
+    return generate_chunk_profiles(
+        snapshots,
+        criteria,
+        risk_profile,
+        plan=_compile_criteria(criteria),
+        windows=windows,
+    )
+
+
+def make_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Returns a new pool of worker processes, for generating stock profiles."""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+    else:
+        context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=context, initializer=_init_worker
+    )
+
+
+@process_local
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process-wide pool of worker processes, sized by
+    `settings.RISK_PROFILE_GENERATION_WORKERS`.
+
+    Profiles generated concurrently (e.g. by concurrent requests) share its workers.
+    """
+    return make_process_pool(settings.RISK_PROFILE_GENERATION_WORKERS)
+
+
+def generate_stock_profiles_in_processes(
+    snapshots: typing.List[StockOHLCV],
+    criteria: Criteria,
+    risk_profile: RiskProfile,
+    windows: typing.List[ReturnWindow],
+    *,
+    max_workers: typing.Optional[int] = None,
+    chunks_per_worker: int = 4,
+) -> typing.Iterator[dict]:
+    """
+    Generate the profiles of the stocks in a pool of worker processes,
+    yielding each chunk's profiles as soon as the chunk is done.
+
+    Stocks whose profiles cannot be generated are logged and skipped.
+
+    :param snapshots: OHLCV snapshots of the stocks to profile
+    :param criteria: The criteria to evaluate the stocks against
+    :param risk_profile: The risk profile being generated
+    :param windows: The risk profile's return windows (see `returns.get_return_windows`)
+    :param max_workers: Number of worker processes of a pool dedicated to this call
+        (e.g. for benchmarks). Defaults to the process-wide pool (see `get_process_pool`).
+    :param chunks_per_worker: Number of chunks to split each worker's share of stocks into.
+        More chunks balance the load better, at the cost of more inter-process communication.
+    """
+    if not snapshots:
+        return
+
+    workers = min(
+        max_workers or settings.RISK_PROFILE_GENERATION_WORKERS, len(snapshots)
+    )
+    chunk_size = math.ceil(len(snapshots) / (workers * chunks_per_worker))
+    chunks = [
+        list(range(start, min(start + chunk_size, len(snapshots))))
+        for start in range(0, len(snapshots), chunk_size)
+    ]
+
+    pool = get_process_pool() if max_workers is None else make_process_pool(workers)
+    shared, memory = SharedOHLCV.create(snapshots)
+    futures = []
+    try:
+        futures = [
+            pool.submit(
+                _generate_profiles, shared, chunk, criteria, risk_profile, windows
+            )
+            for chunk in chunks
+        ]
+        for future in as_completed(futures):
+            yield from future.result()
+    except BrokenProcessPool:
+        if max_workers is None:
+            # A worker died (e.g. was killed), so the pool is replaced on next use
+            get_process_pool.cache_clear()
+            pool.shutdown(wait=False)
+        raise
+    finally:
+        # Chunks not started yet (e.g. if the caller stopped early) are not evaluated
+        for future in futures:
+            future.cancel()
+        if max_workers is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        memory.close()
+        memory.unlink()
@@ -0,0 +1,218 @@
+"""
+Shared (Redis) cache of stock profile results.
+
+Criterion statuses are cached per stock and criterion, keyed by a stable hash
+of the criterion's function specs and operator, and by the stock's rate watermark
+and rate version (see `get_rate_versions`). Period returns (and the close price) are
+cached per stock, keyed by the watermark, the version and the profile's return period.
+So, when a profile is re-run after one of its criteria is changed, only the changed
+criteria are evaluated, and only stocks with newer (or otherwise written) rates are
+evaluated again in full.
+"""
+
+import hashlib
+import typing
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+
+from apps.stocks.ohlcv import StockOHLCV, get_rate_versions, get_rate_watermark
+from helpers import metrics
+from .models import RiskProfile
+from .arg_evaluators import get_timeperiod_start_date
+from .indicator_cache import is_cacheable
+from .criteria.profiling import is_bypassing_cache
+from .criteria.criteria import Criteria, Criterion
+from .vectorized import CriteriaEvaluation, CriteriaPlan, compile_criteria
+
+
+PROFILE_CACHE_TIMEOUT = 60 * 60 * 24
+"""How long (in seconds) cached profile results are kept"""
+
+PROFILE_CACHE_LOOKUPS = metrics.counter(
+    "profile_cache_lookups_total",
+    "Lookups of stock profile results in the profile cache, by kind and result",
+    ["kind", "result"],
+)
+
+
+def criterion_digest(criterion: Criterion) -> str:
+    """
+    Returns a stable hash of the criterion's function specs and operator.
+
+    The criterion's ID is not part of the hash, so equivalent criteria share their results.
+    """
+    signature = f"{criterion.func1!r} {criterion.op.value} {criterion.func2!r}"
+    return hashlib.md5(signature.encode(), usedforsecurity=False).hexdigest()
+
+
+def is_memoizable(criterion: Criterion) -> bool:
+    """Returns True if the criterion's status on a stock depends only on the stock's own rates."""
+    return is_cacheable(criterion.func1) and is_cacheable(criterion.func2)
+
+
+def criterion_key(
+    stock_id: typing.Any, criterion: Criterion, watermark: int, version: int
+) -> str:
+    """
+    Returns the cache key for the status of the criterion on a stock,
+    at the watermark and version of the stock's rates.
+
+    Function specs with a `timeperiod` are evaluated on the rates since a date relative
+    to today, in the current timezone, so those dates and the timezone are part of the key.
+    """
+    digest = criterion_digest(criterion)
+    key = f"profiles:criterion:{stock_id}:{digest}:{watermark}:{version}"
+    dates = [
+        get_timeperiod_start_date(spec.kwargs.get("timeperiod", None))
+        for spec in (criterion.func1, criterion.func2)
+    ]
+    if any(date is not None for date in dates):
+        since = ",".join(date.isoformat() if date else "" for date in dates)
+        key = f"{key}:{since}@{timezone.get_current_timezone_name()}"
+    return key
+
+
+def returns_key(
+    stock_id: typing.Any, risk_profile: RiskProfile, watermark: int, version: int
+) -> str:
+    """
+    Returns the cache key for the period returns of a stock,
+    at the watermark and version of the stock's rates.
+
+    Default return periods are relative to today, in the current timezone,
+    so today's date and the timezone are part of the key.
+    """
+    start = risk_profile.period_return_start
+    end = risk_profile.period_return_end
+    period = f"{start.isoformat() if start else ''},{end.isoformat() if end else ''}"
+    return (
+        f"profiles:returns:{stock_id}:{watermark}:{version}:{period}:"
+        f"{timezone.localdate().isoformat()}@{timezone.get_current_timezone_name()}"
+    )
+
+
+def get_many_stock_returns(
+    snapshots: typing.Sequence[StockOHLCV],
+    risk_profile: RiskProfile,
+    *,
+    versions: typing.Optional[typing.Mapping[typing.Any, int]] = None,
+) -> typing.Dict[int, typing.Dict[str, typing.Any]]:
+    """
+    Fetch the cached period returns of the stocks, in a single round trip.
+
+    :param versions: The stocks' rate versions, by ID (see `get_rate_versions`).
+        Fetched (in another round trip) if not provided.
+    :return: A mapping of stock index to the cached returns, for returns found in the cache
+    """
+    if is_bypassing_cache() or not snapshots:
+        return {}
+    if versions is None:
+        versions = get_rate_versions(snapshot.pk for snapshot in snapshots)
+    keys = {
+        returns_key(
+            snapshot.pk,
+            risk_profile,
+            get_rate_watermark(snapshot),
+            versions[snapshot.pk],
+        ): index
+        for index, snapshot in enumerate(snapshots)
+    }
+    if not keys:
+        return {}
+    found = cache.get_many(keys.keys())
+    PROFILE_CACHE_LOOKUPS.inc(len(found), kind="returns", result="hit")
+    PROFILE_CACHE_LOOKUPS.inc(len(keys) - len(found), kind="returns", result="miss")
+    return {keys[key]: value for key, value in found.items()}
+
+
+def set_many_stock_returns(
+    returns: typing.Iterable[typing.Tuple[StockOHLCV, typing.Dict[str, typing.Any]]],
+    risk_profile: RiskProfile,
+    *,
+    versions: typing.Optional[typing.Mapping[typing.Any, int]] = None,
+) -> None:
+    """
+    Cache the period returns of stocks, in a single round trip
+
+    :param versions: The stocks' rate versions, by ID (see `get_rate_versions`).
+        Fetched (in another round trip) if not provided.
+    """
+    returns = list(returns)
+    if is_bypassing_cache() or not returns:
+        return
+    if versions is None:
+        versions = get_rate_versions(snapshot.pk for snapshot, _ in returns)
+    mapping = {
+        returns_key(
+            snapshot.pk,
+            risk_profile,
+            get_rate_watermark(snapshot),
+            versions[snapshot.pk],
+        ): value
+        for snapshot, value in returns
+    }
+    if mapping:
+        cache.set_many(mapping, timeout=PROFILE_CACHE_TIMEOUT)
+
+
+def evaluate_memoized(
+    plan: CriteriaPlan,
+    snapshots: typing.Sequence[StockOHLCV],
+    *,
+    versions: typing.Optional[typing.Mapping[typing.Any, int]] = None,
+) -> CriteriaEvaluation:
+    """
+    Same as `plan.evaluate`, but statuses cached in the profile cache are reused.
+
+    Only the criteria missing for at least one stock are evaluated, and only on the
+    stocks missing at least one of them. The evaluated statuses are then cached.
+
+    :param versions: The stocks' rate versions, by ID (see `get_rate_versions`).
+        Fetched (in another round trip) if not provided.
+    """
+    criteria = plan.criteria
+    memoizable = [
+        column
+        for column, criterion in enumerate(criteria)
+        if is_memoizable(criterion)
+    ]
+    if memoizable and snapshots and versions is None:
+        versions = get_rate_versions(snapshot.pk for snapshot in snapshots)
+    keys = {}
+    for stock_index, snapshot in enumerate(snapshots):
+        watermark = get_rate_watermark(snapshot)
+        for column in memoizable:
+            keys[(stock_index, column)] = criterion_key(
+                snapshot.pk, criteria[column], watermark, versions[snapshot.pk]
+            )
+
+    statuses = np.zeros((len(snapshots), len(criteria)), dtype=np.int8)
+    missing = np.ones(statuses.shape, dtype=bool)
+    found = cache.get_many(keys.values()) if keys else {}
+    if keys:
+        PROFILE_CACHE_LOOKUPS.inc(len(found), kind="status", result="hit")
+        PROFILE_CACHE_LOOKUPS.inc(len(keys) - len(found), kind="status", result="miss")
+    for position, key in keys.items():
+        if key in found:
+            statuses[position] = found[key]
+            missing[position] = False
+
+    rows = np.flatnonzero(missing.any(axis=1))
+    columns = np.flatnonzero(missing.any(axis=0))
+    if not rows.size:
+        return CriteriaEvaluation(criteria, statuses)
+
+    if columns.size < len(criteria):
+        plan = compile_criteria(Criteria([criteria[column] for column in columns]))
+    evaluation = plan.evaluate([snapshots[row] for row in rows])
+    statuses[np.ix_(rows, columns)] = evaluation.statuses
+
+    evaluated = {
+        key: int(statuses[position])
+        for position, key in keys.items()
+        if missing[position]
+    }
+    if evaluated:
+        cache.set_many(evaluated, timeout=PROFILE_CACHE_TIMEOUT)
+    return CriteriaEvaluation(criteria, statuses)
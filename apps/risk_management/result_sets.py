@@ -0,0 +1,288 @@
+"""
+Cached, columnar risk profile result sets.
+
+A generated risk profile (one row per stock) is stored in the cache as a result set:
+one NumPy array per column, keyed by a run ID. Clients then request sorted, filtered
+and paginated slices of the run (e.g. "EK score (%) >= 70, sorted by 1M return,
+page 2"), or its top rows by a column, without the profile being generated again,
+or all of its rows being sent at once.
+"""
+
+import decimal
+import re
+import typing
+import uuid
+import attrs
+import numpy as np
+from django.core.cache import cache
+
+from .criteria.comparisons import ComparisonOperator
+from .vectorized import _COMPARISONS
+
+
+RESULT_SET_TIMEOUT = 60 * 60
+"""How long (in seconds) result sets are kept in the cache"""
+RESULT_SET_PAGE_SIZE = 50
+MAX_RESULT_SET_PAGE_SIZE = 500
+
+TEXT_COLUMNS = ("symbol",)
+"""Columns whose values are not numeric"""
+
+
+class ColumnKind:
+    """How the values of a column are rendered in rows"""
+
+    NUMBER = "number"
+    INTEGER = "integer"
+    DECIMAL = "decimal"
+    """Prices, rendered as strings with two decimal places (as `Decimal`s are in JSON)"""
+    TEXT = "text"
+
+
+_FILTER_PATTERN = re.compile(
+    r"^(?P<column>.+?)\s*(?P<op>"
+    + "|".join(
+        re.escape(op.value)
+        for op in sorted(ComparisonOperator, key=lambda op: -len(op.value))
+    )
+    + r")\s*(?P<value>.+)$"
+)
+
+
+@attrs.define(slots=True)
+class ResultSet:
+    """A risk profile's rows, stored column by column"""
+
+    run_id: str
+    risk_profile_id: str
+    stockset: str
+    columns: typing.List[str]
+    """Column names, in row order"""
+    kinds: typing.Dict[str, str]
+    values: typing.Dict[str, np.ndarray]
+    """Values of each column. NaN for missing numeric values"""
+
+    def __len__(self) -> int:
+        return len(self.values[self.columns[0]]) if self.columns else 0
+
+    def rows(self, indices: typing.Iterable[int]) -> typing.List[typing.Dict]:
+        """Returns the rows at the indices, as they were before being stored"""
+        renderers = {column: _RENDERERS[self.kinds[column]] for column in self.columns}
+        return [
+            {
+                column: renderers[column](self.values[column][index])
+                for column in self.columns
+            }
+            for index in indices
+        ]
+
+    def filter(
+        self, conditions: typing.Iterable[typing.Tuple[str, ComparisonOperator, float]]
+    ) -> np.ndarray:
+        """
+        Returns the indices of the rows matching all the conditions.
+
+        :param conditions: (column, operator, value) conditions on numeric columns.
+            Rows with a missing value in a condition's column do not match it.
+        :raises KeyError: If a condition is on an unknown or non-numeric column
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for column, op, value in conditions:
+            if self.kinds.get(column, ColumnKind.TEXT) == ColumnKind.TEXT:
+                raise KeyError(column)
+            with np.errstate(invalid="ignore"):
+                mask &= _COMPARISONS[op](self.values[column], value)
+        return np.flatnonzero(mask)
+
+    def order(
+        self,
+        indices: np.ndarray,
+        column: str,
+        *,
+        descending: bool = False,
+        limit: typing.Optional[int] = None,
+    ) -> np.ndarray:
+        """
+        Returns the indices ordered by the column's values. Missing values are last.
+
+        :param indices: The indices of the rows to order
+        :param column: The column to order the rows by
+        :param descending: Whether to order the rows in descending order
+        :param limit: If provided, only the first `limit` rows are selected (top-K),
+            and only those are fully sorted
+        :raises KeyError: If the column does not exist
+        """
+        values = self.values[column][indices]
+        if self.kinds[column] == ColumnKind.TEXT:
+            order = np.argsort(values, kind="stable")
+            if descending:
+                order = order[::-1]
+            return indices[order[:limit]]
+
+        # Sort keys: missing values are moved after all others, in either direction
+        keys = -values if descending else values.copy()
+        keys[np.isnan(keys)] = np.inf
+        if limit is not None and limit < len(keys):
+            selected = np.argpartition(keys, limit)[:limit]
+            selected = selected[np.argsort(keys[selected], kind="stable")]
+            return indices[selected]
+        return indices[np.argsort(keys, kind="stable")]
+
+
+def _render_number(value: float) -> typing.Optional[float]:
+    return None if np.isnan(value) else float(value)
+
+
+def _render_integer(value: float) -> typing.Optional[int]:
+    return None if np.isnan(value) else int(value)
+
+
+def _render_decimal(value: float) -> typing.Optional[str]:
+    if np.isnan(value):
+        return None
+    return str(
+        decimal.Decimal(float(value)).quantize(
+            decimal.Decimal("0.01"), rounding=decimal.ROUND_HALF_UP
+        )
+    )
+
+
+_RENDERERS = {
+    ColumnKind.NUMBER: _render_number,
+    ColumnKind.INTEGER: _render_integer,
+    ColumnKind.DECIMAL: _render_decimal,
+    ColumnKind.TEXT: lambda value: value,
+}
+
+
+def _column_kind(column: str, values: typing.List[typing.Any]) -> str:
+    if column in TEXT_COLUMNS:
+        return ColumnKind.TEXT
+    present = [value for value in values if value is not None]
+    if any(isinstance(value, (decimal.Decimal, str)) for value in present):
+        return ColumnKind.DECIMAL
+    if all(isinstance(value, int) for value in present):
+        # Includes criterion statuses and EK scores
+        return ColumnKind.INTEGER
+    return ColumnKind.NUMBER
+
+
+def make_result_set(
+    rows: typing.Sequence[typing.Dict[str, typing.Any]],
+    *,
+    risk_profile_id: typing.Any,
+    stockset: str,
+) -> ResultSet:
+    """
+    Make a result set of the risk profile's rows.
+
+    :param rows: The rows of the generated (or snapshot) risk profile
+    :param risk_profile_id: The ID of the risk profile
+    :param stockset: The stockset the risk profile was generated for
+    """
+    columns = list(rows[0].keys()) if rows else []
+    kinds = {}
+    values = {}
+    for column in columns:
+        column_values = [row.get(column, None) for row in rows]
+        kind = kinds[column] = _column_kind(column, column_values)
+        if kind == ColumnKind.TEXT:
+            values[column] = np.array(column_values, dtype=object)
+        else:
+            # Integers (criterion statuses and EK scores) are exact in single precision
+            values[column] = np.array(
+                [np.nan if value is None else float(value) for value in column_values],
+                dtype=np.float32 if kind == ColumnKind.INTEGER else float,
+            )
+    return ResultSet(
+        run_id=uuid.uuid4().hex,
+        risk_profile_id=str(risk_profile_id),
+        stockset=stockset.lower(),
+        columns=columns,
+        kinds=kinds,
+        values=values,
+    )
+
+
+def _result_set_key(run_id: str) -> str:
+    return f"risk_management:result_set:{run_id}"
+
+
+def save_result_set(result_set: ResultSet) -> None:
+    """Store the result set in the cache, under its run ID"""
+    cache.set(
+        _result_set_key(result_set.run_id),
+        attrs.asdict(result_set, recurse=False),
+        timeout=RESULT_SET_TIMEOUT,
+    )
+
+
+def get_result_set(run_id: str) -> typing.Optional[ResultSet]:
+    """Returns the result set of the run, or None if it does not exist or has expired."""
+    data = cache.get(_result_set_key(run_id))
+    if data is None:
+        return None
+    return ResultSet(**data)
+
+
+def parse_filter(expression: str) -> typing.Tuple[str, ComparisonOperator, float]:
+    """
+    Parse a filter expression, e.g. "EK score (%)>=70", into a
+    (column, operator, value) condition.
+
+    :raises ValueError: If the expression is invalid
+    """
+    match = _FILTER_PATTERN.match(expression.strip())
+    if match is None:
+        raise ValueError(f"Invalid filter: {expression}")
+    try:
+        value = float(match["value"])
+    except ValueError:
+        raise ValueError(f"Invalid filter value: {match['value']}")
+    return match["column"], ComparisonOperator(match["op"]), value
+
+
+def query_result_set(
+    result_set: ResultSet,
+    *,
+    filters: typing.Iterable[typing.Tuple[str, ComparisonOperator, float]] = (),
+    sort: typing.Optional[str] = None,
+    descending: bool = False,
+    top: typing.Optional[int] = None,
+    page: int = 1,
+    page_size: int = RESULT_SET_PAGE_SIZE,
+) -> typing.Dict[str, typing.Any]:
+    """
+    Returns a sorted, filtered page of the result set's rows.
+
+    :param result_set: The result set to query
+    :param filters: Conditions the rows should match. See `ResultSet.filter`.
+    :param sort: The column to sort the rows by. Rows are in stockset order if not provided.
+    :param descending: Whether to sort the rows in descending order
+    :param top: If provided, only the first `top` rows (after sorting) are paginated
+    :param page: The (1-based) page to return
+    :param page_size: Number of rows per page
+    :raises KeyError: If a filter or the sort column does not exist
+    """
+    indices = result_set.filter(filters)
+    matched = len(indices)
+    if sort:
+        indices = result_set.order(indices, sort, descending=descending, limit=top)
+    elif top is not None:
+        indices = indices[:top]
+
+    page_size = max(1, min(page_size, MAX_RESULT_SET_PAGE_SIZE))
+    pages = max(1, -(-len(indices) // page_size))
+    page = max(1, min(page, pages))
+    start = (page - 1) * page_size
+    return {
+        "run_id": result_set.run_id,
+        "columns": result_set.columns,
+        "total": len(result_set),
+        "matched": matched,
+        "count": len(indices),
+        "page": page,
+        "pages": pages,
+        "page_size": page_size,
+        "rows": result_set.rows(indices[start : start + page_size]),
+    }
@@ -0,0 +1,194 @@
+"""
+In-memory period returns of stocks, as shown in their profiles.
+
+The windows (start and end dates) of a profile's return periods are resolved once
+per run. The price of a stock on a date is the close of its latest rate on or before
+the date, going back at most `RETURN_PRICE_TOLERANCE` days. Those prices are looked
+up for all stocks and window dates at once, with a single `np.searchsorted` over the
+stocks' concatenated rate timestamps, and all return columns are computed from them
+in one pass.
+
+Prices and returns are rounded (half up, to two decimal places) as the `Decimal`
+based calculations they replace did, using integer arithmetic on prices in cents.
+"""
+
+import datetime
+import decimal
+import typing
+import attrs
+import numpy as np
+
+from apps.stocks.ohlcv import StockOHLCV, day_bounds
+from helpers.utils.datetime import timedelta_code_to_datetime_range
+from .models import RiskProfile
+
+
+PERCENTAGE_RETURN_INDICATORS_TIMEDELTA_CODES = (
+    "1D",
+    "3D",
+    "1W",
+    "1M",
+    "YTD",
+)
+
+RETURN_PRICE_TOLERANCE = 10
+"""Number of days to go back from a date, for a price, if the stock has no rate on the date"""
+
+_STOCK_KEY_SPAN = 1 << 40
+"""Offset between the timestamp keys of consecutive stocks. Larger than any timestamp"""
+
+
+@attrs.define(frozen=True, slots=True)
+class ReturnWindow:
+    """A period the return of stocks is calculated over"""
+
+    column: str
+    """The profile column the return is shown in"""
+    start: datetime.date
+    end: datetime.date
+
+
+def get_return_windows(risk_profile: RiskProfile) -> typing.List[ReturnWindow]:
+    """
+    Returns the windows of the risk profile's return columns, in column order.
+
+    Should be called with the risk profile owner's timezone activated,
+    as the default return periods are relative to today.
+
+    :param risk_profile: The risk profile defining the user defined return period
+    """
+    windows = []
+    if risk_profile.period_return_start and risk_profile.period_return_end:
+        windows.append(
+            ReturnWindow(
+                "period return (%)",
+                risk_profile.period_return_start,
+                risk_profile.period_return_end,
+            )
+        )
+
+    for timedelta_code in PERCENTAGE_RETURN_INDICATORS_TIMEDELTA_CODES:
+        start, end = timedelta_code_to_datetime_range(timedelta_code)
+        windows.append(
+            ReturnWindow(f"{timedelta_code} return (%)", start.date(), end.date())
+        )
+    return windows
+
+
+def _to_cents(prices: np.ndarray) -> np.ndarray:
+    """
+    Rounds the prices half up (away from zero) to whole cents, as `Decimal.quantize`
+    does on the (exact) value of each price. Prices within rounding error of a half
+    cent are rounded with `Decimal`, as scaling them by 100 may cross the half cent.
+    """
+    scaled = np.abs(prices) * 100
+    cents = np.sign(prices) * np.floor(scaled + 0.5)
+    fractions = scaled - np.floor(scaled)
+    for index in np.flatnonzero(np.abs(fractions - 0.5) < 1e-6):
+        price = decimal.Decimal(float(prices.flat[index])).quantize(
+            decimal.Decimal("0.01"), rounding=decimal.ROUND_HALF_UP
+        )
+        cents.flat[index] = float(price * 100)
+    return cents.astype(np.int64)
+
+
+def _percentage_returns(start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """
+    Returns the percentage returns between the prices (in cents), rounded half up
+    (away from zero) to two decimal places. 0 where either price is missing (0).
+    """
+    available = (start != 0) & (end != 0)
+    divisor = np.where(available, np.abs(start), 1)
+    # Return in hundredths of a percent, as an exact fraction: change * 10000 / start
+    numerator = (end - start) * 10000 * np.sign(start)
+    hundredths = np.sign(numerator) * (
+        (np.abs(numerator) * 2 + divisor) // (2 * divisor)
+    )
+    return np.where(available, hundredths, 0) / 100
+
+
+def get_prices_as_of(
+    snapshots: typing.Sequence[StockOHLCV],
+    dates: typing.Sequence[datetime.date],
+    *,
+    tolerance: int = RETURN_PRICE_TOLERANCE,
+) -> np.ndarray:
+    """
+    Returns the price (in cents) of each stock on each date: the close of its latest rate
+    added on or before the date, and at most `tolerance` days before it (in the current timezone).
+
+    :param snapshots: The stocks' rates
+    :param dates: The dates to look up the prices on
+    :param tolerance: The number of days to go back if the stock has no rate on a date
+    :return: A (stocks, dates) array of prices, 0 where a stock has no such rate
+    """
+    prices = np.zeros((len(snapshots), len(dates)), dtype=np.int64)
+    if not len(snapshots) or not len(dates):
+        return prices
+
+    ends = np.array([day_bounds(date)[1] for date in dates], dtype=np.int64)
+    starts = np.array(
+        [
+            day_bounds(date - datetime.timedelta(days=tolerance))[0]
+            for date in dates
+        ],
+        dtype=np.int64,
+    )
+    lengths = np.array([len(snapshot) for snapshot in snapshots])
+    if not lengths.sum():
+        return prices
+
+    # Keys of each stock's rates are offset by the stock's position, so that the
+    # concatenated keys of all stocks are sorted, and searched at once
+    stock_keys = np.arange(len(snapshots), dtype=np.int64)[:, None] * _STOCK_KEY_SPAN
+    keys = np.concatenate(
+        [
+            snapshot.timestamps.astype(np.int64) + stock_keys[index, 0]
+            for index, snapshot in enumerate(snapshots)
+        ]
+    )
+    closes = np.concatenate([snapshot.field("close") for snapshot in snapshots])
+
+    positions = np.searchsorted(keys, stock_keys + ends, side="left") - 1
+    first_positions = np.concatenate(([0], np.cumsum(lengths)[:-1]))[:, None]
+    found = positions >= first_positions
+    positions = np.maximum(positions, 0)
+    found &= keys[positions] >= stock_keys + starts
+
+    prices[found] = _to_cents(closes[positions[found]])
+    return prices
+
+
+def calculate_returns(
+    snapshots: typing.Sequence[StockOHLCV],
+    windows: typing.Sequence[ReturnWindow],
+    *,
+    tolerance: int = RETURN_PRICE_TOLERANCE,
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Calculates the close price and period returns of the stocks, as shown in their profiles.
+
+    Should be called with the risk profile owner's timezone activated,
+    as prices are looked up by date in the current timezone.
+
+    :param snapshots: The stocks' rates
+    :param windows: The return windows. See `get_return_windows`.
+    :param tolerance: The number of days to go back for a price,
+        if a stock has no rate on a window's start or end date
+    :return: A dictionary of each stock's close price and period returns,
+        in the order of `snapshots`
+    """
+    dates = sorted({date for window in windows for date in (window.start, window.end)})
+    prices = get_prices_as_of(snapshots, dates, tolerance=tolerance)
+    positions = {date: index for index, date in enumerate(dates)}
+    starts = [positions[window.start] for window in windows]
+    ends = [positions[window.end] for window in windows]
+    returns = _percentage_returns(prices[:, starts], prices[:, ends]).tolist()
+
+    stock_returns = []
+    for snapshot, stock_window_returns in zip(snapshots, returns):
+        values = {"close": snapshot.price}
+        for window, value in zip(windows, stock_window_returns):
+            values[window.column] = value
+        stock_returns.append(values)
+    return stock_returns
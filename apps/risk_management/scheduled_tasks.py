@@ -0,0 +1,29 @@
+import datetime
+from django_q.tasks import schedule
+from django_q.models import Schedule
+from django.utils import timezone
+
+
+def schedule_risk_profile_snapshots(repeats: int = -1, cron: str = "0 13 * * 1-5"):
+    """
+    Schedule the task to generate snapshots of all saved risk profiles.
+
+    Deletes the existing schedule if it already exists.
+
+    :param repeats: Number of times to repeat the task. -1 to repeat indefinitely.
+    :param cron: Cron expression defining the interval at which the task should run.
+        Defaults to weekdays at 13:00 UTC, after the market settles.
+    """
+    task_name = "apps.risk_management.snapshots.generate_risk_profile_snapshots"
+    # Delete the schedule if it already exists
+    Schedule.objects.filter(func=task_name).delete()
+
+    schedule(
+        task_name,
+        q_options={"save": True},
+        schedule_type="C",
+        repeats=repeats,
+        cron=cron,
+        # Set the next run time to 10 seconds from now to avoid running the task immediately
+        next_run=(timezone.now() + datetime.timedelta(seconds=10)),
+    )
@@ -0,0 +1,193 @@
+"""
+Precomputed (snapshot) risk profiles.
+
+Saved risk profiles are evaluated against the default stocksets once a day,
+after the market settles, and the resulting rows are stored as snapshots.
+A snapshot is keyed by the version of the profile (when it was last updated)
+and the date of the rates it was generated from, so requests for a profile
+whose criteria and rates have not changed since can be served from its snapshot.
+"""
+
+import datetime
+import typing
+from asgiref.sync import sync_to_async
+from django.db import models
+from django.utils import timezone
+from django_q.tasks import async_task
+
+from apps.stocks.models import Rate
+from helpers import metrics
+from helpers.caching import get_versions
+from helpers.logging import log_exception
+from helpers.utils.datetime import activate_timezone
+from .models import RiskProfile, RiskProfileSnapshot
+from .stock_profiling import (
+    DEFAULT_STOCKSETS,
+    get_risk_profile_criteria,
+    load_risk_profile,
+)
+
+
+SNAPSHOT_STOCKSETS = tuple(stockset.lower() for stockset in DEFAULT_STOCKSETS)
+"""Stocksets risk profile snapshots are generated for"""
+
+SNAPSHOT_LOOKUPS = metrics.counter(
+    "risk_profile_snapshot_lookups_total",
+    "Lookups of current risk profile snapshots, by result",
+    ["result"],
+)
+
+
+def get_rates_version() -> int:
+    """Returns the current version of the (all stocks') rates."""
+    return get_versions(("stocks.Rate", None))[0]
+
+
+def get_data_date() -> typing.Optional[datetime.date]:
+    """Returns the (current timezone) date of the latest rates, if any."""
+    latest = Rate.objects.aggregate(latest=models.Max("added_at"))["latest"]
+    if latest is None:
+        return None
+    return timezone.localdate(latest)
+
+
+def is_current_snapshot(snapshot: RiskProfileSnapshot) -> bool:
+    """
+    Check if the snapshot is still current for its risk profile.
+
+    A snapshot is current if the profile has not been updated, and no rates
+    have been ingested, since it was generated, and it was generated today
+    (in the profile owner's timezone), as criteria periods are relative to today.
+    """
+    risk_profile = snapshot.risk_profile
+    if snapshot.profile_version != risk_profile.updated_at:
+        return False
+    if snapshot.rates_version != get_rates_version():
+        return False
+
+    with activate_timezone(risk_profile.owner.timezone):
+        return timezone.localdate(snapshot.created_at) == timezone.localdate()
+
+
+def _latest_snapshots(
+    risk_profile: RiskProfile, stockset: str
+) -> models.QuerySet[RiskProfileSnapshot]:
+    """Snapshots of the current version of the risk profile for the stockset, latest first"""
+    return RiskProfileSnapshot.objects.filter(
+        risk_profile=risk_profile,
+        stockset=stockset,
+        profile_version=risk_profile.updated_at,
+    ).order_by("-created_at")
+
+
+def get_current_snapshot(
+    risk_profile: RiskProfile, stockset: str
+) -> typing.Optional[RiskProfileSnapshot]:
+    """
+    Returns the current snapshot of the risk profile for the stockset, if any.
+
+    :param risk_profile: The risk profile to get the snapshot for
+    :param stockset: The stockset the snapshot should be generated for
+    """
+    stockset = stockset.lower()
+    if stockset not in SNAPSHOT_STOCKSETS:
+        return None
+
+    snapshot = _latest_snapshots(risk_profile, stockset).first()
+    if snapshot is None:
+        SNAPSHOT_LOOKUPS.inc(result="miss")
+        return None
+
+    # Avoid refetching the risk profile (and its owner) from the snapshot
+    snapshot.risk_profile = risk_profile
+    if not is_current_snapshot(snapshot):
+        SNAPSHOT_LOOKUPS.inc(result="stale")
+        return None
+    SNAPSHOT_LOOKUPS.inc(result="hit")
+    return snapshot
+
+
+async def aget_current_snapshot(
+    risk_profile: RiskProfile, stockset: str
+) -> typing.Optional[RiskProfileSnapshot]:
+    """Async version of `get_current_snapshot`."""
+    stockset = stockset.lower()
+    if stockset not in SNAPSHOT_STOCKSETS:
+        return None
+
+    snapshot = await _latest_snapshots(risk_profile, stockset).afirst()
+    if snapshot is None:
+        SNAPSHOT_LOOKUPS.inc(result="miss")
+        return None
+
+    snapshot.risk_profile = risk_profile
+    if not await sync_to_async(is_current_snapshot)(snapshot):
+        SNAPSHOT_LOOKUPS.inc(result="stale")
+        return None
+    SNAPSHOT_LOOKUPS.inc(result="hit")
+    return snapshot
+
+
+def generate_risk_profile_snapshot(
+    risk_profile_id: typing.Any, stockset: str
+) -> typing.Optional[RiskProfileSnapshot]:
+    """
+    Generate (or regenerate) the snapshot of the risk profile for the stockset.
+
+    Older snapshots of the risk profile for the stockset are deleted.
+
+    :param risk_profile_id: The ID of the risk profile
+    :param stockset: The stockset to evaluate the profile against
+    :return: The snapshot, or None if the risk profile no longer exists
+    """
+    risk_profile = (
+        RiskProfile.objects.select_related("owner").filter(id=risk_profile_id).first()
+    )
+    if risk_profile is None:
+        return None
+
+    # Read the versions before evaluating, so that rates ingested
+    # while the profile is being evaluated make the snapshot stale
+    rates_version = get_rates_version()
+    data_date = get_data_date() or timezone.localdate()
+    profile_version = risk_profile.updated_at
+
+    criteria = get_risk_profile_criteria(risk_profile)
+    rows = load_risk_profile(risk_profile, stockset, criteria)
+
+    snapshot, _ = RiskProfileSnapshot.objects.update_or_create(
+        risk_profile=risk_profile,
+        stockset=stockset,
+        profile_version=profile_version,
+        data_date=data_date,
+        defaults={"rates_version": rates_version, "rows": rows},
+    )
+    RiskProfileSnapshot.objects.filter(
+        risk_profile=risk_profile, stockset=stockset
+    ).exclude(id=snapshot.id).delete()
+    return snapshot
+
+
+def generate_risk_profile_snapshots() -> int:
+    """
+    Queue the generation of snapshots of all saved risk profiles,
+    for all default stocksets, one task per profile and stockset.
+
+    :return: Number of snapshot generation tasks queued
+    """
+    count = 0
+    for risk_profile_id in RiskProfile.objects.values_list("id", flat=True):
+        for stockset in SNAPSHOT_STOCKSETS:
+            try:
+                async_task(
+                    "apps.risk_management.snapshots.generate_risk_profile_snapshot",
+                    str(risk_profile_id),
+                    stockset,
+                    group="risk_profile_snapshots",
+                    q_options={"save": False},
+                )
+            except Exception as exc:
+                log_exception(exc)
+            else:
+                count += 1
+    return count
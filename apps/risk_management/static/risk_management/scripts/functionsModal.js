@@ -1,4 +1,5 @@
 const functionsModals = document.querySelectorAll(".functions-modal");
+const functionsSchemaUrl = document.currentScript.dataset.schemaUrl;
 
 
 /**
@@ -65,8 +66,140 @@ function getSubOptionFormFieldsData(formfieldsContainer) {
 }
 
 
-functionsModals.forEach(functionsModal => {
-    const functionsModalCloseBtn = functionsModal.querySelector(".modal-head .btn-close");
+/**
+ * Escapes the given value for use in HTML text and attribute values.
+ *
+ * @param {*} value - The value to escape.
+ * @returns {string} - The escaped value.
+ */
+function escapeHTML(value) {
+    return String(value)
+        .replace(/&/g, "&amp;")
+        .replace(/</g, "&lt;")
+        .replace(/>/g, "&gt;")
+        .replace(/"/g, "&quot;")
+        .replace(/'/g, "&#39;");
+}
+
+
+/**
+ * Title-cases the given value, like Django's `title` template filter.
+ *
+ * @param {string} value - The value to title-case.
+ * @returns {string} - The title-cased value.
+ */
+function toTitleCase(value) {
+    return value.toLowerCase().replace(/(^|[^a-z])([a-z])/g, (match, prefix, letter) => prefix + letter.toUpperCase());
+}
+
+
+/**
+ * Makes the form fields for the keyword arguments of a function.
+ *
+ * @param {string} functionName - The name of the function.
+ * @param {Object} functionData - The function's schema.
+ * @returns {string} - The HTML of the form fields.
+ */
+function makeFunctionArgumentsFormFields(functionName, functionData) {
+    const formFields = Object.entries(functionData.kwargs.arguments).map(([argument, argumentData]) => {
+        const hasDefault = argumentData.default !== null && argumentData.default !== undefined;
+        const defaultAttributes = hasDefault ? `
+            value="${escapeHTML(argumentData.default)}"
+            data-default="${escapeHTML(argumentData.default)}"
+        ` : "";
+
+        return `
+            <div class="form-field">
+                <label for="${escapeHTML(argument)}">${escapeHTML(toTitleCase(argument))}</label>
+                <input 
+                    type="${escapeHTML(argumentData.html_input_type)}" 
+                    class="form-input form-control input-rounded function-input" 
+                    id="${escapeHTML(argument)}"
+                    name="${escapeHTML(argument)}"
+                    placeholder="${escapeHTML(toTitleCase(argument))}"
+                    title="${escapeHTML(argumentData.description || 'Provide a valid value for this option')}"
+                    ${defaultAttributes}
+                >
+            </div>
+        `;
+    });
+
+    return `
+        <div class="form-fields" data-function="${escapeHTML(functionName)}">
+            ${formFields.join("")}
+            <button 
+                type="button" 
+                class="btn light btn-success btn-sm done-btn" 
+            >
+                Done
+            </button>
+        </div>
+    `;
+}
+
+
+/**
+ * Makes the function options of a functions modal from the (grouped) functions schema.
+ *
+ * @param {Object} functionsSchema - The functions schema, grouped by function group.
+ * @returns {string} - The HTML of the function options.
+ */
+function makeFunctionOptions(functionsSchema) {
+    return Object.entries(functionsSchema).map(([functionGroup, functionGroupData]) => {
+        const functionOptions = Object.entries(functionGroupData).map(([functionName, functionData]) => {
+            const subOptions = functionData.kwargs ? `
+                <div class="sub-options">
+                    <div class="sub-options-head">
+                        <span class="arrow">&larr;</span>
+                        <p>${escapeHTML(functionData.name)}</p>
+                    </div>
+
+                    <div class="options">
+                        ${makeFunctionArgumentsFormFields(functionName, functionData)}
+                    </div>
+                </div>
+            ` : "";
+
+            return `
+                <div class="option" data-function="${escapeHTML(functionName)}">
+                    <div class="option-label" title="${escapeHTML(functionData.description ?? '')}">
+                        <span>${escapeHTML(functionName)}</span>
+                        ${functionData.kwargs ? '<span class="arrow">&rarr;</span>' : ""}
+                    </div>
+                    ${subOptions}
+                </div>
+            `;
+        });
+
+        return `
+            <div class="option">
+                <div class="option-label">
+                    <span>${escapeHTML(functionGroup)}</span>
+                    <span class="arrow">&rarr;</span>
+                </div>
+                
+                <div class="sub-options">
+                    <div class="sub-options-head">
+                        <span class="arrow">&larr;</span>
+                        <p>${escapeHTML(functionGroup)}</p>
+                    </div>
+
+                    <div class="options">
+                        ${functionOptions.join("")}
+                    </div>
+                </div>
+            </div>
+        `;
+    }).join("");
+}
+
+
+/**
+ * Sets up the function options of a functions modal, once they have been rendered.
+ *
+ * @param {HTMLElement} functionsModal - The functions modal.
+ */
+function setUpFunctionOptions(functionsModal) {
     const optionsSearchInput = functionsModal.querySelector(".options-search-input");
     const mainOptionSet = functionsModal.querySelector(".function-options.options");
     const subOptionSets = functionsModal.querySelectorAll(".sub-options");
@@ -108,14 +241,6 @@ functionsModals.forEach(functionsModal => {
         });
     }
     
-    functionsModal.open = () => {
-        functionsModal.classList.add("show-flex");
-    }
-    
-    functionsModal.close = () => {
-        functionsModal.classList.remove("show-flex");
-    }
-    
     
     // Search functionality
     optionsSearchInput.addEventListener('input', function () {
@@ -148,6 +273,21 @@ functionsModals.forEach(functionsModal => {
             });
         });
     });
+}
+
+
+functionsModals.forEach(functionsModal => {
+    const functionsModalCloseBtn = functionsModal.querySelector(".modal-head .btn-close");
+
+    functionsModal.reset = () => {};
+    
+    functionsModal.open = () => {
+        functionsModal.classList.add("show-flex");
+    }
+    
+    functionsModal.close = () => {
+        functionsModal.classList.remove("show-flex");
+    }
     
     
     functionsModalCloseBtn.addEventListener("click", () => {
@@ -155,3 +295,26 @@ functionsModals.forEach(functionsModal => {
     });
     
 });
+
+
+// The functions schema is loaded asynchronously, instead of being rendered into the page,
+// and the function options of all functions modals are rendered from it once loaded.
+if (functionsModals.length) {
+    fetch(functionsSchemaUrl, { mode: 'same-origin' }).then((response) => {
+        if (!response.ok) {
+            throw new Error(`Failed to load functions schema: ${response.status}`);
+        }
+        return response.json();
+    }).then((data) => {
+        const functionOptions = makeFunctionOptions(data.data);
+
+        functionsModals.forEach(functionsModal => {
+            const mainOptionSet = functionsModal.querySelector(".function-options.options");
+            mainOptionSet.innerHTML = functionOptions;
+            setUpFunctionOptions(functionsModal);
+        });
+    }).catch((error) => {
+        console.error(error);
+        pushNotification("error", "Failed to load functions. Please reload the page.");
+    });
+}
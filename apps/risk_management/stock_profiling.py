@@ -1,78 +1,166 @@
 import datetime
-import decimal
 import functools
 import typing
 import uuid
-from concurrent.futures import ThreadPoolExecutor
+from django.db import models, connection
+from django.utils import timezone
+import math
+import multiprocessing
+import itertools
+import threading
+import collections
+import contextlib
+import contextvars
+import time
+import attrs
+from concurrent.futures import as_completed, wait, FIRST_COMPLETED
+from django.conf import settings
 
 from apps.accounts.models import UserAccount
 from apps.portfolios.models import Portfolio
-from apps.risk_management.models import RiskProfile
+from apps.risk_management.models import RiskProfile, RiskProfileRun
 from apps.stocks.models import Stock, StockIndices
 from apps.stocks.helpers import get_stocks_by_indices
+from apps.stocks.ohlcv import StockOHLCV, get_rate_versions, load_ohlcv
+from helpers import metrics
+from helpers.logging import log_exception
+from helpers.models.db import DatabaseExecutor, get_database_executor
+from helpers.utils.datetime import activate_timezone
 from helpers.utils.time import timeit
-from helpers.utils.datetime import timedelta_code_to_datetime_range, activate_timezone
-from .criteria.criteria import Criteria, evaluate_criteria, CriterionStatus
+from helpers.utils.misc import process_local
+from .criteria.criteria import (
+    Criteria,
+    evaluate_criteria,
+    CriterionStatus,
+    load_criteria_from_list,
+)
+from .criteria.functions import FUNCTIONS_REGISTRY, intern_function_spec
+from .criteria.profiling import (
+    EvaluationProfiler,
+    QueryCounter,
+    get_profiler,
+    profiled_function,
+    profiling,
+)
+from .vectorized import PRICE_FUNCTIONS, CriteriaPlan, compile_criteria
+from .indicator_cache import cached_evaluate
+from .function_evaluators import sharing_results
+from .profile_cache import (
+    evaluate_memoized,
+    get_many_stock_returns,
+    set_many_stock_returns,
+)
+from .returns import (
+    RETURN_PRICE_TOLERANCE,
+    ReturnWindow,
+    calculate_returns,
+    get_return_windows,
+)
 
 
-def get_stock_price_on_date(
-    stock: Stock,
-    date: datetime.date,
-    *,
-    tolerance: int = 5,
-    positive_tolerance: bool = False,
-) -> decimal.Decimal:
-    """
-    Get the price of a stock on a given date. If the price is not available for the given date,
-    the function will go back a number of days specified by the tolerance parameter to find the
-    closest available price.
-
-    :param stock: A Stock object to get the price for
-    :param date: The date to get the price for
-    :param tolerance: The number of days to go back if the price is not available for the given date
-    :param positive_tolerance: If True, the function will go forward in time instead of backwards
-    :return: The price of the stock on the given date
-    """
-    if tolerance < 1:
-        raise ValueError("Tolerance must be greater than 0")
-    
-    price = stock.get_price_on_date(date)
-    if price:
-        return price
-
-    for i in range(1, tolerance + 1):
-        if positive_tolerance:
-            previous_date = date + datetime.timedelta(days=i)
-        else:
-            previous_date = date - datetime.timedelta(days=i)
-        
-        price = stock.get_price_on_date(previous_date)
-        if not price:
-            continue
-        return price
-
-    return decimal.Decimal(0.0)
-
-
-def calculate_stock_percentage_return(
-    stock: Stock, start_date: datetime.date, end_date: datetime.date
-) -> decimal.Decimal:
-    """
-    Calculate the percentage return of a stock over a period of time.
-
-    :param stock: A Stock object to calculate the return for
-    :param start_date: The start date of the period
-    :param end_date: The end date of the period
-    :return: The percentage return of the stock
-    """
-    start_price = get_stock_price_on_date(stock, start_date, tolerance=10)
-    end_price = get_stock_price_on_date(stock, end_date, tolerance=10)
-    if not start_price or not end_price:
-        return decimal.Decimal(0.0)
-
-    return (((end_price - start_price) / start_price) * 100).quantize(
-        decimal.Decimal("0.01"), rounding=decimal.ROUND_HALF_UP
+PROFILED_RUN_SLOWEST_STOCKS = 20
+"""Number of slowest stocks kept in the summary of a profiled run"""
+
+PROFILE_GENERATION_SECONDS = metrics.histogram(
+    "risk_profile_generation_seconds",
+    "Time taken to load (generate) risk profiles",
+)
+
+RISK_PROFILE_CRITERIA_CACHE_SIZE = 256
+"""Maximum number of risk profiles whose loaded criteria are kept in memory"""
+_risk_profile_criteria: typing.OrderedDict[typing.Tuple, Criteria] = (
+    collections.OrderedDict()
+)
+_risk_profile_criteria_lock = threading.Lock()
+
+
+def get_risk_profile_criteria(risk_profile: RiskProfile) -> Criteria:
+    """
+    Returns the loaded criteria of the risk profile.
+
+    Criteria are loaded once per version (`updated_at`) of a risk profile,
+    and kept in (process) memory for the least recently used profiles.
+    Their function specs are interned, so identical specs across profiles
+    are shared. The returned criteria should not be modified.
+    """
+    key = (risk_profile.pk, risk_profile.updated_at)
+    with _risk_profile_criteria_lock:
+        criteria = _risk_profile_criteria.get(key, None)
+        if criteria is not None:
+            _risk_profile_criteria.move_to_end(key)
+            return criteria
+
+    criteria = Criteria(
+        [
+            attrs.evolve(
+                criterion,
+                func1=intern_function_spec(criterion.func1),
+                func2=intern_function_spec(criterion.func2),
+            )
+            for criterion in load_criteria_from_list(risk_profile.criteria)
+        ]
     )
+    with _risk_profile_criteria_lock:
+        _risk_profile_criteria[key] = criteria
+        _risk_profile_criteria.move_to_end(key)
+        while len(_risk_profile_criteria) > RISK_PROFILE_CRITERIA_CACHE_SIZE:
+            _risk_profile_criteria.popitem(last=False)
+    return criteria
+
+
+def get_criteria_lookback(criteria: Criteria) -> typing.Optional[datetime.timedelta]:
+    """
+    Returns how far back from the date it is evaluated on the criteria reads rates,
+    or None if it reads all rates.
+
+    Functions are evaluated on the rates within their `timeperiod` (in days), or on all rates
+    if they have none (e.g. OBV). Price functions (e.g. CLOSE) only read the latest rate.
+    """
+    lookback = datetime.timedelta(0)
+    for criterion in criteria:
+        for spec in (criterion.func1, criterion.func2):
+            if spec.name in PRICE_FUNCTIONS or spec.name not in FUNCTIONS_REGISTRY:
+                # Evaluated on the latest rate, or unsupported
+                continue
+
+            timeperiod = spec.kwargs.get("timeperiod", None)
+            if timeperiod is None:
+                return None
+            lookback = max(lookback, datetime.timedelta(days=float(timeperiod)))
+    return lookback
+
+
+def get_rates_since(
+    risk_profile: RiskProfile, criteria: Criteria
+) -> typing.Optional[datetime.datetime]:
+    """
+    Returns the time from which the rates of stocks are needed to generate
+    the risk profile (evaluate its criteria and calculate its returns),
+    or None if all rates are needed.
+
+    :param risk_profile: The risk profile to generate
+    :param criteria: The criteria the stocks are evaluated against
+    """
+    lookback = get_criteria_lookback(criteria)
+    if lookback is None:
+        return None
+
+    with activate_timezone(risk_profile.owner.timezone):
+        windows = get_return_windows(risk_profile)
+        tolerance = datetime.timedelta(days=RETURN_PRICE_TOLERANCE)
+        since = min(
+            [
+                timezone.now().date() - lookback,
+                *(window.start - tolerance for window in windows),
+            ]
+        )
+        # A day earlier, as timeperiods are counted back from the date they
+        # are evaluated on, which may be after the rates are loaded
+        return timezone.make_aware(
+            datetime.datetime.combine(
+                since - datetime.timedelta(days=1), datetime.time.min
+            )
+        )
 
 
 def calculate_percentage_ranking(
@@ -84,60 +172,236 @@ def calculate_percentage_ranking(
     return round((score / expected_score) * 100)
 
 
-PERCENTAGE_RETURN_INDICATORS_TIMEDELTA_CODES = (
-    "1D",
-    "3D",
-    "1W",
-    "1M",
-    "YTD",
-)
+def calculate_stock_returns(
+    stock: StockOHLCV,
+    risk_profile: RiskProfile,
+    *,
+    windows: typing.Optional[typing.Sequence[ReturnWindow]] = None,
+) -> dict:
+    """
+    Calculates the close price and period returns of a stock, as shown in its profile.
+
+    Should be called with the risk profile owner's timezone activated,
+    as the default return periods are relative to today.
+
+    :param stock: The stock's OHLCV snapshot
+    :param risk_profile: The risk profile defining the user defined return period
+    :param windows: The risk profile's return windows, if already resolved
+    :return: A dictionary of the stock's close price and period returns
+    """
+    if windows is None:
+        windows = get_return_windows(risk_profile)
+    return calculate_returns([stock], windows)[0]
 
 
-@timeit
 def generate_stock_profile(
-    stock: Stock, criteria: Criteria, risk_profile: RiskProfile
+    stock: StockOHLCV,
+    criteria: Criteria,
+    risk_profile: RiskProfile,
+    *,
+    evaluation_result: typing.Optional[typing.Dict[str, CriterionStatus]] = None,
+    percentage_ranking: typing.Optional[int] = None,
+    stock_returns: typing.Optional[dict] = None,
 ) -> dict:
     """
     Generates the risk profile for a single stock.
 
-    :param stock: A Stock object to evaluate
+    :param stock: The OHLCV snapshot of the stock to evaluate
     :param criteria: The criteria to evaluate the stock against
+    :param evaluation_result: The stock's criteria evaluation result, if already evaluated
+    :param percentage_ranking: The stock's percentage ranking, if already calculated
+    :param stock_returns: The stock's close price and period returns, if already calculated
     :return: A dictionary containing the stock's profile and evaluation
     """
     stock_profile = {
         # First add the basic information about the stock
         "symbol": stock.ticker,
-        "close": stock.price
     }
 
     with activate_timezone(risk_profile.owner.timezone):
-        # Calculate the percentage return for the stock over user defined time periods
-        if risk_profile.period_return_start and risk_profile.period_return_end:
-            percentage_return = calculate_stock_percentage_return(
-                stock, risk_profile.period_return_start, risk_profile.period_return_end
-            )
-            # period = f"{risk_profile.period_return_start.strftime("%d.%m.%Y")} - {risk_profile.period_return_end.strftime("%d.%m.%Y")}"
-            stock_profile["period return (%)"] = float(percentage_return)
-
-        # Calculate the percentage return for the stock over different (default) time periods
-        # Update the stock profile with the percentage return for each time period
-        for timedelta_code in PERCENTAGE_RETURN_INDICATORS_TIMEDELTA_CODES:
-            start, end = timedelta_code_to_datetime_range(timedelta_code)
-            percentage_return = calculate_stock_percentage_return(
-                stock, start.date(), end.date()
-            )
-            stock_profile[f"{timedelta_code} return (%)"] = float(percentage_return)
-
-        evaluation_result = evaluate_criteria(stock, criteria=criteria)
+        if stock_returns is None:
+            stock_returns = calculate_stock_returns(stock, risk_profile)
+        stock_profile.update(stock_returns)
+
+        if evaluation_result is None:
+            with sharing_results():
+                evaluation_result = evaluate_criteria(
+                    stock, criteria=criteria, evaluate=cached_evaluate
+                )
         stock_profile.update(evaluation_result)
-        percentage_ranking = calculate_percentage_ranking(evaluation_result)
+        if percentage_ranking is None:
+            percentage_ranking = calculate_percentage_ranking(evaluation_result)
         # This is the percentage ranking of the stock based on the evaluation result
         # It should be the last key in the dictionary
         stock_profile["EK score (%)"] = percentage_ranking
     return stock_profile
 
 
-@timeit
+def generate_chunk_profiles(
+    snapshots: typing.List[StockOHLCV],
+    criteria: Criteria,
+    risk_profile: RiskProfile,
+    *,
+    plan: typing.Optional[CriteriaPlan] = None,
+    windows: typing.Optional[typing.Sequence[ReturnWindow]] = None,
+) -> typing.List[dict]:
+    """
+    Generates the profiles of a chunk of stocks, evaluating the criteria on,
+    and calculating the period returns of, all the stocks in the chunk at once.
+
+    Criterion statuses and period returns already in the profile cache
+    are reused, and only the rest are evaluated (see `profile_cache`).
+
+    Stocks whose profiles cannot be generated are logged and skipped.
+
+    :param snapshots: OHLCV snapshots of the stocks to profile
+    :param criteria: The criteria to evaluate the stocks against
+    :param risk_profile: The risk profile being generated
+    :param plan: The compiled criteria. Compiled from `criteria` if not provided.
+    :param windows: The risk profile's return windows. Resolved if not provided.
+    """
+    plan = plan or compile_criteria(criteria)
+    with activate_timezone(risk_profile.owner.timezone), sharing_results():
+        # Cached results are keyed by the stocks' rate versions, fetched once for all
+        versions = get_rate_versions(snapshot.pk for snapshot in snapshots)
+        evaluation = evaluate_memoized(plan, snapshots, versions=versions)
+        stock_returns = get_many_stock_returns(
+            snapshots, risk_profile, versions=versions
+        )
+
+        missing = [
+            index for index in range(len(snapshots)) if index not in stock_returns
+        ]
+        if missing:
+            if windows is None:
+                windows = get_return_windows(risk_profile)
+            with profiled_function("period returns", calls=len(missing)):
+                calculated_returns = calculate_returns(
+                    [snapshots[index] for index in missing], windows
+                )
+            stock_returns.update(zip(missing, calculated_returns))
+            set_many_stock_returns(
+                [
+                    (snapshots[index], returns)
+                    for index, returns in zip(missing, calculated_returns)
+                ],
+                risk_profile,
+                versions=versions,
+            )
+
+    profiles = []
+    for index, (snapshot, ek_score) in enumerate(zip(snapshots, evaluation.ek_scores)):
+        try:
+            profiles.append(
+                generate_stock_profile(
+                    snapshot,
+                    criteria,
+                    risk_profile,
+                    evaluation_result=evaluation.result(index),
+                    percentage_ranking=ek_score,
+                    stock_returns=stock_returns[index],
+                )
+            )
+        except Exception as exc:
+            log_exception(exc)
+    return profiles
+
+
+@process_local
+def get_profile_executor() -> DatabaseExecutor:
+    """
+    Returns the process-wide pool stocks are evaluated in by the "thread" executor,
+    sized by `settings.RISK_PROFILE_GENERATION_WORKERS`.
+
+    Evaluation is CPU bound, so it gets its own pool, sized for it, rather than the
+    shared database executor. Profiles generated concurrently (e.g. by concurrent
+    requests) share its workers, so it bounds the evaluating threads of the process.
+    """
+    return DatabaseExecutor(
+        max_workers=settings.RISK_PROFILE_GENERATION_WORKERS,
+        thread_name_prefix="profile-executor",
+    )
+
+
+def generate_stock_profiles(
+    snapshots: typing.List[StockOHLCV],
+    criteria: Criteria,
+    risk_profile: RiskProfile,
+    *,
+    executor: typing.Optional[str] = None,
+    max_workers: typing.Optional[int] = None,
+) -> typing.Iterator[dict]:
+    """
+    Generate the profiles of the given stocks, yielding them in completion order.
+
+    The stocks are split into chunks, and the criteria is evaluated
+    on all stocks in a chunk at once (see `vectorized.CriteriaPlan`).
+
+    :param snapshots: OHLCV snapshots of the stocks to profile
+    :param criteria: The criteria to evaluate the stocks against
+    :param risk_profile: The risk profile being generated
+    :param executor: "process" to evaluate the stocks in a pool of worker processes,
+        or "thread" to evaluate them in threads. Defaults to `settings.RISK_PROFILE_GENERATION_EXECUTOR`.
+    :param max_workers: Number of workers of a pool dedicated to this call (e.g. for benchmarks).
+        Defaults to the process-wide pool of the executor, sized by `settings.RISK_PROFILE_GENERATION_WORKERS`.
+    """
+    executor = executor or settings.RISK_PROFILE_GENERATION_EXECUTOR
+
+    # Return windows are relative to today, so they are resolved once for all stocks
+    with activate_timezone(risk_profile.owner.timezone):
+        windows = get_return_windows(risk_profile)
+
+    # Daemonic processes (e.g. django-q workers) cannot have child processes,
+    # and evaluations in other processes cannot be profiled
+    if (
+        executor == "process"
+        and not multiprocessing.current_process().daemon
+        and get_profiler() is None
+    ):
+        from .parallel import generate_stock_profiles_in_processes
+
+        yield from generate_stock_profiles_in_processes(
+            snapshots, criteria, risk_profile, windows, max_workers=max_workers
+        )
+        return
+
+    workers = max_workers or settings.RISK_PROFILE_GENERATION_WORKERS
+    plan = compile_criteria(criteria)
+    chunk_size = math.ceil(len(snapshots) / (workers * 4)) or 1
+    chunks = [
+        snapshots[start : start + chunk_size]
+        for start in range(0, len(snapshots), chunk_size)
+    ]
+    # Chunks are evaluated in copies of the current context, so an active profiler
+    # (see `criteria.profiling`) also profiles the evaluations in the threads
+    context = contextvars.copy_context()
+    if max_workers:
+        pool = DatabaseExecutor(max_workers=max_workers)
+    else:
+        pool = contextlib.nullcontext(get_profile_executor())
+    with pool as thread_executor:
+        futures = [
+            thread_executor.submit(
+                context.copy().run,
+                generate_chunk_profiles,
+                chunk,
+                criteria,
+                risk_profile,
+                plan=plan,
+                windows=windows,
+            )
+            for chunk in chunks
+        ]
+        try:
+            for future in as_completed(futures):
+                yield from future.result()
+        finally:
+            # Chunks not started yet (e.g. if the caller stopped early) are not evaluated
+            for future in futures:
+                future.cancel()
+
+
+@timeit(histogram=PROFILE_GENERATION_SECONDS, output=False)
 def load_risk_profile(
     risk_profile: RiskProfile,
     stockset: str,
@@ -155,15 +419,120 @@ def load_risk_profile(
     if not stocks:
         return []
 
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        profiles = list(
-            executor.map(
-                lambda stock: generate_stock_profile(stock, criteria, risk_profile),
-                stocks,
+    since = get_rates_since(risk_profile, criteria)
+    snapshots = list(load_ohlcv(stocks, since=since).values())
+    return list(generate_stock_profiles(snapshots, criteria, risk_profile))
+
+
+def profile_risk_profile(
+    risk_profile: RiskProfile,
+    stockset: str,
+    criteria: Criteria,
+    *,
+    use_cache: bool = True,
+    save: bool = True,
+) -> typing.Tuple[list, RiskProfileRun]:
+    """
+    Load the risk profile for the given stockset and criteria, profiling
+    the evaluation of each function (see `criteria.profiling`).
+
+    :param risk_profile: The risk profile to load the profile for
+    :param stockset: The stockset to evaluate the profile against
+    :param criteria: The criteria to evaluate the stocks against
+    :param use_cache: Whether cached indicator values and criterion statuses may be used.
+        If False, all functions are evaluated afresh.
+    :param save: Whether to save the run
+    :return: The loaded profile, and the profiled run
+    """
+    profiler = EvaluationProfiler(use_cache=use_cache)
+    counter = QueryCounter()
+    start = time.perf_counter()
+    with profiling(profiler), connection.execute_wrapper(counter):
+        loaded_profile = load_risk_profile(risk_profile, stockset, criteria)
+
+    run = RiskProfileRun(
+        risk_profile=risk_profile,
+        stockset=stockset.lower(),
+        stock_count=len(loaded_profile),
+        wall_time=time.perf_counter() - start,
+        queries=counter.queries,
+        used_cache=use_cache,
+        summary=profiler.summary(top=PROFILED_RUN_SLOWEST_STOCKS),
+    )
+    if save:
+        run.save()
+    return loaded_profile, run
+
+
+def iter_stock_snapshots(
+    stocks: typing.Iterable[Stock],
+    *,
+    batch_size: int = 50,
+    since: typing.Optional[datetime.datetime] = None,
+) -> typing.Iterator[StockOHLCV]:
+    """
+    Lazily load the OHLCV snapshots of the stocks, one batch (query) at a time.
+
+    :param since: If provided, only rates added on or after this time are loaded.
+    """
+    stocks = iter(stocks)
+    while batch := list(itertools.islice(stocks, batch_size)):
+        yield from load_ohlcv(batch, since=since).values()
+
+
+def iter_risk_profile(
+    risk_profile: RiskProfile,
+    stockset: str,
+    criteria: Criteria,
+    *,
+    max_pending: int = 4,
+) -> typing.Iterator[dict]:
+    """
+    Generate the risk profile for the given stockset and criteria,
+    yielding each stock's profile as soon as it is generated, in completion order.
+
+    At most `max_pending` stocks are evaluated or awaiting evaluation at any time,
+    so memory usage does not grow with the size of the stockset. Stocks are evaluated
+    in the database executor (see `helpers.models.db`).
+
+    Stocks whose profiles cannot be generated are logged and skipped.
+
+    :param risk_profile: The risk profile to generate
+    :param stockset: The stockset to evaluate the profile against
+    :param criteria: The criteria to evaluate the stocks against
+    :param max_pending: Maximum number of stocks submitted for evaluation at a time
+    """
+    stocks = resolve_stockset(stockset, risk_profile)
+    if isinstance(stocks, models.QuerySet):
+        stocks = stocks.iterator(chunk_size=max_pending * 10)
+    stocks = iter_stock_snapshots(
+        stocks,
+        batch_size=max_pending * 10,
+        since=get_rates_since(risk_profile, criteria),
+    )
+
+    executor = get_database_executor()
+    pending = set()
+    exhausted = False
+    while True:
+        while not exhausted and len(pending) < max_pending:
+            stock = next(stocks, None)
+            if stock is None:
+                exhausted = True
+                break
+            pending.add(
+                executor.submit(generate_stock_profile, stock, criteria, risk_profile)
             )
-        )
 
-    return profiles
+        if not pending:
+            return
+
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                yield future.result()
+            except Exception as exc:
+                log_exception(exc)
 
 
 def portfolio_stockset(risk_profile: RiskProfile, portofolio_id: uuid.UUID):
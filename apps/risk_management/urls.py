@@ -7,6 +7,11 @@ app_name = "risk_management"
 
 urlpatterns = [
     path("", views.risk_management_view, name="risk_management"),
+    path(
+        "functions-schema",
+        views.functions_schema_view,
+        name="functions_schema",
+    ),
     path(
         "risk-profile/create",
         views.risk_profile_create_view,
@@ -27,4 +32,34 @@ urlpatterns = [
         views.stocks_risk_profile_generation_view,
         name="stocks_risk_profile_generation",
     ),
+    path(
+        "risk-profile/<uuid:profile_id>/generate/stream",
+        views.stocks_risk_profile_generation_stream_view,
+        name="stocks_risk_profile_generation_stream",
+    ),
+    path(
+        "risk-profile/<uuid:profile_id>/results",
+        views.risk_profile_result_set_view,
+        name="risk_profile_result_set",
+    ),
+    path(
+        "risk-profile/<uuid:profile_id>/backtest",
+        views.risk_profile_backtest_view,
+        name="risk_profile_backtest",
+    ),
+    path(
+        "risk-profile/<uuid:profile_id>/generate/jobs",
+        views.stocks_risk_profile_generation_job_create_view,
+        name="stocks_risk_profile_generation_job_create",
+    ),
+    path(
+        "risk-profile/generate/jobs/<str:job_id>",
+        views.stocks_risk_profile_generation_job_view,
+        name="stocks_risk_profile_generation_job",
+    ),
+    path(
+        "risk-profile/generate/jobs/<str:job_id>/cancel",
+        views.stocks_risk_profile_generation_job_cancel_view,
+        name="stocks_risk_profile_generation_job_cancel",
+    ),
 ]
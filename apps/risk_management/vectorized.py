@@ -0,0 +1,472 @@
+"""
+Cross-sectional (vectorized) criteria evaluation.
+
+Compiles a `Criteria` into a plan that evaluates it on many stocks at once.
+Functions with NumPy-native rolling forms are computed for all stocks in a single
+pass over a (stocks x bars) matrix of their rates, and comparisons are run as
+boolean array operations. Other functions fall back to per-stock evaluation
+(through `incremental.evaluate_many`) within the same plan, backed by the shared indicator cache.
+
+The vectorized functions reproduce the latest value TA-LIB would return for each stock,
+following the same rules for insufficient data (NaN), no data (0) and invalid parameters (error).
+"""
+
+import math
+import operator
+import typing
+import attrs
+import numpy as np
+
+from apps.stocks.ohlcv import StockOHLCV, get_rate_versions
+from .arg_evaluators import get_timeperiod_start_date
+from . import incremental
+from .criteria import functions
+from .indicator_cache import get_many_indicator_values, set_many_indicator_values
+from .criteria.criteria import Criteria, CriterionStatus
+from .criteria.comparisons import ComparisonOperator
+from .criteria.profiling import profiled_function
+
+
+MAX_TIMEPERIOD = 100_000
+
+
+@attrs.define(slots=True)
+class RateMatrix:
+    """
+    Rate field values of many stocks, as a (stocks x bars) matrix.
+
+    Rows are right-aligned, that is, the latest value of each stock is in the last column,
+    and rows of stocks with fewer rates are padded with NaN on the left.
+    """
+
+    values: np.ndarray
+    lengths: np.ndarray
+    """Number of rates of each stock"""
+
+    @property
+    def starts(self) -> np.ndarray:
+        """Column of the first value of each stock"""
+        return self.values.shape[1] - self.lengths
+
+    def column(self, offset: int) -> np.ndarray:
+        """
+        Returns the value `offset` bars before the latest, for each stock.
+
+        NaN for stocks with fewer than `offset + 1` values.
+        """
+        if offset >= self.values.shape[1]:
+            return np.full(len(self.lengths), np.nan)
+        return self.values[:, -1 - offset]
+
+    def window(self, size: int) -> np.ndarray:
+        """Returns the latest `size` values of each stock, as a (stocks x size) matrix"""
+        if size > self.values.shape[1]:
+            padding = np.full((len(self.lengths), size - self.values.shape[1]), np.nan)
+            return np.hstack([padding, self.values])
+        return self.values[:, self.values.shape[1] - size :]
+
+
+def build_rate_matrix(
+    snapshots: typing.Sequence[StockOHLCV], field: str, since=None
+) -> RateMatrix:
+    """Builds a `RateMatrix` of the field from the stocks' snapshots"""
+    rows = [snapshot.field(field, since=since) for snapshot in snapshots]
+    lengths = np.array([len(row) for row in rows], dtype=np.int64)
+    width = int(lengths.max()) if len(lengths) else 0
+    values = np.full((len(rows), width), np.nan)
+    for index, row in enumerate(rows):
+        if len(row):
+            values[index, width - len(row) :] = row
+    return RateMatrix(values, lengths)
+
+
+@attrs.define(slots=True)
+class VectorResult:
+    """Results of a function evaluated on many stocks"""
+
+    values: np.ndarray
+    """Float array of the result of each stock"""
+    errors: np.ndarray
+    """Boolean array. True for stocks whose evaluation returned `functions.Error`"""
+
+
+_VectorizedFunction = typing.Callable[[RateMatrix, int, typing.Mapping], np.ndarray]
+"""Takes a `RateMatrix`, the timeperiod and the function's kwargs. Returns the latest value of each stock"""
+
+
+@attrs.define(slots=True, frozen=True)
+class _VectorizedFunctionData:
+    func: _VectorizedFunction
+    field: str
+    min_timeperiod: int
+    lookback: typing.Callable[[int], int]
+    """Returns the number of values needed before the first output, for a timeperiod"""
+
+
+VECTORIZED_FUNCTIONS: typing.Dict[str, _VectorizedFunctionData] = {}
+
+
+def vectorized(
+    name: str,
+    *,
+    field: str = "close",
+    min_timeperiod: int = 2,
+    lookback: typing.Callable[[int], int] = lambda timeperiod: timeperiod - 1,
+):
+    """
+    Register a vectorized implementation of a (timeperiod based) function.
+
+    :param name: The name of the function in the functions registry
+    :param field: The rate field the function is evaluated on
+    :param min_timeperiod: The minimum timeperiod TA-LIB accepts for the function
+    :param lookback: Returns the number of values TA-LIB needs before the first output, for a timeperiod
+    """
+
+    def _decorator(func: _VectorizedFunction):
+        VECTORIZED_FUNCTIONS[name] = _VectorizedFunctionData(
+            func, field, min_timeperiod, lookback
+        )
+        return func
+
+    return _decorator
+
+
+@vectorized("SMA")
+def _sma(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+    return matrix.window(timeperiod).sum(axis=1) / timeperiod
+
+
+@vectorized("SUM")
+def _sum(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+    return matrix.window(timeperiod).sum(axis=1)
+
+
+@vectorized("MAX")
+def _max(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+    return matrix.window(timeperiod).max(axis=1)
+
+
+@vectorized("MIN")
+def _min(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+    return matrix.window(timeperiod).min(axis=1)
+
+
+def _variance(matrix: RateMatrix, timeperiod: int) -> np.ndarray:
+    window = matrix.window(timeperiod)
+    mean = window.sum(axis=1) / timeperiod
+    mean_of_squares = (window * window).sum(axis=1) / timeperiod
+    return mean_of_squares - mean * mean
+
+
+@vectorized("VAR", min_timeperiod=1)
+def _var(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+    # TA-LIB's VAR does not apply `nbdev`
+    return _variance(matrix, timeperiod)
+
+
+@vectorized("STDDEV")
+def _stddev(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+    variance = _variance(matrix, timeperiod)
+    with np.errstate(invalid="ignore"):
+        stddev = np.where(variance > 0, np.sqrt(variance), 0.0)
+    return np.where(np.isnan(variance), np.nan, stddev) * kwargs.get("nbdev", 1)
+
+
+@vectorized("EMA")
+def _ema(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+    values, starts = matrix.values, matrix.starts
+    rows = np.arange(len(starts))
+    width = values.shape[1]
+    seed_columns = starts + timeperiod - 1
+    has_seed = seed_columns < width
+    if not width:
+        # None of the stocks have values
+        return np.full(len(starts), np.nan)
+
+    # Seed with the simple average of the first `timeperiod` values, summed in order, as TA-LIB does
+    seed = np.zeros(len(starts))
+    for offset in range(timeperiod):
+        columns = np.minimum(starts + offset, width - 1)
+        seed += np.where(has_seed, values[rows, columns], 0.0)
+    ema = np.where(has_seed, seed / timeperiod, np.nan)
+
+    k = 2.0 / (timeperiod + 1)
+    if has_seed.any():
+        for column in range(int(seed_columns[has_seed].min()) + 1, width):
+            active = has_seed & (column > seed_columns)
+            ema = np.where(active, ((values[:, column] - ema) * k) + ema, ema)
+    return ema
+
+
+def _change(
+    func: typing.Callable[[np.ndarray, np.ndarray], np.ndarray],
+) -> _VectorizedFunction:
+    """Vectorized form of TA-LIB's ROC family, which output 0 when the previous value is 0"""
+
+    def _vectorized(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+        current, previous = matrix.column(0), matrix.column(timeperiod)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result = func(current, previous)
+        return np.where(previous == 0, 0.0, result)
+
+    return _vectorized
+
+
+_change_lookback = dict(min_timeperiod=1, lookback=lambda timeperiod: timeperiod)
+
+vectorized("ROC", **_change_lookback)(
+    _change(lambda current, previous: ((current / previous) - 1.0) * 100.0)
+)
+vectorized("ROCP", **_change_lookback)(
+    _change(lambda current, previous: (current - previous) / previous)
+)
+vectorized("ROCR", **_change_lookback)(
+    _change(lambda current, previous: current / previous)
+)
+vectorized("ROCR100", **_change_lookback)(
+    _change(lambda current, previous: (current / previous) * 100.0)
+)
+
+
+@vectorized("MOM", **_change_lookback)
+def _mom(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+    return matrix.column(0) - matrix.column(timeperiod)
+
+
+def _linear_regression(
+    matrix: RateMatrix, timeperiod: int
+) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """Returns the (slope, intercept) of the least squares line through the latest values, as TA-LIB computes them"""
+    sum_x = timeperiod * (timeperiod - 1) * 0.5
+    sum_x_sqr = timeperiod * (timeperiod - 1) * (2 * timeperiod - 1) / 6
+    divisor = sum_x * sum_x - timeperiod * sum_x_sqr
+
+    sum_xy = np.zeros(len(matrix.lengths))
+    sum_y = np.zeros(len(matrix.lengths))
+    for offset in range(timeperiod):
+        value = matrix.column(offset)
+        sum_y += value
+        sum_xy += offset * value
+
+    slope = (timeperiod * sum_xy - sum_x * sum_y) / divisor
+    intercept = (sum_y - slope * sum_x) / timeperiod
+    return slope, intercept
+
+
+@vectorized("LINEARREG")
+def _linearreg(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+    slope, intercept = _linear_regression(matrix, timeperiod)
+    return intercept + slope * (timeperiod - 1)
+
+
+@vectorized("LINEARREG_SLOPE")
+def _linearreg_slope(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+    slope, _ = _linear_regression(matrix, timeperiod)
+    return slope
+
+
+@vectorized("LINEARREG_INTERCEPT")
+def _linearreg_intercept(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+    _, intercept = _linear_regression(matrix, timeperiod)
+    return intercept
+
+
+@vectorized("LINEARREG_ANGLE")
+def _linearreg_angle(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+    slope, _ = _linear_regression(matrix, timeperiod)
+    return np.arctan(slope) * (180.0 / math.pi)
+
+
+@vectorized("TSF")
+def _tsf(matrix: RateMatrix, timeperiod: int, kwargs) -> np.ndarray:
+    slope, intercept = _linear_regression(matrix, timeperiod)
+    return intercept + slope * timeperiod
+
+
+PRICE_FUNCTIONS = {
+    "OPEN": "open",
+    "HIGH": "high",
+    "LOW": "low",
+    "CLOSE": "close",
+    "VOLUME": "volume",
+}
+"""Functions that return a field of the latest rate, by function name"""
+
+
+def is_vectorizable(spec: functions.FunctionSpec) -> bool:
+    """Returns True if the function spec can be evaluated on many stocks at once"""
+    if spec.name in PRICE_FUNCTIONS:
+        return True
+
+    data = VECTORIZED_FUNCTIONS.get(spec.name, None)
+    if data is None:
+        return False
+    timeperiod = spec.kwargs.get("timeperiod", None)
+    # Leave TA-LIB's defaults and parameter validation to the per-stock evaluation
+    return (
+        isinstance(timeperiod, int)
+        and data.min_timeperiod <= timeperiod <= MAX_TIMEPERIOD
+    )
+
+
+_COMPARISONS: typing.Dict[ComparisonOperator, typing.Callable] = {
+    ComparisonOperator.GREATER_THAN: operator.gt,
+    ComparisonOperator.LESS_THAN: operator.lt,
+    ComparisonOperator.EQUALS: operator.eq,
+    ComparisonOperator.NOT_EQUALS: operator.ne,
+    ComparisonOperator.GREATER_OR_EQUALS: operator.ge,
+    ComparisonOperator.LESS_OR_EQUALS: operator.le,
+}
+
+
+@attrs.define(slots=True)
+class CriteriaEvaluation:
+    """Result of a criteria evaluation on many stocks"""
+
+    criteria: Criteria
+    statuses: np.ndarray
+    """(stocks x criteria) matrix of the criterion statuses (1 for passed, 0 for failed)"""
+
+    @property
+    def ek_scores(self) -> typing.List[int]:
+        """Percentage of the criteria passed by each stock"""
+        if not len(self.criteria):
+            return [0] * self.statuses.shape[0]
+        passed = self.statuses.sum(axis=1)
+        return [round((score / len(self.criteria)) * 100) for score in passed.tolist()]
+
+    def result(self, index: int) -> typing.Dict[str, CriterionStatus]:
+        """Returns the evaluation result of the stock at the index, as `evaluate_criteria` would"""
+        return {
+            str(criterion): CriterionStatus(int(status))
+            for criterion, status in zip(self.criteria, self.statuses[index])
+        }
+
+
+class CriteriaPlan:
+    """A compiled criteria, which evaluates the criteria on many stocks at once"""
+
+    def __init__(self, criteria: Criteria) -> None:
+        self.criteria = criteria
+        self.specs: typing.Dict[str, functions.FunctionSpec] = {}
+        """The distinct function specs in the criteria, by their repr"""
+        for criterion in criteria:
+            for spec in (criterion.func1, criterion.func2):
+                self.specs.setdefault(repr(spec), spec)
+
+        self.vectorized = {
+            key for key, spec in self.specs.items() if is_vectorizable(spec)
+        }
+        self.fallback = set(self.specs) - self.vectorized
+
+    def _evaluate_vectorized(
+        self,
+        spec: functions.FunctionSpec,
+        snapshots: typing.Sequence[StockOHLCV],
+        matrices: typing.Dict[typing.Tuple, RateMatrix],
+    ) -> VectorResult:
+        if spec.name in PRICE_FUNCTIONS:
+            field = PRICE_FUNCTIONS[spec.name]
+            key = (field, None)
+            timeperiod, data = None, None
+        else:
+            data = VECTORIZED_FUNCTIONS[spec.name]
+            timeperiod = spec.kwargs["timeperiod"]
+            field = data.field
+            key = (field, get_timeperiod_start_date(timeperiod))
+
+        if key not in matrices:
+            matrices[key] = build_rate_matrix(snapshots, *key)
+        matrix = matrices[key]
+
+        if data is None:
+            # The latest rate's value, and an error for stocks without rates
+            return VectorResult(matrix.column(0), matrix.lengths == 0)
+
+        values = np.asarray(data.func(matrix, timeperiod, spec.kwargs), dtype=float)
+        # Not enough values for an output
+        values = np.where(matrix.lengths <= data.lookback(timeperiod), np.nan, values)
+        # No values at all. TA-LIB returns an empty result, which evaluates to 0
+        values = np.where(matrix.lengths == 0, 0.0, values)
+        return VectorResult(values, np.zeros(len(snapshots), dtype=bool))
+
+    def _evaluate_fallback(
+        self,
+        specs: typing.List[functions.FunctionSpec],
+        snapshots: typing.Sequence[StockOHLCV],
+    ) -> typing.List[VectorResult]:
+        """
+        Evaluate the specs on each stock, one stock at a time.
+
+        Values cached in the indicator cache are fetched in one round trip
+        and only the rest are evaluated (reading incremental indicator states
+        where possible), then cached.
+        """
+        versions = get_rate_versions(snapshot.pk for snapshot in snapshots)
+        cached = get_many_indicator_values(snapshots, specs, versions=versions)
+        missing = [
+            (stock_index, spec_index)
+            for spec_index in range(len(specs))
+            for stock_index in range(len(snapshots))
+            if (stock_index, spec_index) not in cached
+        ]
+        evaluated = incremental.evaluate_many(
+            [
+                (snapshots[stock_index], specs[spec_index])
+                for stock_index, spec_index in missing
+            ]
+        )
+        cached.update(zip(missing, evaluated))
+        set_many_indicator_values(
+            [
+                (snapshots[stock_index], specs[spec_index], result)
+                for (stock_index, spec_index), result in zip(missing, evaluated)
+            ],
+            versions=versions,
+        )
+
+        results = []
+        for spec_index in range(len(specs)):
+            values = np.full(len(snapshots), np.nan)
+            errors = np.zeros(len(snapshots), dtype=bool)
+            for stock_index in range(len(snapshots)):
+                result = cached[(stock_index, spec_index)]
+                if isinstance(result, functions.Error):
+                    errors[stock_index] = True
+                else:
+                    values[stock_index] = float(result)
+            results.append(VectorResult(values, errors))
+        return results
+
+    def evaluate(self, snapshots: typing.Sequence[StockOHLCV]) -> CriteriaEvaluation:
+        """
+        Evaluate the criteria on the stocks
+
+        :param snapshots: OHLCV snapshots of the stocks to evaluate the criteria on
+        :return: The evaluation result
+        """
+        matrices: typing.Dict[typing.Tuple, RateMatrix] = {}
+        results: typing.Dict[str, VectorResult] = {}
+        for key in self.vectorized:
+            spec = self.specs[key]
+            with profiled_function(spec.name, calls=len(snapshots)):
+                results[key] = self._evaluate_vectorized(spec, snapshots, matrices)
+        fallback = list(self.fallback)
+        fallback_results = self._evaluate_fallback(
+            [self.specs[key] for key in fallback], snapshots
+        )
+        results.update(zip(fallback, fallback_results))
+
+        statuses = np.zeros((len(snapshots), len(self.criteria)), dtype=np.int8)
+        for column, criterion in enumerate(self.criteria):
+            a = results[repr(criterion.func1)]
+            b = results[repr(criterion.func2)]
+            compare = _COMPARISONS[criterion.op]
+            passed = compare(a.values, b.values) & ~a.errors & ~b.errors
+            statuses[:, column] = passed
+        return CriteriaEvaluation(self.criteria, statuses)
+
+
+def compile_criteria(criteria: Criteria) -> CriteriaPlan:
+    """Compile the criteria into a plan for evaluating it on many stocks at once"""
+    return CriteriaPlan(criteria)
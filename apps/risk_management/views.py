@@ -1,22 +1,57 @@
 import json
 import typing
+from django.conf import settings
 from django.db import models
 from django.views import generic
-from django.http import JsonResponse
+from django.http import (
+    HttpResponse,
+    HttpResponseNotModified,
+    JsonResponse,
+    Http404,
+    StreamingHttpResponse,
+)
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+from django.core.serializers.json import DjangoJSONEncoder
 from django.urls import reverse
-from django.shortcuts import get_object_or_404, redirect
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect
 from django.contrib.auth.mixins import LoginRequiredMixin
 
-from .criteria.functions import generate_functions_schema
 from .criteria.comparisons import ComparisonOperator
-from .criteria.criteria import load_criteria_from_list
+from .criteria.profiling import format_summary
 from helpers.exceptions import capture
+from helpers.models.db import database_sync_to_async, executor_sync_to_async
+from helpers.views.mixins import AsyncLoginRequiredMixin
 from .models import RiskProfile
-from .forms import RiskProfileForm, RiskProfileUpdateForm
+from .forms import (
+    RiskProfileForm,
+    RiskProfileUpdateForm,
+    RiskProfileBacktestForm,
+    RiskProfileResultSetForm,
+)
 from .stock_profiling import (
+    get_risk_profile_criteria,
     load_risk_profile,
+    profile_risk_profile,
+    iter_risk_profile,
     get_available_stocksets_for_user,
 )
+from .jobs import (
+    start_profile_job,
+    cancel_profile_job,
+    get_job,
+    get_job_progress,
+    get_job_rows,
+)
+from .snapshots import aget_current_snapshot, get_current_snapshot
+from .functions_schema import get_functions_schema
+from .backtest import backtest_risk_profile
+from .result_sets import (
+    get_result_set,
+    make_result_set,
+    query_result_set,
+    save_result_set,
+)
 
 
 risk_profile_qs = RiskProfile.objects.select_related("owner").all()
@@ -30,15 +65,15 @@ class RiskManagementView(LoginRequiredMixin, generic.TemplateView):
         risk_profiles = risk_profile_qs.filter(owner=self.request.user)
         context_data["risk_profiles"] = risk_profiles
 
-        functions_schema = generate_functions_schema(grouped=True)
         operators_schema = {
             op.name.replace("_", " ").upper(): op.value for op in ComparisonOperator
         }
         criterion_schema = {
-            "functions_schema": functions_schema,
             "operators_schema": operators_schema,
         }
         context_data["criterion_schema"] = criterion_schema
+        # The functions schema is fetched by the page from `FunctionsSchemaView`
+        context_data["functions_schema_etag"] = get_functions_schema().etag
 
         context_data["available_stocksets"] = get_available_stocksets_for_user(
             self.request.user
@@ -46,6 +81,39 @@ class RiskManagementView(LoginRequiredMixin, generic.TemplateView):
         return context_data
 
 
+class FunctionsSchemaView(LoginRequiredMixin, generic.View):
+    """
+    Serves the precomputed (grouped) functions schema.
+
+    Responses carry the schema's ETag. Requests for the current version of the schema
+    (with `?v=<etag>`) may be cached indefinitely, others must be revalidated.
+    """
+
+    http_method_names = ["get"]
+    cache_max_age = 60 * 60 * 24 * 365
+
+    def get(self, request, *args: typing.Any, **kwargs: typing.Any) -> HttpResponse:
+        functions_schema = get_functions_schema()
+        etag = quote_etag(functions_schema.etag)
+
+        if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+        if etag in if_none_match or "*" in if_none_match:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                functions_schema.content, content_type="application/json"
+            )
+        response["ETag"] = etag
+
+        if request.GET.get("v", None) == functions_schema.etag:
+            patch_cache_control(
+                response, private=True, max_age=self.cache_max_age, immutable=True
+            )
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
 @capture.enable
 class RiskProfileCreateView(LoginRequiredMixin, generic.View):
     http_method_names = ["post"]
@@ -143,7 +211,15 @@ class RiskProfileDeleteView(LoginRequiredMixin, generic.View):
 
 
 @capture.enable
-class StocksRiskProfileGenerationView(LoginRequiredMixin, generic.View):
+class StocksRiskProfileGenerationView(AsyncLoginRequiredMixin, generic.View):
+    """
+    Returns the risk profile's rows for the stockset.
+
+    The view is async, so that (under ASGI) requests waiting on profile generation,
+    which runs in a worker thread, do not hold up other requests.
+    Subclasses may still define sync handlers.
+    """
+
     http_method_names = ["get"]
     queryset = risk_profile_qs
 
@@ -152,23 +228,36 @@ class StocksRiskProfileGenerationView(LoginRequiredMixin, generic.View):
         qs = self.queryset
         return qs.filter(owner=user)
 
+    def get_object_queryset(self) -> models.QuerySet[RiskProfile]:
+        return self.get_queryset().prefetch_related(
+            "owner__portfolios",
+            "owner__portfolios__investments",
+            "owner__portfolios__investments__stock",
+        )
+
     def get_object(self):
         return get_object_or_404(
-            self.get_queryset().prefetch_related(
-                "owner__portfolios",
-                "owner__portfolios__investments",
-                "owner__portfolios__investments__stock",
-            ),
-            id=self.kwargs["profile_id"],
+            self.get_object_queryset(), id=self.kwargs["profile_id"]
+        )
+
+    async def aget_object(self):
+        return await aget_object_or_404(
+            self.get_object_queryset(), id=self.kwargs["profile_id"]
         )
 
     @capture.capture(content="Oops! An error occurred")
-    def get(self, request, *args: typing.Any, **kwargs: typing.Any) -> JsonResponse:
+    async def get(
+        self, request, *args: typing.Any, **kwargs: typing.Any
+    ) -> JsonResponse:
         stockset = request.GET.get("stockset", "kse100")
-        risk_profile = self.get_object()
+        risk_profile = await self.aget_object()
 
-        criteria = load_criteria_from_list(risk_profile.criteria)
-        loaded_profile = load_risk_profile(risk_profile, stockset, criteria)
+        if settings.RISK_PROFILE_PROFILING and request.GET.get("profile", None):
+            return await database_sync_to_async(self.get_profiled)(
+                risk_profile, stockset
+            )
+
+        loaded_profile = await self.aget_rows(risk_profile, stockset)
         return JsonResponse(
             data={
                 "status": "success",
@@ -178,10 +267,338 @@ class StocksRiskProfileGenerationView(LoginRequiredMixin, generic.View):
             status=200,
         )
 
+    def get_rows(self, risk_profile: RiskProfile, stockset: str) -> list:
+        """Returns the rows of the risk profile's current snapshot, or generates them"""
+        snapshot = get_current_snapshot(risk_profile, stockset)
+        if snapshot is not None:
+            return snapshot.rows
+        criteria = get_risk_profile_criteria(risk_profile)
+        return load_risk_profile(risk_profile, stockset, criteria)
+
+    async def aget_rows(self, risk_profile: RiskProfile, stockset: str) -> list:
+        """Async version of `get_rows`. Profiles are generated in the database executor."""
+        snapshot = await aget_current_snapshot(risk_profile, stockset)
+        if snapshot is not None:
+            return snapshot.rows
+        criteria = get_risk_profile_criteria(risk_profile)
+        return await executor_sync_to_async(load_risk_profile)(
+            risk_profile, stockset, criteria
+        )
+
+    def get_profiled(self, risk_profile: RiskProfile, stockset: str) -> JsonResponse:
+        """
+        Generate the risk profile with function evaluations profiled, bypassing snapshots.
+
+        The run is saved, and its ID and a summary of the slowest functions
+        are returned in the `X-Risk-Profile-Run` and `X-Risk-Profile-Summary` headers.
+        Cached values are not used if the `cache` query parameter is "false".
+        """
+        use_cache = self.request.GET.get("cache", "true").lower() != "false"
+        criteria = get_risk_profile_criteria(risk_profile)
+        loaded_profile, run = profile_risk_profile(
+            risk_profile, stockset, criteria, use_cache=use_cache
+        )
+        response = JsonResponse(
+            data={
+                "status": "success",
+                "detail": "Risk profile generated successfully",
+                "data": loaded_profile,
+            },
+            status=200,
+        )
+        response["X-Risk-Profile-Run"] = str(run.id)
+        response["X-Risk-Profile-Summary"] = format_summary(run.summary)
+        return response
+
+
+@capture.enable
+class StocksRiskProfileGenerationStreamView(StocksRiskProfileGenerationView):
+    """
+    Streams the risk profile as newline-delimited JSON (NDJSON),
+    one line per stock, as soon as each stock's profile is generated.
+    """
+
+    @capture.capture(content="Oops! An error occurred")
+    def get(
+        self, request, *args: typing.Any, **kwargs: typing.Any
+    ) -> StreamingHttpResponse:
+        stockset = request.GET.get("stockset", "kse100")
+        risk_profile = self.get_object()
+        criteria = get_risk_profile_criteria(risk_profile)
+
+        def stream():
+            encoder = DjangoJSONEncoder()
+            for stock_profile in iter_risk_profile(risk_profile, stockset, criteria):
+                yield encoder.encode(stock_profile) + "\n"
+
+        response = StreamingHttpResponse(
+            stream(), content_type="application/x-ndjson", status=200
+        )
+        # Prevent proxies (e.g. Nginx) from buffering the streamed rows
+        response["X-Accel-Buffering"] = "no"
+        response["Cache-Control"] = "no-cache"
+        return response
+
+
+@capture.enable
+class RiskProfileResultSetView(StocksRiskProfileGenerationView):
+    """
+    Returns a sorted, filtered page of the risk profile's rows.
+
+    The rows are generated once, and cached as a result set (see `result_sets`),
+    whose run ID is returned. Subsequent requests with the `run` query parameter
+    are served from the result set, until it expires.
+
+    Query parameters:
+    - `filter`: (repeatable) condition on a numeric column, e.g. "EK score (%)>=70"
+    - `sort` and `order` ("asc" or "desc"): the column to sort the rows by, and the order
+    - `top`: only paginate the first `top` rows, after sorting
+    - `page` and `page_size`
+    """
+
+    @capture.capture(content="Oops! An error occurred")
+    def get(self, request, *args: typing.Any, **kwargs: typing.Any) -> JsonResponse:
+        form = RiskProfileResultSetForm(data=request.GET)
+        if not form.is_valid():
+            return JsonResponse(
+                data={
+                    "status": "error",
+                    "detail": "An error occurred",
+                    "errors": form.errors,
+                },
+                status=400,
+            )
+
+        params = form.cleaned_data
+        risk_profile = self.get_object()
+        result_set = None
+        if params["run"]:
+            result_set = get_result_set(params["run"])
+        if (
+            result_set is None
+            or result_set.risk_profile_id != str(risk_profile.id)
+            or result_set.stockset != params["stockset"].lower()
+        ):
+            rows = self.get_rows(risk_profile, params["stockset"])
+            result_set = make_result_set(
+                rows, risk_profile_id=risk_profile.id, stockset=params["stockset"]
+            )
+            save_result_set(result_set)
+
+        try:
+            data = query_result_set(
+                result_set,
+                filters=params["filters"],
+                sort=params["sort"] or None,
+                descending=params["order"] == "desc",
+                top=params["top"],
+                page=params["page"],
+                page_size=params["page_size"],
+            )
+        except KeyError as exc:
+            return JsonResponse(
+                data={
+                    "status": "error",
+                    "detail": "An error occurred",
+                    "errors": {"__all__": [f"Unknown column: {exc.args[0]}"]},
+                },
+                status=400,
+            )
+        return JsonResponse(
+            data={
+                "status": "success",
+                "detail": "Risk profile results retrieved successfully",
+                "data": data,
+            },
+            status=200,
+        )
+
+
+@capture.enable
+class RiskProfileBacktestView(StocksRiskProfileGenerationView):
+    """
+    Backtests the risk profile's criteria on a stockset, at every trading date.
+
+    Returns the hit rate and forward returns of the signals (dates on which a stock's
+    EK score reached the `threshold`), and the mean EK score at each date.
+    If the `stock` query parameter (a ticker) is provided, the stock's criterion
+    statuses, EK scores and forward returns at each date are also returned.
+    """
+
+    @capture.capture(content="Oops! An error occurred")
+    def get(self, request, *args: typing.Any, **kwargs: typing.Any) -> JsonResponse:
+        form = RiskProfileBacktestForm(data=request.GET)
+        if not form.is_valid():
+            return JsonResponse(
+                data={
+                    "status": "error",
+                    "detail": "An error occurred",
+                    "errors": form.errors,
+                },
+                status=400,
+            )
+
+        params = form.cleaned_data
+        risk_profile = self.get_object()
+        backtest = backtest_risk_profile(
+            risk_profile, params["stockset"], since=params["since"]
+        )
+        data = {
+            "summary": backtest.summary(
+                threshold=params["threshold"], horizons=params["horizons"]
+            ),
+            "ek_scores": backtest.ek_score_series(threshold=params["threshold"]),
+        }
+        if params["stock"]:
+            ticker = params["stock"].upper()
+            stock = next(
+                (stock for stock in backtest.stocks if stock.ticker.upper() == ticker),
+                None,
+            )
+            if stock is None:
+                raise Http404("Stock not found in stockset")
+            data["stock"] = stock.as_dict(
+                threshold=params["threshold"], horizons=params["horizons"]
+            )
+
+        return JsonResponse(
+            data={
+                "status": "success",
+                "detail": "Risk profile backtested successfully",
+                "data": data,
+            },
+            status=200,
+        )
+
+
+@capture.enable
+class StocksRiskProfileGenerationJobCreateView(LoginRequiredMixin, generic.View):
+    """Starts a background job that generates the risk profile for a stockset."""
+
+    http_method_names = ["post"]
+    queryset = risk_profile_qs
+
+    def get_queryset(self) -> models.QuerySet[RiskProfile]:
+        user = self.request.user
+        qs = self.queryset
+        return qs.filter(owner=user)
+
+    def get_object(self):
+        return get_object_or_404(self.get_queryset(), id=self.kwargs["profile_id"])
+
+    @capture.capture(content="Oops! An error occurred")
+    def post(self, request, *args: typing.Any, **kwargs: typing.Any) -> JsonResponse:
+        stockset = request.GET.get("stockset", "kse100")
+        risk_profile = self.get_object()
+
+        job = start_profile_job(risk_profile, stockset)
+        return JsonResponse(
+            data={
+                "status": "success",
+                "detail": "Risk profile generation started",
+                "data": {
+                    "job_id": job["id"],
+                    "progress": get_job_progress(job),
+                    "status_url": reverse(
+                        "risk_management:stocks_risk_profile_generation_job",
+                        kwargs={"job_id": job["id"]},
+                    ),
+                    "cancel_url": reverse(
+                        "risk_management:stocks_risk_profile_generation_job_cancel",
+                        kwargs={"job_id": job["id"]},
+                    ),
+                },
+            },
+            status=202,
+        )
+
+
+class RiskProfileGenerationJobMixin:
+    """Mixin for views that operate on a risk profile generation job owned by the user."""
+
+    def get_job(self) -> typing.Dict[str, typing.Any]:
+        job = get_job(self.kwargs["job_id"])
+        if not job or job["owner_id"] != self.request.user.id:
+            raise Http404("Job not found")
+        return job
+
+
+@capture.enable
+class StocksRiskProfileGenerationJobView(
+    LoginRequiredMixin, RiskProfileGenerationJobMixin, generic.View
+):
+    """
+    Returns the progress of a risk profile generation job and the rows generated so far.
+
+    Pollers should pass the `cursor` of the previous response as `?since=`,
+    to only fetch the rows generated since.
+    """
+
+    http_method_names = ["get"]
+
+    @capture.capture(content="Oops! An error occurred")
+    def get(self, request, *args: typing.Any, **kwargs: typing.Any) -> JsonResponse:
+        job = self.get_job()
+        # Cursor returned by the previous poll, so only rows generated since are returned
+        since = request.GET.get("since", "0")
+        since = int(since) if since.isdigit() else 0
+
+        progress = get_job_progress(job)
+        rows, cursor = get_job_rows(job, since=since)
+        return JsonResponse(
+            data={
+                "status": "success",
+                "detail": "Risk profile generation progress retrieved successfully",
+                "data": {
+                    "job_id": job["id"],
+                    "progress": progress,
+                    "rows": rows,
+                    "cursor": cursor,
+                },
+            },
+            status=200,
+        )
+
+
+@capture.enable
+class StocksRiskProfileGenerationJobCancelView(
+    LoginRequiredMixin, RiskProfileGenerationJobMixin, generic.View
+):
+    http_method_names = ["post"]
+
+    @capture.capture(content="Oops! An error occurred")
+    def post(self, request, *args: typing.Any, **kwargs: typing.Any) -> JsonResponse:
+        job = self.get_job()
+        cancel_profile_job(job["id"])
+        return JsonResponse(
+            data={
+                "status": "success",
+                "detail": "Risk profile generation cancelled",
+                "data": {
+                    "job_id": job["id"],
+                    "progress": get_job_progress(job),
+                },
+            },
+            status=200,
+        )
+
 
 risk_management_view = RiskManagementView.as_view()
+functions_schema_view = FunctionsSchemaView.as_view()
 risk_profile_create_view = RiskProfileCreateView.as_view()
 risk_profile_update_view = RiskProfileUpdateView.as_view()
 risk_profile_delete_view = RiskProfileDeleteView.as_view()
 
 stocks_risk_profile_generation_view = StocksRiskProfileGenerationView.as_view()
+stocks_risk_profile_generation_stream_view = (
+    StocksRiskProfileGenerationStreamView.as_view()
+)
+risk_profile_result_set_view = RiskProfileResultSetView.as_view()
+risk_profile_backtest_view = RiskProfileBacktestView.as_view()
+stocks_risk_profile_generation_job_create_view = (
+    StocksRiskProfileGenerationJobCreateView.as_view()
+)
+stocks_risk_profile_generation_job_view = StocksRiskProfileGenerationJobView.as_view()
+stocks_risk_profile_generation_job_cancel_view = (
+    StocksRiskProfileGenerationJobCancelView.as_view()
+)
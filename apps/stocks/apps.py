@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class StocksConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.stocks"
+
+    def ready(self) -> None:
+        import apps.stocks.signals  # noqa
@@ -4,7 +4,20 @@ from django.core.files import File
 from dateutil.parser import parse
 
 from .models import Rate, Stock, KSE100Rate, StockIndices
+from .index_series import refresh_kse100_series
+from helpers import metrics
 from helpers.utils.misc import comma_separated_to_int_float
+from helpers.caching import bump_versions
+
+
+RATE_UPLOAD_ROWS = metrics.counter(
+    "rate_upload_rows_total", "Rows saved from uploaded rates files", ["file"]
+)
+RATE_UPLOAD_SECONDS = metrics.histogram(
+    "rate_upload_duration_seconds",
+    "Time taken to process uploaded rates files",
+    ["file"],
+)
 
 
 def get_stocks_by_indices(*indices: StockIndices):
@@ -12,6 +25,22 @@ def get_stocks_by_indices(*indices: StockIndices):
     return Stock.objects.filter(indices__contains=indices)
 
 
+def invalidate_rates_dependents(*stock_ids) -> None:
+    """
+    Invalidate cached values that depend on the rates of the given stocks.
+
+    Should be called after rates are written in bulk, as bulk writes
+    do not send `post_save` signals.
+    """
+    if not stock_ids:
+        # Nothing was written, so nothing (including rates-wide values) is stale
+        return
+    bump_versions(
+        ("stocks.Rate", None),
+        *(("stocks.Stock", stock_id) for stock_id in stock_ids),
+    )
+
+
 def get_trend(previous_close: float, close: float) -> str:
     """Get the market trend based on the previous close and current close."""
     if close > previous_close:
@@ -62,6 +91,7 @@ class RateUploadError(Exception):
     pass
 
 
+@RATE_UPLOAD_SECONDS.time(file="rates")
 def handle_rates_file(rates_file: File) -> None:
     """
     Process the uploaded rates file.
@@ -101,9 +131,14 @@ def handle_rates_file(rates_file: File) -> None:
 
     Rate.objects.bulk_create(new_rates, batch_size=5000)
     Rate.objects.bulk_update(existing_rates, UPDATEABLE_RATE_FIELDS, batch_size=5000)
+    invalidate_rates_dependents(
+        *{rate.stock_id for rate in (*new_rates, *existing_rates)}
+    )
+    RATE_UPLOAD_ROWS.inc(len(new_rates) + len(existing_rates), file="rates")
     return None
 
 
+@RATE_UPLOAD_SECONDS.time(file="kse100")
 def handle_kse_rates_file(kse_rates_file: File) -> None:
     """
     Process the uploaded KSE100 rates file.
@@ -138,4 +173,6 @@ def handle_kse_rates_file(kse_rates_file: File) -> None:
         kse_rates.append(KSE100Rate(**data))
 
     KSE100Rate.objects.bulk_create(kse_rates, batch_size=5000)
+    refresh_kse100_series()
+    RATE_UPLOAD_ROWS.inc(len(kse_rates), file="kse100")
     return None
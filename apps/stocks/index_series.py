@@ -0,0 +1,210 @@
+"""
+In-memory KSE100 close series.
+
+Loads the (daily) KSE100 closes once per process into sorted NumPy arrays,
+so benchmark lookups can be resolved with `np.searchsorted` instead of
+one query per date.
+"""
+
+import datetime
+import threading
+import typing
+import numpy as np
+from django.core.cache import cache
+
+from .models import KSE100Rate
+
+
+_DateLike = typing.Union[datetime.date, np.datetime64]
+
+KSE100_SERIES_VERSION_KEY = "stocks:kse100_series:version"
+"""Cache key holding the version of the KSE100 series. Bumped whenever new KSE100 rates are uploaded."""
+
+
+def to_datetime64_array(dates: typing.Iterable[_DateLike]) -> np.ndarray:
+    """Converts an iterable of dates to a `datetime64[D]` numpy array."""
+    if isinstance(dates, np.ndarray) and dates.dtype == "datetime64[D]":
+        return dates
+    return np.array(list(dates), dtype="datetime64[D]")
+
+
+class IndexCloseSeries:
+    """
+    Sorted (ascending) series of an index's daily close values.
+
+    Lookups are "as-of" lookups, that is, the close on a date is the close of
+    the most recent trading day on or before that date. This allows non-trading
+    days (weekends, holidays) to resolve to the previous trading day's close.
+    """
+
+    def __init__(
+        self,
+        dates: np.ndarray,
+        closes: np.ndarray,
+        *,
+        tolerance: datetime.timedelta = datetime.timedelta(days=10),
+    ) -> None:
+        """
+        Create a new close series.
+
+        :param dates: Ascending `datetime64[D]` array of trading dates.
+        :param closes: Float array of closes, aligned with `dates`.
+        :param tolerance: How far back a lookup may go to find a close.
+            Lookups that cannot find a close within the tolerance resolve to NaN.
+        """
+        if len(dates) != len(closes):
+            raise ValueError("dates and closes must be of the same length")
+        self.dates = to_datetime64_array(dates)
+        self.closes = np.asarray(closes, dtype=float)
+        self.tolerance = np.timedelta64(tolerance.days, "D")
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    @property
+    def start(self) -> typing.Optional[datetime.date]:
+        """The first date in the series."""
+        if not self:
+            return None
+        return self.dates[0].astype(datetime.date)
+
+    @property
+    def end(self) -> typing.Optional[datetime.date]:
+        """The last date in the series."""
+        if not self:
+            return None
+        return self.dates[-1].astype(datetime.date)
+
+    def closes_as_of(self, dates: typing.Iterable[_DateLike]) -> np.ndarray:
+        """
+        Returns the close on or before each of the given dates.
+
+        :param dates: The dates to look up.
+        :return: A float array of closes. NaN where no close exists within the tolerance.
+        """
+        query = to_datetime64_array(dates)
+        result = np.full(query.shape, np.nan, dtype=float)
+        if not self or not query.size:
+            return result
+
+        indices = np.searchsorted(self.dates, query, side="right") - 1
+        found = indices >= 0
+        safe_indices = np.where(found, indices, 0)
+        within_tolerance = (query - self.dates[safe_indices]) <= self.tolerance
+        valid = found & within_tolerance
+        result[valid] = self.closes[safe_indices[valid]]
+        return result
+
+    def close_on(self, date: _DateLike) -> typing.Optional[float]:
+        """Returns the close on or before the given date, or None if there is none."""
+        close = self.closes_as_of([date])[0]
+        if np.isnan(close):
+            return None
+        return float(close)
+
+    def percentage_changes(
+        self,
+        from_dates: typing.Iterable[_DateLike],
+        to_dates: typing.Iterable[_DateLike],
+    ) -> np.ndarray:
+        """
+        Returns the percentage change in close between each pair of dates.
+
+        Pairs for which either close cannot be resolved have a change of 0.
+
+        :param from_dates: The dates to measure the changes from.
+        :param to_dates: The dates to measure the changes to. Should be of the same length as `from_dates`.
+        :return: A float array of percentage changes.
+        """
+        from_closes = self.closes_as_of(from_dates)
+        to_closes = self.closes_as_of(to_dates)
+        if from_closes.shape != to_closes.shape:
+            raise ValueError("from_dates and to_dates must be of the same length")
+
+        valid = ~np.isnan(from_closes) & ~np.isnan(to_closes) & (from_closes != 0)
+        changes = np.zeros(from_closes.shape, dtype=float)
+        changes[valid] = (
+            (to_closes[valid] - from_closes[valid]) / from_closes[valid]
+        ) * 100
+        return changes
+
+    def percentage_returns(
+        self, base_date: _DateLike, dates: typing.Iterable[_DateLike]
+    ) -> np.ndarray:
+        """
+        Returns the percentage return from the base date to each of the given dates.
+
+        Useful for building benchmark return series at any resolution.
+
+        :param base_date: The date the returns are measured from.
+        :param dates: The dates to compute the returns for.
+        """
+        to_dates = to_datetime64_array(dates)
+        from_dates = np.full(to_dates.shape, np.datetime64(base_date, "D"))
+        return self.percentage_changes(from_dates, to_dates)
+
+
+def load_kse100_series() -> IndexCloseSeries:
+    """Loads the KSE100 close series from the database."""
+    rows = KSE100Rate.objects.order_by("date").values_list("date", "close")
+    dates, closes = [], []
+    for date, close in rows.iterator(chunk_size=5000):
+        if dates and dates[-1] == date:
+            # Keep only one close per date. The last one loaded wins.
+            closes[-1] = close
+            continue
+        dates.append(date)
+        closes.append(close)
+    return IndexCloseSeries(
+        np.array(dates, dtype="datetime64[D]"), np.array(closes, dtype=float)
+    )
+
+
+_series_lock = threading.Lock()
+_series: typing.Optional[IndexCloseSeries] = None
+_series_version: typing.Optional[int] = None
+
+
+def get_kse100_series() -> IndexCloseSeries:
+    """
+    Returns the process-wide KSE100 close series.
+
+    The series is loaded once and reloaded only when its version in the
+    (shared) cache changes, that is, after new KSE100 rates are uploaded
+    in any process.
+    """
+    global _series, _series_version
+
+    version = cache.get(KSE100_SERIES_VERSION_KEY, 0)
+    series = _series
+    if series is not None and _series_version == version:
+        return series
+
+    with _series_lock:
+        if _series is None or _series_version != version:
+            _series = load_kse100_series()
+            _series_version = version
+        return _series
+
+
+def refresh_kse100_series() -> IndexCloseSeries:
+    """
+    Reloads the KSE100 close series in this process and
+    signals other processes to reload theirs.
+    """
+    global _series, _series_version
+
+    try:
+        version = cache.incr(KSE100_SERIES_VERSION_KEY)
+    except ValueError:
+        # The key does not exist yet
+        version = 1
+        cache.set(KSE100_SERIES_VERSION_KEY, version, timeout=None)
+
+    with _series_lock:
+        _series = load_kse100_series()
+        _series_version = version
+        return _series
@@ -7,7 +7,7 @@ from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
-from helpers.caching import ttl_cache
+from helpers.caching import versioned_cache
 
 
 
@@ -54,8 +54,19 @@ class Stock(models.Model):
         return decimal.Decimal(latest_rate.close).quantize(
             decimal.Decimal("0.01"), rounding=decimal.ROUND_HALF_UP
         )
+
+    async def aget_price(self) -> typing.Optional[decimal.Decimal]:
+        """Async version of `price`."""
+        latest_rate = (
+            await self.rates.only("close", "added_at").order_by("-added_at").afirst()
+        )
+        if not latest_rate:
+            return
+        return decimal.Decimal(latest_rate.close).quantize(
+            decimal.Decimal("0.01"), rounding=decimal.ROUND_HALF_UP
+        )
     
-    @ttl_cache(ttl=30)
+    @versioned_cache(timeout=60 * 60 * 6, vary_on_timezone=True)
     def get_price_on_date(
         self, date: datetime.date
     ) -> typing.Optional[decimal.Decimal]:
@@ -0,0 +1,288 @@
+"""
+In-memory OHLCV snapshots of stock rates.
+
+Loads the rates of many stocks in a single query into chronologically ordered
+(oldest first) NumPy arrays, so that indicators can be evaluated on a stock
+without querying the database for each indicator argument.
+"""
+
+import datetime
+import decimal
+import typing
+import numpy as np
+import pandas as pd
+from django.db import models
+from django.utils import timezone
+
+from helpers.caching import get_versions
+from .models import Stock, Rate
+
+
+OHLCV_FIELDS = ("open", "high", "low", "close", "volume")
+
+
+def _to_timestamp(dt: datetime.datetime) -> int:
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return int(dt.timestamp())
+
+
+def day_bounds(date: datetime.date) -> typing.Tuple[int, int]:
+    """
+    Returns the (start, end) timestamps of the date in the current timezone.
+
+    Mirrors the `added_at__date` lookup, which also uses the current timezone.
+    """
+    start = timezone.make_aware(
+        datetime.datetime.combine(date, datetime.time.min),
+        timezone.get_current_timezone(),
+    )
+    end = start + datetime.timedelta(days=1)
+    return _to_timestamp(start), _to_timestamp(end)
+
+
+def _to_local_dates(timestamps: np.ndarray) -> np.ndarray:
+    """Converts (UTC) timestamps, in seconds, to `datetime64[D]` dates in the current timezone."""
+    local = pd.to_datetime(timestamps, unit="s", utc=True).tz_convert(
+        timezone.get_current_timezone_name()
+    )
+    return local.tz_localize(None).values.astype("datetime64[D]")
+
+
+class StockOHLCV:
+    """
+    Chronologically ordered (oldest first) rates of a stock.
+
+    Can be used in place of a `Stock` when evaluating criteria and
+    generating stock profiles, as it implements the parts of the
+    `Stock` interface they use, without querying the database.
+    """
+
+    def __init__(
+        self,
+        stock_id: typing.Any,
+        ticker: str,
+        timestamps: np.ndarray,
+        values: np.ndarray,
+    ) -> None:
+        """
+        Create a new snapshot.
+
+        :param stock_id: The ID of the stock.
+        :param ticker: The ticker of the stock.
+        :param timestamps: Ascending int64 array of the rates' `added_at` (UTC) timestamps, in seconds.
+        :param values: Float array of shape (5, n) holding the rates' open, high, low, close and volume values, aligned with `timestamps`.
+        """
+        if values.shape != (len(OHLCV_FIELDS), len(timestamps)):
+            raise ValueError("values must be of shape (5, len(timestamps))")
+        self.id = self.pk = stock_id
+        self.ticker = ticker
+        self.timestamps = timestamps
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __repr__(self) -> str:
+        return f"<StockOHLCV {self.ticker} ({len(self)} rates)>"
+
+    def __str__(self) -> str:
+        return self.ticker
+
+    def __reduce__(self):
+        # Snapshots sent to other processes should not carry
+        # (possibly shared-memory backed) array views along.
+        return (
+            self.__class__,
+            (self.id, self.ticker, np.array(self.timestamps), np.array(self.values)),
+        )
+
+    def field(self, name: str, *, since: typing.Optional[datetime.date] = None) -> np.ndarray:
+        """
+        Returns the (oldest first) values of a rate field.
+
+        :param name: One of "open", "high", "low", "close" or "volume".
+        :param since: If provided, only the values of rates added on or after this date
+            (in the current timezone) are returned.
+        """
+        values = self.values[OHLCV_FIELDS.index(name)]
+        if since is not None:
+            start, _ = day_bounds(since)
+            values = values[np.searchsorted(self.timestamps, start, side="left") :]
+        return values
+
+    def latest(self, name: str) -> typing.Optional[float]:
+        """Returns the value of the field on the latest rate, or None if there are no rates."""
+        if not len(self):
+            return None
+        return float(self.values[OHLCV_FIELDS.index(name), -1])
+
+    def dates(self, *, since: typing.Optional[datetime.date] = None) -> np.ndarray:
+        """
+        Returns the (current timezone) dates of the rates, aligned with the values of `field`.
+
+        :param since: If provided, only the dates of rates added on or after this date are returned.
+        """
+        timestamps = self.timestamps
+        if since is not None:
+            start, _ = day_bounds(since)
+            timestamps = timestamps[np.searchsorted(timestamps, start, side="left") :]
+        return _to_local_dates(timestamps)
+
+    @property
+    def price(self) -> typing.Optional[decimal.Decimal]:
+        """Current price of the stock."""
+        close = self.latest("close")
+        if close is None:
+            return None
+        return decimal.Decimal(close).quantize(
+            decimal.Decimal("0.01"), rounding=decimal.ROUND_HALF_UP
+        )
+
+    def get_price_on_date(
+        self, date: datetime.date
+    ) -> typing.Optional[decimal.Decimal]:
+        """Returns the close of the latest rate added on the date (in the current timezone)."""
+        start, end = day_bounds(date)
+        index = np.searchsorted(self.timestamps, end, side="left") - 1
+        if index < 0 or self.timestamps[index] < start:
+            return None
+        return decimal.Decimal(float(self.values[OHLCV_FIELDS.index("close"), index])).quantize(
+            decimal.Decimal("0.01"), rounding=decimal.ROUND_HALF_UP
+        )
+
+
+def load_ohlcv(
+    stocks: typing.Iterable[Stock],
+    *,
+    since: typing.Optional[datetime.datetime] = None,
+) -> typing.Dict[typing.Any, StockOHLCV]:
+    """
+    Loads the rates of the given stocks, in a single query.
+
+    Rates of the same stock added at the same time are deduplicated, the last one loaded wins.
+
+    :param stocks: The stocks to load the rates of.
+    :param since: If provided, only rates added on or after this time are loaded.
+    :return: A mapping of the stock IDs to their snapshots, in the order of `stocks`.
+    """
+    tickers = {stock.pk: stock.ticker for stock in stocks}
+    rates = Rate.objects.filter(stock_id__in=tickers.keys())
+    if since is not None:
+        rates = rates.filter(added_at__gte=since)
+    rows = rates.order_by("stock_id", "added_at").values_list(
+        "stock_id", "added_at", *OHLCV_FIELDS
+    )
+
+    collected: typing.Dict[typing.Any, typing.Tuple[list, list]] = {}
+    for stock_id, added_at, *values in rows.iterator(chunk_size=10_000):
+        timestamps, stock_values = collected.setdefault(stock_id, ([], []))
+        timestamp = _to_timestamp(added_at)
+        if timestamps and timestamps[-1] == timestamp:
+            stock_values[-1] = values
+            continue
+        timestamps.append(timestamp)
+        stock_values.append(values)
+
+    snapshots = {}
+    for stock_id, ticker in tickers.items():
+        timestamps, values = collected.get(stock_id, ([], []))
+        snapshots[stock_id] = StockOHLCV(
+            stock_id,
+            ticker,
+            np.array(timestamps, dtype=np.int64),
+            np.array(values, dtype=float).reshape(-1, len(OHLCV_FIELDS)).T.copy(),
+        )
+    return snapshots
+
+
+def get_rate_watermark(stock: typing.Union[Stock, StockOHLCV]) -> int:
+    """Returns the (UTC) timestamp, in seconds, of the stock's latest rate. 0 if it has no rates"""
+    if isinstance(stock, StockOHLCV):
+        return int(stock.timestamps[-1]) if len(stock) else 0
+
+    # Memoize on the instance, as the watermark is usually needed more than once per stock
+    watermark = getattr(stock, "_rate_watermark", None)
+    if watermark is None:
+        latest = (
+            stock.rates.order_by("-added_at").values_list("added_at", flat=True).first()
+        )
+        watermark = _to_timestamp(latest) if latest else 0
+        stock._rate_watermark = watermark
+    return watermark
+
+
+def get_rate_versions(
+    stock_ids: typing.Iterable[typing.Any],
+) -> typing.Dict[typing.Any, int]:
+    """
+    Returns the version of each stock's rates, by stock ID, in one round trip.
+
+    Versions are bumped (see `invalidate_rates_dependents`) whenever a stock's rates are written,
+    including in-place corrections and backfills, which leave its watermark unchanged.
+    """
+    stock_ids = list(dict.fromkeys(stock_ids))
+    return dict(
+        zip(stock_ids, get_versions(*(("stocks.Stock", pk) for pk in stock_ids)))
+    )
+
+
+def get_rate_values(
+    stock: typing.Union[Stock, StockOHLCV],
+    field: str,
+    *,
+    since: typing.Optional[datetime.date] = None,
+) -> typing.Union[np.ndarray, models.QuerySet]:
+    """
+    Returns the chronologically ordered (oldest first) values of a rate field of the stock.
+
+    Uses the stock's snapshot if a `StockOHLCV` is given, otherwise queries the database.
+
+    :param stock: The stock, or its snapshot.
+    :param field: One of "open", "high", "low", "close" or "volume".
+    :param since: If provided, only the values of rates added on or after this date
+        (in the current timezone) are returned.
+    """
+    if isinstance(stock, StockOHLCV):
+        return stock.field(field, since=since)
+
+    rates = stock.rates.order_by("added_at")
+    if since is not None:
+        rates = rates.filter(added_at__date__gte=since).distinct("added_at")
+    return rates.values_list(field, flat=True)
+
+
+def get_rate_dates(
+    stock: typing.Union[Stock, StockOHLCV],
+    *,
+    since: typing.Optional[datetime.date] = None,
+) -> np.ndarray:
+    """
+    Returns the (current timezone) dates of the stock's rates,
+    as a `datetime64[D]` array aligned with the values returned by `get_rate_values`.
+
+    :param stock: The stock, or its snapshot.
+    :param since: If provided, only the dates of rates added on or after this date are returned.
+    """
+    if isinstance(stock, StockOHLCV):
+        return stock.dates(since=since)
+
+    rates = stock.rates.order_by("added_at")
+    if since is not None:
+        rates = rates.filter(added_at__date__gte=since).distinct("added_at")
+    timestamps = [
+        _to_timestamp(added_at)
+        for added_at in rates.values_list("added_at", flat=True)
+    ]
+    return _to_local_dates(np.array(timestamps, dtype=np.int64))
+
+
+def latest_on_each_date(dates: np.ndarray) -> np.ndarray:
+    """
+    Returns the positions of the latest rate on each date.
+
+    :param dates: The (ascending) dates of the rates, as returned by `get_rate_dates`.
+    """
+    if not len(dates):
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero(np.append(dates[1:] != dates[:-1], True))
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Rate
+from .helpers import invalidate_rates_dependents
+
+
+@receiver([post_save, post_delete], sender=Rate)
+def invalidate_rate_dependents(sender, instance: Rate, **kwargs):
+    invalidate_rates_dependents(instance.stock_id)
@@ -1,6 +1,6 @@
 from typing import Dict, Any
 import json
-from django.shortcuts import get_object_or_404, redirect
+from django.shortcuts import aget_object_or_404, redirect
 from django.views import generic
 from django.http import JsonResponse
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -15,6 +15,7 @@ from .helpers import (
 )
 from helpers.logging import log_exception
 from helpers.exceptions import capture
+from helpers.views.mixins import AsyncLoginRequiredMixin
 from .models import Stock
 
 
@@ -54,15 +55,15 @@ class UploadsView(LoginRequiredMixin, generic.TemplateView):
 
 
 @capture.enable
-class StockLatestPriceView(LoginRequiredMixin, generic.View):
+class StockLatestPriceView(AsyncLoginRequiredMixin, generic.View):
     http_method_names = ["post"]
 
     @capture.capture(content="Oops! An error occurred")
-    def post(self, request, *args: Any, **kwargs: Any) -> JsonResponse:
+    async def post(self, request, *args: Any, **kwargs: Any) -> JsonResponse:
         data: Dict = json.loads(request.body)
         ticker = data["stock"]
-        stock = get_object_or_404(Stock, ticker=ticker)
-        latest_price = stock.price
+        stock = await aget_object_or_404(Stock, ticker=ticker)
+        latest_price = await stock.aget_price()
         if latest_price is None:
             return JsonResponse(
                 data={
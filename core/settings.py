@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    "helpers.response.middleware.QueryInstrumentationMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -167,6 +168,36 @@ CSRF_TRUSTED_ORIGINS = ["https://doulab.project.bytechain.dev"]
 #     },
 # }
 
+HELPERS_SETTINGS = {
+    "QUERY_INSTRUMENTATION": {
+        "enabled": os.getenv("QUERY_INSTRUMENTATION", "true").lower() == "true",
+        "repeated_query_threshold": 5,
+        "budgets": {
+            "portfolios:portfolio_detail": {"queries": 40, "repeated": 5},
+            "portfolios:portfolio_performance_data": {"queries": 60, "repeated": 5},
+            "risk_management:stocks_risk_profile_generation": {
+                "queries": 20,
+                "repeated": 5,
+            },
+        },
+        # Raise when a view exceeds its query budget, instead of only logging it (e.g. in tests)
+        "raise": os.getenv("QUERY_BUDGET_RAISE", "false").lower() == "true",
+    },
+    "METRICS": {
+        "enabled": os.getenv("METRICS_ENABLED", "true").lower() == "true",
+        # Aggregate the metrics of all web and django-q worker processes in Redis
+        "store": "redis",
+        "cache": "default",
+        # Bearer token Prometheus scrapes `/metrics` with. Staff users need none
+        "token": os.getenv("METRICS_TOKEN"),
+    },
+    # Shared thread pool ORM work is fanned out to. Caps the connections it opens
+    "DATABASE_EXECUTOR": {
+        "max_workers": int(os.getenv("DATABASE_EXECUTOR_WORKERS", 4)),
+        "connection_max_age": 60,
+    },
+}
+
 MG_LINK_CLIENT_USERNAME = os.getenv("MG_LINK_CLIENT_USERNAME")
 MG_LINK_CLIENT_PASSWORD = os.getenv("MG_LINK_CLIENT_PASSWORD")
 
@@ -188,6 +219,22 @@ Q_CLUSTER = {
     "broker": "django_q.brokers.redis_broker.Redis",
 }
 
+# Risk profile generation
+# "process" evaluates stocks in a process-wide pool of worker processes (started with the
+# "forkserver" method), sized by the workers setting. "thread" evaluates them in a
+# process-wide thread pool of the same size
+RISK_PROFILE_GENERATION_EXECUTOR = os.getenv(
+    "RISK_PROFILE_GENERATION_EXECUTOR", "process"
+).lower()
+RISK_PROFILE_GENERATION_WORKERS = (
+    int(os.getenv("RISK_PROFILE_GENERATION_WORKERS", 0)) or os.cpu_count() or 1
+)
+# Whether risk profile generation can be profiled per request (with `?profile=1`).
+# Defaults to DEBUG, as profiled runs bypass snapshots and are slower.
+RISK_PROFILE_PROFILING = (
+    os.getenv("RISK_PROFILE_PROFILING", str(DEBUG)).lower() == "true"
+)
+
 STOCKS_INDICES_FILE = os.path.join(BASE_DIR, "resources/stocks_indices.csv")
 
 PAKISTAN_TIMEZONE = zoneinfo.ZoneInfo("Asia/Karachi")
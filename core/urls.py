@@ -2,6 +2,8 @@ from django.contrib import admin
 from django.conf import settings
 from django.urls import path, include
 
+from helpers.views.metrics import metrics_view
+
 
 urlpatterns = [
     path("", include("apps.dashboard.urls", namespace="dashboard")),
@@ -13,6 +15,7 @@ urlpatterns = [
         "risk-management/",
         include("apps.risk_management.urls", namespace="risk_management"),
     ),
+    path("metrics", metrics_view, name="metrics"),
 ]
 
 admin.site.site_header = f"{settings.APPLICATION_NAME} Admin"
@@ -1,19 +1,81 @@
 import functools
-from typing import Callable, TypeVar, Coroutine, Any
-from cachetools import TTLCache
+import hashlib
+import datetime
+import decimal
+import uuid
+from typing import Callable, TypeVar, Coroutine, Any, Dict, Iterable, Optional, Tuple, Union
+from cachetools import Cache, TTLCache
 import asyncio
 import threading
+import time
+import weakref
+import attrs
+from django.core.cache import caches
+from django.db import models
+from django.utils import timezone
 
 T = TypeVar("T")
 
+_MISSING = object()
+
+
+@attrs.define(auto_attribs=True)
+class CacheStats:
+    """Counters of a cache's usage"""
+
+    hits: int = 0
+    misses: int = 0
+    stale_hits: int = 0
+    """Number of lookups served a stale value while the value was being refreshed."""
+    evictions: int = 0
+    """Number of entries removed from the cache because it was full or the entries expired."""
+    errors: int = 0
+    """Number of calls to the cached function that raised an exception."""
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.stale_hits + self.misses
+        if not lookups:
+            return 0.0
+        return (self.hits + self.stale_hits) / lookups
+
+    def reset(self) -> None:
+        self.hits = self.misses = self.stale_hits = self.evictions = self.errors = 0
+
+
+class _StatsTTLCache(TTLCache):
+    """`cachetools.TTLCache` that counts evictions in its `stats`"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = CacheStats()
+
+    def expire(self, time=None):
+        # `TTLCache.__len__` expires items itself, so count the underlying items instead
+        size = Cache.__len__(self)
+        result = super().expire(time)
+        self.stats.evictions += size - Cache.__len__(self)
+        return result
+
+    def popitem(self):
+        # Make sure expired items are not counted twice
+        self.expire()
+        item = super().popitem()
+        self.stats.evictions += 1
+        return item
+
 
 class SyncTTLCache:
     """Thread-safe implementation of `cachetools.TTLCache`"""
 
     def __init__(self, **kwargs):
-        self.cache = TTLCache(**kwargs)
+        self.cache = _StatsTTLCache(**kwargs)
         self.lock = threading.Lock()
 
+    @property
+    def stats(self) -> CacheStats:
+        return self.cache.stats
+
     def __getitem__(self, key):
         with self.lock:
             return self.cache[key]
@@ -43,41 +105,110 @@ class SyncTTLCache:
             self.cache.clear()
 
 
+_CACHES: "weakref.WeakValueDictionary[str, Callable]" = weakref.WeakValueDictionary()
+"""Registry of functions decorated with `ttl_cache` or `async_ttl_cache`, by qualified name"""
+
+
+def get_cache_stats() -> Dict[str, CacheStats]:
+    """Returns the stats of all `ttl_cache` or `async_ttl_cache` caches in this process, by the qualified name of the cached function."""
+    return {name: func.cache_info() for name, func in list(_CACHES.items())}
+
+
 class AsyncTTLCache:
-    """Asynchronous thread-safe implementation of `cachetools.TTLCache`"""
+    """
+    `cachetools.TTLCache` for caching the results of asynchronous functions.
 
-    def __init__(self, **kwargs):
-        self.cache = TTLCache(**kwargs)
-        self.lock = asyncio.Lock()
+    Concurrent lookups of the same key (in the same event loop) are coalesced,
+    that is, only one computation runs and all callers await its result.
+    Lookups of different keys never wait on each other.
 
-    async def __getitem__(self, key):
-        async with self.lock:
-            return self.cache[key]
+    The cache can be shared across threads and event loops.
+    """
 
-    async def __setitem__(self, key, value):
-        async with self.lock:
-            self.cache[key] = value
+    def __init__(self, **kwargs):
+        self.cache = _StatsTTLCache(**kwargs)
+        # Only held for short, non-blocking operations on the underlying cache,
+        # never while awaiting, so it is safe to use within event loops.
+        self.lock = threading.Lock()
+        self.tasks: Dict[Tuple[int, Any], asyncio.Task] = {}
+        """In-flight computations, by event loop and key"""
 
-    async def __delitem__(self, key):
-        async with self.lock:
-            del self.cache[key]
+    @property
+    def stats(self) -> CacheStats:
+        return self.cache.stats
 
-    async def __contains__(self, key):
-        async with self.lock:
+    def __contains__(self, key):
+        with self.lock:
             return key in self.cache
 
-    async def get(self, key, default=None):
-        async with self.lock:
+    def get(self, key, default=None):
+        with self.lock:
             return self.cache.get(key, default)
 
-    async def pop(self, key, default=None):
-        async with self.lock:
+    def set(self, key, value):
+        with self.lock:
+            self.cache[key] = value
+
+    def pop(self, key, default=None):
+        with self.lock:
             return self.cache.pop(key, default)
 
-    async def clear(self):
-        async with self.lock:
+    def clear(self):
+        with self.lock:
             self.cache.clear()
 
+    async def get_or_compute(
+        self,
+        key,
+        coroutine_func: Callable[..., Coroutine[Any, Any, T]],
+        *args,
+        **kwargs,
+    ) -> T:
+        """
+        Returns the cached value for the key, or computes, caches and returns it.
+
+        If the key is already being computed, waits for that computation instead of starting another.
+        Exceptions raised by the computation are propagated to all waiting callers, and are not cached.
+
+        :param key: The cache key.
+        :param coroutine_func: The asynchronous function to call to compute the value.
+        :param args: Positional arguments to pass to `coroutine_func`.
+        :param kwargs: Keyword arguments to pass to `coroutine_func`.
+        """
+        task_key = (id(asyncio.get_running_loop()), key)
+        with self.lock:
+            value = self.cache.get(key, _MISSING)
+            if value is not _MISSING:
+                self.stats.hits += 1
+                return value
+
+            self.stats.misses += 1
+            task = self.tasks.get(task_key)
+            if task is None:
+                task = asyncio.ensure_future(
+                    self._compute(key, task_key, coroutine_func, *args, **kwargs)
+                )
+                self.tasks[task_key] = task
+
+        # Shield the shared computation, so that a cancelled caller
+        # does not cancel it for the other callers awaiting it.
+        return await asyncio.shield(task)
+
+    async def _compute(self, key, task_key, coroutine_func, *args, **kwargs):
+        try:
+            value = await coroutine_func(*args, **kwargs)
+        except Exception:
+            with self.lock:
+                self.stats.errors += 1
+            raise
+        else:
+            with self.lock:
+                self.cache[key] = value
+            return value
+        finally:
+            with self.lock:
+                self.tasks.pop(task_key, None)
+
 
 def async_ttl_cache(
     coroutine_func: Callable[..., Coroutine[Any, Any, T]] = None,
@@ -89,8 +220,13 @@ def async_ttl_cache(
     Cache the result of the decorated asynchronous function's
     call for a specified amount of time
 
+    Concurrent calls with the same arguments are coalesced, that is,
+    only one of them calls the function while the others await its result.
+
     :param maxsize: The maximum size of the cache
     :param ttl: The time to live of the cache in seconds. Defaults to 1 hour.
+
+    The cache's stats can be read with `wrapper.cache_info()`, and cleared with `wrapper.cache_clear()`.
     """
     cache = AsyncTTLCache(maxsize=maxsize, ttl=ttl)
 
@@ -98,13 +234,20 @@ def async_ttl_cache(
         coroutine_func: Callable[..., Coroutine[Any, Any, T]],
     ) -> Callable[..., Coroutine[Any, Any, T]]:
         @functools.wraps(coroutine_func)
-        async def wrapper(*args, **kwargs) -> Coroutine[Any, Any, T]:
+        async def wrapper(*args, **kwargs) -> T:
             key = (args, frozenset(kwargs.items()))
-            if key not in cache:
-                result = await coroutine_func(*args, **kwargs)
-                cache[key] = result
-            return cache[key]
+            return await cache.get_or_compute(key, coroutine_func, *args, **kwargs)
+
+        def cache_info() -> CacheStats:
+            return cache.stats
 
+        def cache_clear() -> None:
+            cache.clear()
+            cache.stats.reset()
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        _CACHES[f"{coroutine_func.__module__}.{coroutine_func.__qualname__}"] = wrapper
         return wrapper
 
     if coroutine_func is None:
@@ -112,24 +255,393 @@ def async_ttl_cache(
     return decorator(coroutine_func)
 
 
-def ttl_cache(func: Callable[..., T] = None, *, maxsize: int = 128, ttl: float = 3600):
+@attrs.define(slots=True)
+class _Entry:
+    """A cached result of a function call"""
+
+    value: Any = None
+    exception: Optional[BaseException] = None
+    fresh_until: float = 0.0
+    """Time (on the cache's timer) until which the entry can be served without refreshing it."""
+    expires_at: float = 0.0
+    """Time (on the cache's timer) after which the entry can no longer be served."""
+
+    def result(self):
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+
+class _Flight:
+    """An in-progress computation of a cache entry, which other callers can wait on"""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.entry: Optional[_Entry] = None
+
+    def wait(self):
+        self.done.wait()
+        return self.entry.result()
+
+
+def ttl_cache(
+    func: Callable[..., T] = None,
+    *,
+    maxsize: int = 128,
+    ttl: float = 3600,
+    stale_ttl: float = 0,
+    error_ttl: float = 0,
+):
     """
     Cache the result of the decorated function's call for a specified amount of time
 
+    Concurrent calls with the same arguments are coalesced, that is,
+    only one of them calls the function while the others wait for its result.
+
     :param maxsize: The maximum size of the cache
     :param ttl: The time to live of the cache in seconds. Defaults to 1 hour.
+    :param stale_ttl: How long (in seconds) after it expires a cached result may still be returned
+        while it is being refreshed in a background thread. Defaults to 0 (results are not served stale).
+    :param error_ttl: How long (in seconds) an exception raised by the function is cached and re-raised
+        for calls with the same arguments. Defaults to 0 (exceptions are not cached).
+
+    The cache's stats can be read with `wrapper.cache_info()`, and cleared with `wrapper.cache_clear()`.
     """
-    cache = SyncTTLCache(maxsize=maxsize, ttl=ttl)
+    timer = time.monotonic
+    cache = SyncTTLCache(maxsize=maxsize, ttl=ttl + stale_ttl, timer=timer)
+    flights: Dict[Any, _Flight] = {}
 
     def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        def compute(key, args, kwargs, flight: _Flight) -> _Entry:
+            try:
+                try:
+                    entry = _Entry(value=func(*args, **kwargs))
+                    now = timer()
+                    entry.fresh_until = now + ttl
+                    entry.expires_at = entry.fresh_until + stale_ttl
+                except Exception as exc:
+                    now = timer()
+                    entry = _Entry(
+                        exception=exc,
+                        fresh_until=now + error_ttl,
+                        expires_at=now + error_ttl,
+                    )
+                flight.entry = entry
+
+                with cache.lock:
+                    if entry.exception is None:
+                        cache.cache[key] = entry
+                    else:
+                        cache.stats.errors += 1
+                        if error_ttl > 0:
+                            cache.cache[key] = entry
+            finally:
+                with cache.lock:
+                    flights.pop(key, None)
+                if flight.entry is None:
+                    flight.entry = _Entry(
+                        exception=RuntimeError("Cached function call was interrupted")
+                    )
+                flight.done.set()
+            return entry
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs) -> T:
             key = (args, frozenset(kwargs.items()))
-            if key not in cache:
+            refresh = False
+            with cache.lock:
+                entry: Optional[_Entry] = cache.cache.get(key)
+                now = timer()
+                if entry is not None and now < entry.fresh_until:
+                    cache.stats.hits += 1
+                    return entry.result()
+
+                flight = flights.get(key)
+                if entry is not None and now < entry.expires_at:
+                    cache.stats.stale_hits += 1
+                    if flight is None:
+                        flight = flights[key] = _Flight()
+                        refresh = True
+                elif flight is not None:
+                    cache.stats.misses += 1
+                    entry = None
+                else:
+                    cache.stats.misses += 1
+                    flight = flights[key] = _Flight()
+                    entry = None
+                    refresh = True
+
+            if entry is not None:
+                # Serve the stale entry, refreshing it in the background if no one else is
+                if refresh:
+                    threading.Thread(
+                        target=compute,
+                        args=(key, args, kwargs, flight),
+                        daemon=True,
+                    ).start()
+                return entry.result()
+
+            if refresh:
+                return compute(key, args, kwargs, flight).result()
+            return flight.wait()
+
+        def cache_info() -> CacheStats:
+            return cache.stats
+
+        def cache_clear() -> None:
+            cache.clear()
+            cache.stats.reset()
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        _CACHES[f"{func.__module__}.{func.__qualname__}"] = wrapper
+        return wrapper
+
+    if func is None:
+        return decorator
+    return decorator(func)
+
+
+class TwoTierCache:
+    """
+    In-process LRU cache in front of a shared Django cache backend.
+
+    Reads check the in-process cache first and fall back to the shared cache,
+    populating the in-process cache on a shared cache hit. Writes go to both.
+
+    Since the in-process cache is never invalidated across processes, keys
+    stored in a `TwoTierCache` should be immutable, that is, a key should
+    always map to the same value. Use versioned keys to achieve this.
+    """
+
+    def __init__(
+        self,
+        alias: str = "default",
+        *,
+        local_maxsize: int = 1024,
+        local_ttl: float = 3600,
+        timeout: Optional[float] = 3600,
+    ) -> None:
+        """
+        Create a new two-tier cache.
+
+        :param alias: The alias of the Django cache (in `settings.CACHES`) to use as the shared cache.
+        :param local_maxsize: The maximum size of the in-process cache.
+        :param local_ttl: The time to live of entries in the in-process cache in seconds.
+        :param timeout: The default time to live of entries in the shared cache in seconds.
+            Set to None to store entries indefinitely.
+        """
+        self.alias = alias
+        self.local = SyncTTLCache(maxsize=local_maxsize, ttl=local_ttl)
+        self.timeout = timeout
+
+    @property
+    def shared(self):
+        """The shared (Django) cache."""
+        return caches[self.alias]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        value = self.shared.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        self.local[key] = value
+        return value
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Returns a mapping of the keys found in the cache to their values."""
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key, _MISSING)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+
+        if missing:
+            shared_found = self.shared.get_many(missing)
+            for key, value in shared_found.items():
+                self.local[key] = value
+            found.update(shared_found)
+        return found
+
+    def set(self, key: str, value: Any, timeout: Optional[float] = _MISSING) -> None:
+        if timeout is _MISSING:
+            timeout = self.timeout
+        self.local[key] = value
+        self.shared.set(key, value, timeout=timeout)
+
+    def set_many(
+        self, mapping: Dict[str, Any], timeout: Optional[float] = _MISSING
+    ) -> None:
+        if timeout is _MISSING:
+            timeout = self.timeout
+        for key, value in mapping.items():
+            self.local[key] = value
+        self.shared.set_many(mapping, timeout=timeout)
+
+    def delete(self, key: str) -> None:
+        self.local.pop(key, None)
+        self.shared.delete(key)
+
+
+####################
+# VERSION COUNTERS #
+####################
+
+VersionTarget = Union[models.Model, Tuple[Union[str, type[models.Model]], Any]]
+"""
+A model instance, or a (model or model label, primary key) tuple,
+whose version should be tracked. A primary key of None targets the model itself.
+"""
+
+
+def _model_label(model: Union[str, type[models.Model], models.Model]) -> str:
+    if isinstance(model, str):
+        return model.lower()
+    return model._meta.label_lower
+
+
+def version_key(target: VersionTarget) -> str:
+    """Returns the cache key holding the version counter of the target."""
+    if isinstance(target, models.Model):
+        model, pk = target, target.pk
+    else:
+        model, pk = target
+
+    label = _model_label(model)
+    if pk is None:
+        return f"version:{label}"
+    return f"version:{label}:{pk}"
+
+
+def get_versions(
+    *targets: VersionTarget, alias: str = "default"
+) -> Tuple[int, ...]:
+    """
+    Returns the current version of each target, in one round trip.
+
+    Targets that have never been bumped are at version 0.
+    """
+    keys = [version_key(target) for target in targets]
+    if not keys:
+        return ()
+    versions = caches[alias].get_many(keys)
+    return tuple(versions.get(key, 0) for key in keys)
+
+
+def bump_versions(*targets: VersionTarget, alias: str = "default") -> None:
+    """
+    Increment the version of each target.
+
+    Cached values that depend on a target are invalidated
+    once the target's version is bumped.
+    """
+    cache = caches[alias]
+    for key in {version_key(target) for target in targets}:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # The counter does not exist yet
+            if not cache.add(key, 1, timeout=None):
+                cache.incr(key)
+
+
+def _stable_repr(value: Any) -> str:
+    """
+    Returns a representation of the value that is stable across processes.
+
+    Model instances are represented by their model label and primary key.
+    """
+    if isinstance(value, models.Model):
+        return f"{_model_label(value)}:{value.pk}"
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (str, int, float, bool, decimal.Decimal, uuid.UUID)) or value is None:
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return f"({','.join(_stable_repr(v) for v in value)})"
+    if isinstance(value, dict):
+        items = sorted((str(k), _stable_repr(v)) for k, v in value.items())
+        return f"{{{','.join(f'{k}={v}' for k, v in items)}}}"
+    raise TypeError(f"Cannot build a stable cache key from {type(value).__name__}")
+
+
+def make_stable_key(func: Callable, args: tuple, kwargs: dict) -> str:
+    """Returns a cache key for a function call that is stable across processes."""
+    arguments = _stable_repr(args) + _stable_repr(kwargs)
+    digest = hashlib.md5(arguments.encode(), usedforsecurity=False).hexdigest()
+    return f"{func.__module__}.{func.__qualname__}:{digest}"
+
+
+def _default_dependencies(*args, **kwargs) -> Iterable[VersionTarget]:
+    return [
+        value
+        for value in (*args, *kwargs.values())
+        if isinstance(value, models.Model)
+    ]
+
+
+def versioned_cache(
+    func: Callable[..., T] = None,
+    *,
+    depends_on: Optional[Callable[..., Iterable[VersionTarget]]] = None,
+    timeout: Optional[float] = 3600,
+    local_maxsize: int = 256,
+    alias: str = "default",
+    vary_on_timezone: bool = False,
+):
+    """
+    Cache the result of the decorated function in a two-tier (in-process and shared) cache.
+
+    Cache keys are built from the model primary keys (and other arguments) of the call
+    and the versions of the call's dependencies. Bumping the version of a dependency
+    (see `bump_versions`) invalidates all cached results that depend on it, in all processes.
+
+    :param depends_on: A callable that takes the same arguments as the decorated function
+        and returns the version targets the result depends on. Defaults to the model instances
+        passed as arguments (including `self`, for model methods).
+    :param timeout: The time to live of cached results in seconds.
+    :param local_maxsize: The maximum size of the in-process cache.
+    :param alias: The alias of the Django cache to use as the shared cache.
+    :param vary_on_timezone: Whether the current timezone is part of the cache key.
+        Should be set if the result depends on it, e.g. on `added_at__date` lookups.
+
+    Example:
+    ```python
+    class Stock(models.Model):
+
+        @versioned_cache(vary_on_timezone=True)
+        def get_price_on_date(self, date):
+            ...
+
+    bump_versions(stock)  # Invalidates `stock.get_price_on_date` results
+    ```
+    """
+    cache = TwoTierCache(
+        alias, local_maxsize=local_maxsize, local_ttl=timeout or 3600, timeout=timeout
+    )
+    get_dependencies = depends_on or _default_dependencies
+
+    def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs) -> T:
+            versions = get_versions(*get_dependencies(*args, **kwargs), alias=alias)
+            key = f"{make_stable_key(func, args, kwargs)}:{'.'.join(map(str, versions))}"
+            if vary_on_timezone:
+                key = f"{key}@{timezone.get_current_timezone_name()}"
+
+            result = cache.get(key, _MISSING)
+            if result is _MISSING:
                 result = func(*args, **kwargs)
-                cache[key] = result
-            return cache[key]
+                cache.set(key, result)
+            return result
 
+        wrapper.cache = cache
         return wrapper
 
     if func is None:
@@ -47,6 +47,22 @@ DEFAULT_SETTINGS = {
     },
     "MAINTENANCE_MODE": {"status": "off", "message": "default:minimal_dark"},
     "RESPONSE_FORMATTER": None,
+    "QUERY_INSTRUMENTATION": {
+        "enabled": True,
+        "server_timing": True,
+        "repeated_query_threshold": 5,
+        "default_budget": {},
+        "budgets": {},
+        "raise": False,
+    },
+    "METRICS": {
+        "enabled": True,
+        "store": "redis",
+        "cache": "default",
+        "prefix": "metrics",
+        "token": None,
+    },
+    "DATABASE_EXECUTOR": {"max_workers": 4, "connection_max_age": 60},
 }
 
 
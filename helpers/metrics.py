@@ -0,0 +1,647 @@
+"""
+Lightweight application metrics.
+
+Counters, gauges and fixed-bucket histograms, rendered in the Prometheus text
+exposition format.
+
+```python
+from helpers import metrics
+
+uploaded_rows = metrics.counter(
+    "rate_upload_rows_total", "Rows processed from uploaded rates files", ["file"]
+)
+uploaded_rows.inc(len(rows), file="rates")
+
+upload_duration = metrics.histogram("rate_upload_duration_seconds", labelnames=["file"])
+with upload_duration.time(file="rates"):
+    ...
+
+metrics.render()
+```
+
+Values are kept in the store configured by the `METRICS` helpers setting:
+
+- "redis": in hashes on the Redis server of a `django_redis` cache. Updates are atomic
+  (`HINCRBYFLOAT`), so values recorded by all threads, web processes and django-q
+  workers are aggregated, and rendered by whichever process serves the metrics.
+- "local": in process memory. Only values recorded by the rendering process are rendered.
+
+The "redis" store falls back to the "local" store if the cache is not a
+`django_redis` cache.
+Recording a metric never raises. Store errors are logged and the value is dropped.
+"""
+
+import bisect
+import collections
+import contextlib
+import json
+import math
+import threading
+import time
+import typing
+import attrs
+from django.core.cache import caches
+
+from .config import settings
+from .logging import log_exception
+
+
+class MetricType:
+    COUNTER = "counter"
+    GAUGE = "gauge"
+    HISTOGRAM = "histogram"
+
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+"""Default upper bounds (in seconds) of histogram buckets"""
+
+
+def format_value(value: float) -> str:
+    """Format a sample value as in the Prometheus text format"""
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _field(suffix: str, label_values: typing.Sequence[str]) -> str:
+    """Returns the store field of a metric's sample. See `_parse_field`."""
+    return json.dumps([suffix, *label_values])
+
+
+def _parse_field(
+    field: typing.Union[str, bytes],
+) -> typing.Tuple[str, typing.List[str]]:
+    suffix, *label_values = json.loads(field)
+    return suffix, label_values
+
+
+@attrs.define(slots=True)
+class Sample:
+    name: str
+    labels: typing.Dict[str, str]
+    value: float
+
+
+@attrs.define(slots=True)
+class MetricFamily:
+    """A metric and its samples, as rendered"""
+
+    name: str
+    type: str
+    documentation: str = ""
+    samples: typing.List[Sample] = attrs.field(factory=list)
+
+    def render(self) -> str:
+        lines = []
+        if self.documentation:
+            documentation = self.documentation.replace("\\", r"\\").replace("\n", r"\n")
+            lines.append(f"# HELP {self.name} {documentation}")
+        lines.append(f"# TYPE {self.name} {self.type}")
+        for sample in self.samples:
+            labels = ",".join(
+                f'{name}="{_escape_label_value(str(value))}"'
+                for name, value in sample.labels.items()
+            )
+            name = f"{sample.name}{{{labels}}}" if labels else sample.name
+            lines.append(f"{name} {format_value(sample.value)}")
+        return "\n".join(lines)
+
+
+#################
+# METRIC STORES #
+#################
+
+
+class LocalStore:
+    """Keeps metric values in process memory"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.definitions: typing.Dict[str, typing.Dict] = {}
+        self.values: typing.DefaultDict[str, typing.DefaultDict[str, float]] = (
+            collections.defaultdict(lambda: collections.defaultdict(float))
+        )
+
+    def update(
+        self,
+        definition: typing.Dict,
+        *,
+        increments: typing.Optional[typing.Dict[str, float]] = None,
+        values: typing.Optional[typing.Dict[str, float]] = None,
+    ) -> None:
+        with self.lock:
+            self.definitions[definition["name"]] = definition
+            metric_values = self.values[definition["name"]]
+            for field, amount in (increments or {}).items():
+                metric_values[field] += amount
+            metric_values.update(values or {})
+
+    def collect(
+        self,
+    ) -> typing.Dict[str, typing.Tuple[typing.Dict, typing.Dict[str, float]]]:
+        """Returns the definition and values of each stored metric, by name"""
+        with self.lock:
+            return {
+                name: (definition, dict(self.values[name]))
+                for name, definition in self.definitions.items()
+            }
+
+    def clear(self) -> None:
+        with self.lock:
+            self.definitions.clear()
+            self.values.clear()
+
+
+class RedisStore:
+    """
+    Keeps metric values in Redis, shared by all processes.
+
+    The values of each metric are stored in a hash (one field per sample),
+    and the definitions of all metrics in another, so that metrics recorded
+    only by other processes (e.g. django-q workers) can be rendered.
+    Each process stores a metric's definition once, on its first update.
+    """
+
+    def __init__(self, alias: str = "default", *, prefix: str = "metrics") -> None:
+        self.alias = alias
+        self.prefix = prefix
+        self.defined: typing.Set[str] = set()
+        """Names of the metrics whose definitions this process has stored"""
+
+    @property
+    def client(self):
+        from django_redis import get_redis_connection
+
+        return get_redis_connection(self.alias)
+
+    @property
+    def definitions_key(self) -> str:
+        return f"{self.prefix}:definitions"
+
+    def values_key(self, name: str) -> str:
+        return f"{self.prefix}:values:{name}"
+
+    def update(
+        self,
+        definition: typing.Dict,
+        *,
+        increments: typing.Optional[typing.Dict[str, float]] = None,
+        values: typing.Optional[typing.Dict[str, float]] = None,
+    ) -> None:
+        name = definition["name"]
+        key = self.values_key(name)
+        pipeline = self.client.pipeline(transaction=False)
+        # Definitions do not change, so only store them on first use
+        is_defined = name in self.defined
+        if not is_defined:
+            pipeline.hset(self.definitions_key, name, json.dumps(definition))
+        for field, amount in (increments or {}).items():
+            pipeline.hincrbyfloat(key, field, amount)
+        if values:
+            pipeline.hset(key, mapping=values)
+        pipeline.execute()
+        if not is_defined:
+            self.defined.add(name)
+
+    def collect(
+        self,
+    ) -> typing.Dict[str, typing.Tuple[typing.Dict, typing.Dict[str, float]]]:
+        client = self.client
+        definitions = {
+            name.decode(): json.loads(definition)
+            for name, definition in client.hgetall(self.definitions_key).items()
+        }
+        pipeline = client.pipeline(transaction=False)
+        for name in definitions:
+            pipeline.hgetall(self.values_key(name))
+        return {
+            name: (
+                definition,
+                {field.decode(): float(value) for field, value in values.items()},
+            )
+            for (name, definition), values in zip(
+                definitions.items(), pipeline.execute()
+            )
+        }
+
+    def clear(self) -> None:
+        client = self.client
+        names = [name.decode() for name in client.hkeys(self.definitions_key)]
+        client.delete(self.definitions_key, *map(self.values_key, names))
+        self.defined.clear()
+
+
+def _is_redis_cache(alias: str) -> bool:
+    try:
+        from django_redis.cache import RedisCache
+    except ImportError:
+        return False
+    return isinstance(caches[alias], RedisCache)
+
+
+def make_store() -> typing.Union[LocalStore, RedisStore]:
+    """Returns the metric store configured in the `METRICS` helpers setting"""
+    config: typing.Dict[str, typing.Any] = settings.METRICS
+    alias = config.get("cache", "default")
+    if config.get("store", "redis") == "redis" and _is_redis_cache(alias):
+        return RedisStore(alias, prefix=config.get("prefix", "metrics"))
+    return LocalStore()
+
+
+###########
+# METRICS #
+###########
+
+
+class Metric:
+    """Base class of metrics"""
+
+    type: str
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str = "",
+        labelnames: typing.Sequence[str] = (),
+        *,
+        registry: typing.Optional["MetricsRegistry"] = None,
+    ) -> None:
+        """
+        Create a new metric.
+
+        :param name: The name of the metric. Should be unique in the registry.
+        :param documentation: Description of the metric, rendered as its HELP line
+        :param labelnames: Names of the labels samples of the metric are recorded with
+        :param registry: The registry to record the metric in. Defaults to the global registry.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry or default_registry
+
+    @property
+    def definition(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "name": self.name,
+            "type": self.type,
+            "documentation": self.documentation,
+            "labelnames": list(self.labelnames),
+        }
+
+    def label_values(self, labels: typing.Dict[str, typing.Any]) -> typing.List[str]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Metric '{self.name}' expects the labels {list(self.labelnames)}, "
+                f"got {sorted(labels)}"
+            )
+        return [str(labels[name]) for name in self.labelnames]
+
+    def _update(
+        self,
+        *,
+        increments: typing.Optional[typing.Dict[str, float]] = None,
+        values: typing.Optional[typing.Dict[str, float]] = None,
+    ) -> None:
+        if not self.registry.enabled:
+            return
+        try:
+            self.registry.store.update(
+                self.definition, increments=increments, values=values
+            )
+        except Exception as exc:
+            log_exception(exc, f"Failed to record metric '{self.name}'")
+
+    @classmethod
+    def samples(
+        cls, definition: typing.Dict, values: typing.Dict[str, float]
+    ) -> typing.List[Sample]:
+        """Returns the samples of the metric, from its stored values"""
+        samples = []
+        for field, value in sorted(values.items()):
+            _, label_values = _parse_field(field)
+            labels = dict(zip(definition["labelnames"], label_values))
+            samples.append(Sample(definition["name"], labels, value))
+        return samples
+
+
+class Counter(Metric):
+    """A cumulative value that only increases, e.g. the number of rows processed"""
+
+    type = MetricType.COUNTER
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be incremented by non-negative amounts")
+        field = _field("", self.label_values(labels))
+        self._update(increments={field: amount})
+
+
+class Gauge(Metric):
+    """A value that can go up and down, e.g. a cache's hit rate"""
+
+    type = MetricType.GAUGE
+
+    def set(self, value: float, **labels) -> None:
+        self._update(values={_field("", self.label_values(labels)): value})
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        self._update(increments={_field("", self.label_values(labels)): amount})
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values (e.g. durations) over fixed buckets.
+
+    Each observation is counted in the first bucket whose upper bound is not less
+    than it. Buckets are made cumulative (as Prometheus expects) when rendered.
+    """
+
+    type = MetricType.HISTOGRAM
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str = "",
+        labelnames: typing.Sequence[str] = (),
+        *,
+        buckets: typing.Sequence[float] = DEFAULT_BUCKETS,
+        registry: typing.Optional["MetricsRegistry"] = None,
+    ) -> None:
+        """
+        Create a new histogram.
+
+        :param buckets: The (increasing) upper bounds of the buckets.
+            A last, `+Inf` bucket is always added.
+        """
+        super().__init__(name, documentation, labelnames, registry=registry)
+        buckets = sorted(float(bound) for bound in buckets)
+        if not buckets or buckets[-1] != math.inf:
+            buckets.append(math.inf)
+        self.buckets = tuple(buckets)
+
+    @property
+    def definition(self) -> typing.Dict[str, typing.Any]:
+        return {
+            **super().definition,
+            "buckets": [format_value(bound) for bound in self.buckets],
+        }
+
+    def observe(self, value: float, **labels) -> None:
+        label_values = self.label_values(labels)
+        bound = self.buckets[bisect.bisect_left(self.buckets, value)]
+        self._update(
+            increments={
+                _field(format_value(bound), label_values): 1,
+                _field("count", label_values): 1,
+                _field("sum", label_values): value,
+            }
+        )
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> typing.Iterator[None]:
+        """Observe the time (in seconds) taken to execute the block. Can be used as a decorator."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @classmethod
+    def samples(
+        cls, definition: typing.Dict, values: typing.Dict[str, float]
+    ) -> typing.List[Sample]:
+        name = definition["name"]
+        series: typing.Dict[typing.Tuple[str, ...], typing.Dict[str, float]] = (
+            collections.defaultdict(dict)
+        )
+        for field, value in values.items():
+            suffix, label_values = _parse_field(field)
+            series[tuple(label_values)][suffix] = value
+
+        samples = []
+        for label_values, series_values in sorted(series.items()):
+            labels = dict(zip(definition["labelnames"], label_values))
+            cumulative = 0.0
+            for bound in definition["buckets"]:
+                cumulative += series_values.get(bound, 0.0)
+                samples.append(
+                    Sample(f"{name}_bucket", {**labels, "le": bound}, cumulative)
+                )
+            samples.append(Sample(f"{name}_sum", labels, series_values.get("sum", 0.0)))
+            samples.append(
+                Sample(f"{name}_count", labels, series_values.get("count", 0.0))
+            )
+        return samples
+
+
+_METRIC_CLASSES: typing.Dict[str, typing.Type[Metric]] = {
+    MetricType.COUNTER: Counter,
+    MetricType.GAUGE: Gauge,
+    MetricType.HISTOGRAM: Histogram,
+}
+
+
+############
+# REGISTRY #
+############
+
+Collector = typing.Callable[[], typing.Iterable[MetricFamily]]
+"""Callable returning metric families computed when metrics are rendered"""
+
+
+class MetricsRegistry:
+    """Registry of metrics, and of collectors of metrics computed on render"""
+
+    def __init__(
+        self, store: typing.Optional[typing.Union[LocalStore, RedisStore]] = None
+    ) -> None:
+        """
+        Create a new registry.
+
+        :param store: The store to keep metric values in.
+            Defaults to the store configured in the `METRICS` helpers setting.
+        """
+        self._store = store
+        self.metrics: typing.Dict[str, Metric] = {}
+        self.collectors: typing.List[Collector] = []
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.METRICS.get("enabled", True)
+
+    @property
+    def store(self) -> typing.Union[LocalStore, RedisStore]:
+        if self._store is None:
+            with self.lock:
+                if self._store is None:
+                    self._store = make_store()
+        return self._store
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Register the metric, if no metric with the same name is registered.
+
+        :return: The registered metric with the metric's name
+        :raises ValueError: If a different type of metric is registered with the name
+        """
+        with self.lock:
+            registered = self.metrics.setdefault(metric.name, metric)
+        if type(registered) is not type(metric):
+            raise ValueError(
+                f"Metric '{metric.name}' is already registered as a {registered.type}"
+            )
+        return registered
+
+    def counter(
+        self, name: str, documentation: str = "", labelnames: typing.Sequence[str] = ()
+    ) -> Counter:
+        """Returns the counter with the name, registering it if necessary"""
+        return self.register(Counter(name, documentation, labelnames, registry=self))
+
+    def gauge(
+        self, name: str, documentation: str = "", labelnames: typing.Sequence[str] = ()
+    ) -> Gauge:
+        """Returns the gauge with the name, registering it if necessary"""
+        return self.register(Gauge(name, documentation, labelnames, registry=self))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str = "",
+        labelnames: typing.Sequence[str] = (),
+        *,
+        buckets: typing.Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Returns the histogram with the name, registering it if necessary"""
+        return self.register(
+            Histogram(name, documentation, labelnames, buckets=buckets, registry=self)
+        )
+
+    def collector(self, collector: Collector) -> Collector:
+        """Register a collector. Can be used as a decorator."""
+        with self.lock:
+            self.collectors.append(collector)
+        return collector
+
+    def collect(self) -> typing.List[MetricFamily]:
+        """Returns the families of all stored metrics and collected metrics, by name"""
+        stored = self.store.collect()
+        families = {}
+        for name, metric in list(self.metrics.items()):
+            _, values = stored.pop(name, (None, {}))
+            families[name] = MetricFamily(
+                name,
+                metric.type,
+                metric.documentation,
+                metric.samples(metric.definition, values),
+            )
+        # Metrics recorded (only) by other processes
+        for name, (definition, values) in stored.items():
+            metric_class = _METRIC_CLASSES.get(definition["type"])
+            if metric_class is None:
+                continue
+            families[name] = MetricFamily(
+                name,
+                definition["type"],
+                definition.get("documentation", ""),
+                metric_class.samples(definition, values),
+            )
+
+        for collector in list(self.collectors):
+            try:
+                for family in collector():
+                    families[family.name] = family
+            except Exception as exc:
+                log_exception(exc, f"Metrics collector {collector!r} failed")
+        return [families[name] for name in sorted(families)]
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format"""
+        return "".join(f"{family.render()}\n" for family in self.collect())
+
+    def clear(self) -> None:
+        """Delete the stored values of all metrics"""
+        self.store.clear()
+
+
+default_registry = MetricsRegistry()
+"""The global metrics registry"""
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+"""Content type of the Prometheus text exposition format"""
+
+counter = default_registry.counter
+gauge = default_registry.gauge
+histogram = default_registry.histogram
+collector = default_registry.collector
+render = default_registry.render
+
+
+@collector
+def collect_cache_stats() -> typing.Iterable[MetricFamily]:
+    """
+    Collect the usage of the in-process caches (`ttl_cache` and `async_ttl_cache`
+    decorated functions) of the process rendering the metrics.
+    """
+    from .caching import get_cache_stats
+
+    families = {
+        "cache_lookups_total": MetricFamily(
+            "cache_lookups_total",
+            MetricType.COUNTER,
+            "Lookups of in-process caches, by result",
+        ),
+        "cache_evictions_total": MetricFamily(
+            "cache_evictions_total",
+            MetricType.COUNTER,
+            "Entries evicted from in-process caches",
+        ),
+        "cache_hit_ratio": MetricFamily(
+            "cache_hit_ratio",
+            MetricType.GAUGE,
+            "Ratio of in-process cache lookups served from the cache",
+        ),
+    }
+    for name, stats in sorted(get_cache_stats().items()):
+        for result, value in (
+            ("hit", stats.hits),
+            ("stale_hit", stats.stale_hits),
+            ("miss", stats.misses),
+        ):
+            families["cache_lookups_total"].samples.append(
+                Sample("cache_lookups_total", {"cache": name, "result": result}, value)
+            )
+        families["cache_evictions_total"].samples.append(
+            Sample("cache_evictions_total", {"cache": name}, stats.evictions)
+        )
+        families["cache_hit_ratio"].samples.append(
+            Sample("cache_hit_ratio", {"cache": name}, stats.hit_rate)
+        )
+    return families.values()
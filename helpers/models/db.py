@@ -1,5 +1,16 @@
+import contextvars
+import threading
+import time
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor
 from asgiref.sync import SyncToAsync
 from django.db import close_old_connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from helpers.config import settings
+from helpers.utils.misc import process_local
+from .queries import track_current_queries
 
 
 class DatabaseSyncToAsync(SyncToAsync):
@@ -17,3 +28,107 @@ class DatabaseSyncToAsync(SyncToAsync):
 
 database_sync_to_async = DatabaseSyncToAsync
 # Extract from Django channels
+
+
+_worker = threading.local()
+"""Holds the `DatabaseExecutor` a thread is a worker of, if any"""
+
+
+class DatabaseExecutor(ThreadPoolExecutor):
+    """
+    Thread pool for fanning out ORM work.
+
+    Workers are reused across tasks, and so are their database connections.
+    As for `DatabaseSyncToAsync`, old connections (unusable, or older than their
+    maximum age) are closed before and after each task. So the pool opens at most
+    one connection per worker (per database), and its size caps its connections.
+
+    Tasks submitted from the pool's own workers (e.g. by a task that fans out further)
+    are run inline, as a worker waiting on tasks queued behind it could deadlock the pool.
+
+    Tasks run in a copy of the submitter's context, so queries they execute are tracked
+    by the submitter's `track_queries` context, if any (e.g. a request's query stats).
+    """
+
+    def __init__(
+        self,
+        max_workers: typing.Optional[int] = None,
+        *,
+        connection_max_age: typing.Optional[float] = None,
+        thread_name_prefix: str = "database-executor",
+    ) -> None:
+        """
+        Create a new database executor.
+
+        :param max_workers: The maximum number of worker threads (and connections per database).
+        :param connection_max_age: How long (in seconds) connections opened by workers are
+            kept between tasks. Defaults to the `CONN_MAX_AGE` of their database.
+        :param thread_name_prefix: Prefix of the names of the worker threads.
+        """
+        super().__init__(
+            max_workers=max_workers,
+            thread_name_prefix=thread_name_prefix,
+            initializer=self._init_worker,
+        )
+        self.connection_max_age = connection_max_age
+
+    def _init_worker(self) -> None:
+        _worker.executor = self
+
+    def is_worker(self) -> bool:
+        """Returns whether the current thread is a worker of the executor."""
+        return getattr(_worker, "executor", None) is self
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        if self.is_worker():
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as exc:
+                future.set_exception(exc)
+            return future
+        context = contextvars.copy_context()
+        return super().submit(context.run, self._run, fn, *args, **kwargs)
+
+    @staticmethod
+    def _run(fn, *args, **kwargs):
+        close_old_connections()
+        try:
+            with track_current_queries():
+                return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+
+@receiver(connection_created)
+def _set_worker_connection_max_age(sender, connection, **kwargs) -> None:
+    """Have connections opened by `DatabaseExecutor` workers kept for the executor's `connection_max_age`."""
+    executor: typing.Optional[DatabaseExecutor] = getattr(_worker, "executor", None)
+    if executor is not None and executor.connection_max_age is not None:
+        connection.close_at = time.monotonic() + executor.connection_max_age
+
+
+@process_local
+def get_database_executor() -> DatabaseExecutor:
+    """
+    Returns the process-wide database executor, configured by the
+    `DATABASE_EXECUTOR` helpers setting.
+
+    The executor is created on first use, and again in forked processes
+    (e.g. django-q workers), as threads do not survive a fork.
+    """
+    config: typing.Dict[str, typing.Any] = settings.DATABASE_EXECUTOR
+    return DatabaseExecutor(
+        max_workers=config.get("max_workers", 4),
+        connection_max_age=config.get("connection_max_age", 60),
+    )
+
+
+def executor_sync_to_async(func: typing.Callable) -> DatabaseSyncToAsync:
+    """
+    Same as `database_sync_to_async`, but `func` is run in the process-wide
+    database executor, so that concurrent awaits are bounded by its size.
+    """
+    return DatabaseSyncToAsync(
+        func, thread_sensitive=False, executor=get_database_executor()
+    )
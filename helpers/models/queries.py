@@ -0,0 +1,187 @@
+"""
+Database query instrumentation.
+
+Counts the queries executed (and the time spent executing them) within a context,
+using `connection.execute_wrapper`, and fingerprints the SQL of each query, so that
+the same query shape executed many times (usually an N+1 pattern, e.g. a property
+that queries per row) can be flagged.
+
+```python
+with track_queries() as stats:
+    ...
+
+stats.queries, stats.duration, stats.repeated()
+```
+
+Database connections (and their execute wrappers) are per thread, so queries are
+tracked in the current thread, and in threads running work on behalf of the context,
+e.g. `DatabaseExecutor` tasks, which call `track_current_queries`.
+"""
+
+import collections
+import contextlib
+import contextvars
+import re
+import threading
+import time
+import typing
+import attrs
+from django.db import connections
+
+
+DEFAULT_REPEATED_QUERY_THRESHOLD = 5
+"""Number of times the same query shape can be executed before being flagged as repeated"""
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_VALUES_LIST = re.compile(r"\(\s*(?:%s|\?|\d+|'')(?:\s*,\s*(?:%s|\?|\d+|''))*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql: str) -> str:
+    """
+    Returns the shape of the SQL query, that is, the query with its literals
+    and parameters replaced by placeholders, and lists of values (e.g. in `IN`
+    clauses) collapsed, so that queries differing only in their values match.
+
+    Example:
+
+        ```python
+        fingerprint('SELECT * FROM "stocks_rate" WHERE "stock_id" IN (%s, %s) LIMIT 21')
+
+        # Output:
+        # 'SELECT * FROM "stocks_rate" WHERE "stock_id" IN (...) LIMIT ?'
+        ```
+    """
+    sql = _STRING_LITERAL.sub("''", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _VALUES_LIST.sub("(...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip().replace("%s", "?")
+
+
+@attrs.define(slots=True)
+class QueryStats:
+    """Queries executed within a `track_queries` context"""
+
+    queries: int = 0
+    duration: float = 0.0
+    """Total time (in seconds) spent executing the queries"""
+    shapes: typing.Counter[str] = attrs.field(factory=collections.Counter)
+    """Number of times each query shape (see `fingerprint`) was executed"""
+
+    def repeated(
+        self, threshold: int = DEFAULT_REPEATED_QUERY_THRESHOLD
+    ) -> typing.List[typing.Tuple[str, int]]:
+        """
+        Returns the query shapes executed more than `threshold` times, and their counts,
+        most executed first. These are likely N+1 queries.
+        """
+        return [
+            (shape, count)
+            for shape, count in self.shapes.most_common()
+            if count > threshold
+        ]
+
+    def as_dict(
+        self, *, threshold: int = DEFAULT_REPEATED_QUERY_THRESHOLD
+    ) -> typing.Dict[str, typing.Any]:
+        return {
+            "queries": self.queries,
+            "db_time_ms": round(self.duration * 1000, 3),
+            "repeated": [
+                {"sql": shape, "count": count}
+                for shape, count in self.repeated(threshold)
+            ],
+        }
+
+
+class QueryTracker:
+    """
+    Execute wrapper that records the queries it wraps into `stats`.
+
+    Can be installed in several threads at once.
+    """
+
+    def __init__(
+        self, stats: QueryStats, using: typing.Optional[typing.Iterable[str]] = None
+    ) -> None:
+        self.stats = stats
+        self.using = tuple(using or connections)
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            shape = fingerprint(sql)
+            with self.lock:
+                self.stats.duration += duration
+                self.stats.queries += 1
+                self.stats.shapes[shape] += 1
+
+    @contextlib.contextmanager
+    def install(self) -> typing.Iterator[None]:
+        """Install the tracker on the current thread's connections, within the context"""
+        with contextlib.ExitStack() as stack:
+            for alias in self.using:
+                connection = connections[alias]
+                if self not in connection.execute_wrappers:
+                    stack.enter_context(connection.execute_wrapper(self))
+            yield
+
+
+_current_tracker: contextvars.ContextVar[typing.Optional[QueryTracker]] = (
+    contextvars.ContextVar("query_tracker", default=None)
+)
+"""The tracker of the innermost `track_queries` context"""
+
+
+@contextlib.contextmanager
+def track_queries(
+    using: typing.Optional[typing.Iterable[str]] = None,
+    *,
+    stats: typing.Optional[QueryStats] = None,
+) -> typing.Iterator[QueryStats]:
+    """
+    Track the queries executed within the context, in the current thread,
+    and in threads calling `track_current_queries` in (a copy of) the context.
+
+    :param using: Aliases of the databases to track queries on. Defaults to all databases.
+    :param stats: Stats to add the queries to, e.g. to resume tracking. Defaults to new stats.
+    :return: The stats of the queries, updated as queries are executed
+    """
+    stats = stats if stats is not None else QueryStats()
+    tracker = QueryTracker(stats, using)
+    # Restore the previous tracker, rather than resetting to a token, as the context
+    # may be exited in a copy of the context it was entered in (e.g. by `sync_to_async`)
+    previous = _current_tracker.get()
+    _current_tracker.set(tracker)
+    try:
+        with tracker.install():
+            yield stats
+    finally:
+        _current_tracker.set(previous)
+
+
+@contextlib.contextmanager
+def track_current_queries() -> typing.Iterator[typing.Optional[QueryStats]]:
+    """
+    Track the queries executed within the context, in the current thread,
+    into the stats of the `track_queries` context the current context is (a copy of), if any.
+
+    For threads running work on behalf of another, in a copy of its context.
+
+    :return: The stats the queries are added to, or None if there is no such context
+    """
+    tracker = _current_tracker.get()
+    if tracker is None:
+        yield None
+        return
+    with tracker.install():
+        yield tracker.stats
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a request executes more queries than its budget allows"""
@@ -219,3 +219,30 @@ def redirect_authenticated(
         return functools.wraps(view)(wrapper)
 
     return decorator
+
+
+def query_budget(
+    queries: Optional[int] = None, *, repeated: Optional[int] = None
+) -> Callable[[Union[type[CBV], FBV]], Union[type[CBV], FBV]]:
+    """
+    Sets the query budget of a view, enforced by `QueryInstrumentationMiddleware`.
+    Overrides any budget set for the view in the `QUERY_INSTRUMENTATION` helpers setting.
+
+    :param queries: Maximum number of queries a request to the view may execute.
+    :param repeated: Maximum number of times a request to the view may execute
+        the same query shape (see `helpers.models.queries.fingerprint`).
+
+    Example usage:
+    ```python
+    @query_budget(20, repeated=3)
+    class MyView(View):
+        ...
+    ```
+    """
+    budget = {"queries": queries, "repeated": repeated}
+
+    def decorator(view: Union[type[CBV], FBV]) -> Union[type[CBV], FBV]:
+        view.query_budget = budget
+        return view
+
+    return decorator
@@ -3,13 +3,18 @@ from django.utils.module_loading import import_string
 from django.http import HttpRequest, HttpResponse
 import os
 import asyncio
-from typing import Dict, Union, Any, Callable
+import contextlib
+import json
+import logging
+import time
+from typing import Dict, Union, Any, Callable, Iterator, Optional
 from asgiref.sync import async_to_sync
 from django.core.exceptions import ImproperlyConfigured
 
 from helpers.config import settings
 from .format import drf_response_formatter, Formatter
 from ..logging import log_exception
+from ..models.queries import QueryBudgetExceeded, QueryStats, track_queries
 
 
 class FormatResponseMiddleware(MiddlewareMixin):
@@ -143,3 +148,186 @@ class MaintenanceMiddleware(MiddlewareMixin):
         return {
             "Content-Type": "text/html",
         }
+
+
+class QueryInstrumentationMiddleware(MiddlewareMixin):
+    """
+    Middleware that counts the queries executed, and the time spent executing them,
+    per request (see `helpers.models.queries`), and flags query shapes repeated
+    more than `repeated_query_threshold` times, which are likely N+1 queries.
+
+    The stats of each request are logged (as JSON) to the `helpers.queries` logger,
+    as a warning if queries were repeated or the view's budget was exceeded,
+    and added to the response's `Server-Timing` header.
+
+    Budgets are set per view name (e.g. "portfolios:portfolio_detail") in the
+    `budgets` setting, or with the `query_budget` decorator, and default to
+    `default_budget`. If `raise` is set (e.g. in tests), `QueryBudgetExceeded`
+    is raised when a budget is exceeded.
+
+    Queries executed in the request's thread are counted, and so are those of
+    `DatabaseExecutor` tasks submitted while handling it (see `track_current_queries`).
+    Streaming responses are tracked until their content is consumed, and are
+    logged then, without a `Server-Timing` header (sent before their content).
+    Queries executed while consuming async streaming content are not counted.
+
+    In settings.py:
+
+    ```python
+    HELPERS_SETTINGS = {
+        ...,
+        "QUERY_INSTRUMENTATION": {
+            "enabled": True,
+            "server_timing": True,
+            "repeated_query_threshold": 5,
+            "default_budget": {"queries": 100},
+            "budgets": {
+                "portfolios:portfolio_detail": {"queries": 30, "repeated": 5},
+            },
+            "raise": False,
+        }
+    }
+    ```
+    """
+
+    setting_name = "QUERY_INSTRUMENTATION"
+    logger = logging.getLogger("helpers.queries")
+
+    def __init__(
+        self, get_response: Callable[[HttpRequest], HttpResponse] | None = ...
+    ) -> None:
+        super().__init__(get_response)
+        self.settings: Dict[str, Any] = getattr(settings, type(self).setting_name)
+
+    def process_request(self, request: HttpRequest) -> None:
+        if not self.settings.get("enabled", True):
+            return None
+        stack = contextlib.ExitStack()
+        request._query_stats = stack.enter_context(track_queries())
+        request._query_tracking = stack
+        request._request_start = time.perf_counter()
+        return None
+
+    def process_view(
+        self, request: HttpRequest, view_func: Callable, view_args, view_kwargs
+    ) -> None:
+        view_class = getattr(view_func, "view_class", None)
+        request._query_budget = getattr(
+            view_func, "query_budget", getattr(view_class, "query_budget", None)
+        )
+        return None
+
+    def process_response(
+        self, request: HttpRequest, response: HttpResponse
+    ) -> HttpResponse:
+        stack: Optional[contextlib.ExitStack] = getattr(
+            request, "_query_tracking", None
+        )
+        if stack is None:
+            return response
+        stack.close()
+        request._query_tracking = None
+
+        if response.streaming and not response.is_async:
+            response.streaming_content = self.track_streaming_content(
+                request, response, response.streaming_content
+            )
+            return response
+        return self.report(request, response)
+
+    def track_streaming_content(
+        self, request: HttpRequest, response: HttpResponse, content: Iterator[bytes]
+    ) -> Iterator[bytes]:
+        """Track the queries executed while the content is consumed, and report them after."""
+        completed = False
+        try:
+            with track_queries(stats=request._query_stats):
+                yield from content
+            completed = True
+        finally:
+            # Do not raise from a stream closed early (e.g. by the client disconnecting)
+            self.report(request, response, streamed=True, raise_exceeded=completed)
+
+    def report(
+        self,
+        request: HttpRequest,
+        response: HttpResponse,
+        *,
+        streamed: bool = False,
+        raise_exceeded: bool = True,
+    ) -> HttpResponse:
+        """
+        Log the request's query stats, and check them against the view's budget.
+
+        :param streamed: Whether the response's content was streamed, so its headers were sent.
+        :param raise_exceeded: Whether to raise if the budget was exceeded (and `raise` is set).
+        """
+        stats: QueryStats = request._query_stats
+        duration = time.perf_counter() - request._request_start
+        view_name = getattr(getattr(request, "resolver_match", None), "view_name", None)
+        threshold = self.settings.get("repeated_query_threshold", 5)
+        exceeded = self.check_budget(stats, self.get_budget(request, view_name))
+
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": view_name,
+            "status": response.status_code,
+            "duration_ms": round(duration * 1000, 3),
+            **stats.as_dict(threshold=threshold),
+            "budget_exceeded": exceeded,
+        }
+        level = (
+            logging.WARNING if exceeded or record["repeated"] else logging.INFO
+        )
+        self.logger.log(level, json.dumps(record), extra={"query_stats": record})
+
+        if self.settings.get("server_timing", True) and not streamed:
+            self.add_server_timing(response, stats, duration)
+        if exceeded and raise_exceeded and self.settings.get("raise", False):
+            raise QueryBudgetExceeded(
+                f"{view_name or request.path}: {'; '.join(exceeded)}"
+            )
+        return response
+
+    def get_budget(
+        self, request: HttpRequest, view_name: Optional[str]
+    ) -> Dict[str, Optional[int]]:
+        """Returns the query budget of the request's view."""
+        budget = getattr(request, "_query_budget", None)
+        if budget is not None:
+            return budget
+        budgets: Dict[str, Dict[str, Optional[int]]] = self.settings.get("budgets", {})
+        if view_name in budgets:
+            return budgets[view_name]
+        return self.settings.get("default_budget", {}) or {}
+
+    def check_budget(
+        self, stats: QueryStats, budget: Dict[str, Optional[int]]
+    ) -> list:
+        """Returns a description of each limit of the budget the stats exceed."""
+        exceeded = []
+        max_queries = budget.get("queries", None)
+        if max_queries is not None and stats.queries > max_queries:
+            exceeded.append(f"{stats.queries} queries executed, budget is {max_queries}")
+
+        max_repeated = budget.get("repeated", None)
+        if max_repeated is not None:
+            for shape, count in stats.repeated(max_repeated):
+                exceeded.append(
+                    f"query executed {count} times, budget is {max_repeated}: {shape}"
+                )
+        return exceeded
+
+    def add_server_timing(
+        self, response: HttpResponse, stats: QueryStats, duration: float
+    ) -> None:
+        """Add the request's database and total time to the `Server-Timing` header."""
+        timing = (
+            f'db;dur={stats.duration * 1000:.3f};desc="{stats.queries} queries", '
+            f"total;dur={duration * 1000:.3f}"
+        )
+        existing = response.headers.get("Server-Timing", None)
+        response.headers["Server-Timing"] = (
+            f"{existing}, {timing}" if existing else timing
+        )
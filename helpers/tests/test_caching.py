@@ -0,0 +1,74 @@
+import asyncio
+from django.test import SimpleTestCase
+
+from helpers.caching import AsyncTTLCache
+
+
+class AsyncTTLCacheTests(SimpleTestCase):
+    """Tests for the coalescing of concurrent `AsyncTTLCache.get_or_compute` calls"""
+
+    def setUp(self) -> None:
+        self.cache = AsyncTTLCache(maxsize=16, ttl=60)
+        self.calls = 0
+
+    async def compute(self, value, *, release: asyncio.Event = None):
+        self.calls += 1
+        if release is not None:
+            await release.wait()
+        else:
+            await asyncio.sleep(0.01)
+        return value
+
+    async def test_concurrent_callers_share_one_computation(self):
+        results = await asyncio.gather(
+            *(self.cache.get_or_compute("key", self.compute, 42) for _ in range(20))
+        )
+
+        self.assertEqual(results, [42] * 20)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.cache.get("key"), 42)
+        self.assertEqual(self.cache.tasks, {})
+
+    async def test_different_keys_are_computed_separately(self):
+        results = await asyncio.gather(
+            self.cache.get_or_compute("a", self.compute, 1),
+            self.cache.get_or_compute("b", self.compute, 2),
+        )
+
+        self.assertEqual(results, [1, 2])
+        self.assertEqual(self.calls, 2)
+
+    async def test_cancelled_caller_does_not_cancel_shared_computation(self):
+        release = asyncio.Event()
+        cancelled = asyncio.ensure_future(
+            self.cache.get_or_compute("key", self.compute, 42, release=release)
+        )
+        waiting = asyncio.ensure_future(
+            self.cache.get_or_compute("key", self.compute, 42, release=release)
+        )
+        await asyncio.sleep(0)
+
+        cancelled.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await cancelled
+
+        release.set()
+        self.assertEqual(await waiting, 42)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.cache.get("key"), 42)
+
+    async def test_errors_are_propagated_to_all_callers_and_not_cached(self):
+        async def fail():
+            self.calls += 1
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        results = await asyncio.gather(
+            *(self.cache.get_or_compute("key", fail) for _ in range(5)),
+            return_exceptions=True,
+        )
+
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertNotIn("key", self.cache)
+        self.assertEqual(self.cache.stats.errors, 1)
@@ -0,0 +1,46 @@
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+from helpers.models.db import DatabaseExecutor
+from helpers.models.queries import track_queries
+from helpers.response.middleware import QueryInstrumentationMiddleware
+
+
+def execute_query(*args) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+
+class QueryTrackingTests(SimpleTestCase):
+    """Tests for the tracking of queries executed outside the tracking thread"""
+
+    databases = {"default"}
+
+    def test_executor_tasks_are_tracked(self):
+        with DatabaseExecutor(max_workers=2) as executor:
+            with track_queries() as stats:
+                execute_query()
+                list(executor.map(execute_query, range(4)))
+            self.assertEqual(stats.queries, 5)
+
+            # Tasks submitted outside the context are not
+            list(executor.map(execute_query, range(2)))
+        self.assertEqual(stats.queries, 5)
+
+    def test_streaming_content_is_tracked(self):
+        middleware = QueryInstrumentationMiddleware(lambda request: None)
+        request = RequestFactory().get("/")
+        middleware.process_request(request)
+
+        def stream():
+            for _ in range(3):
+                execute_query()
+                yield "row\n"
+
+        response = middleware.process_response(request, StreamingHttpResponse(stream()))
+        self.assertEqual(request._query_stats.queries, 0)
+        with self.assertLogs("helpers.queries"):
+            self.assertEqual(b"".join(response.streaming_content), b"row\n" * 3)
+        self.assertEqual(request._query_stats.queries, 3)
+        self.assertNotIn("Server-Timing", response.headers)
@@ -15,6 +15,9 @@ from typing import (
     AsyncIterable,
 )
 import base64
+import functools
+import os
+import threading
 from itertools import islice
 
 from .choice import ExtendedEnum
@@ -310,6 +313,47 @@ async def async_batched(
         yield batch
 
 
+def process_local(factory: Callable[[], T]) -> Callable[[], T]:
+    """
+    Decorator. Makes the factory return a single, process-wide instance,
+    created on first call, and again in forked processes (e.g. django-q workers),
+    as instances such as executors do not survive a fork.
+
+    The instance can be discarded, to be created again on next call,
+    with the decorated function's `cache_clear()`.
+
+    :param factory: Creates the instance.
+    """
+    lock = threading.Lock()
+    instance = None
+    pid = None
+
+    def reset_lock() -> None:
+        # The lock may have been held by another thread at the time of the fork
+        nonlocal lock
+        lock = threading.Lock()
+
+    os.register_at_fork(after_in_child=reset_lock)
+
+    @functools.wraps(factory)
+    def wrapper() -> T:
+        nonlocal instance, pid
+        if instance is None or pid != os.getpid():
+            with lock:
+                if instance is None or pid != os.getpid():
+                    instance = factory()
+                    pid = os.getpid()
+        return instance
+
+    def cache_clear() -> None:
+        nonlocal instance
+        with lock:
+            instance = None
+
+    wrapper.cache_clear = cache_clear
+    return wrapper
+
+
 __all__ = [
     "is_exception_class",
     "str_to_base64",
@@ -325,4 +369,5 @@ __all__ = [
     "underscore_dict_keys",
     "python_type_to_html_input_type",
     "batched",
+    "process_local",
 ]
@@ -6,6 +6,10 @@ except ImportError:
 import time
 import sys
 from contextlib import ContextDecorator
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from helpers.metrics import Histogram
 
 
 _P = ParamSpec("_P")
@@ -16,17 +20,27 @@ _C = TypeVar("_C", bound=Callable[_P, _R])
 class _timeit(ContextDecorator):
     """Context manager/decorator to measure the time taken to execute a function or block of code."""
 
-    def __init__(self, identifier: str = None, output: Callable = None) -> None:
+    def __init__(
+        self,
+        identifier: str = None,
+        output: Union[Callable, bool, None] = None,
+        histogram: Union[str, "Histogram", None] = None,
+    ) -> None:
         """
         Create a new instance of the _timeit class.
 
         :param identifier: A unique identifier for the function or block.
         :param output: The output/writer function to use. This defaults to sys.stdout.write.
+            If False, the time taken is not written.
+        :param histogram: The (name of the) histogram to also record the time taken into.
         """
         self.identifier = identifier
         self.start = None
         self.end = None
-        self.output = output or sys.stdout.write
+        if output is None or output is True:
+            output = sys.stdout.write
+        self.output = output
+        self.histogram = histogram
 
     def __enter__(self) -> None:
         self.start = time.monotonic()
@@ -34,22 +48,36 @@ class _timeit(ContextDecorator):
     def __exit__(self, *exc) -> None:
         self.end = time.monotonic()
         time_taken = self.end - self.start
-        if self.identifier:
-            self.output(f"'{self.identifier}' executed in {time_taken} seconds.\n")
-        else:
-            self.output(f"Execution took {time_taken} seconds.\n")
+        if self.output is not False:
+            if self.identifier:
+                self.output(f"'{self.identifier}' executed in {time_taken} seconds.\n")
+            else:
+                self.output(f"Execution took {time_taken} seconds.\n")
+
+        if self.histogram is not None:
+            if isinstance(self.histogram, str):
+                from helpers import metrics
+
+                self.histogram = metrics.histogram(self.histogram)
+            self.histogram.observe(time_taken)
 
     def __call__(self, func: _C) -> _C:
         self.identifier = self.identifier or func.__name__
         return super().__call__(func)
 
+    def _recreate_cm(self) -> "_timeit":
+        # Each call of a decorated function is timed by its own instance,
+        # so that concurrent calls (e.g. in threads) do not share their start time
+        return type(self)(self.identifier, self.output, self.histogram)
+
 
 @overload
 def timeit(
     identifier: str,
     func: Optional[_C] = None,
     *,
-    output: Optional[Callable] = None,
+    output: Union[Callable, bool, None] = None,
+    histogram: Union[str, "Histogram", None] = None,
 ) -> Union[_timeit, _C]: ...
 
 
@@ -58,14 +86,16 @@ def timeit(
     func: Optional[_C] = None,
     *,
     identifier: Optional[str] = None,
-    output: Optional[Callable] = None,
+    output: Union[Callable, bool, None] = None,
+    histogram: Union[str, "Histogram", None] = None,
 ) -> Union[_timeit, _C]: ...
 
 
 def timeit(
     func: Optional[_C] = None,
     identifier: Optional[str] = None,
-    output: Optional[Callable] = None,
+    output: Union[Callable, bool, None] = None,
+    histogram: Union[str, "Histogram", None] = None,
 ) -> Union[_timeit, _C]:
     """
     Measure the time taken to execute a function or block of code.
@@ -73,6 +103,9 @@ def timeit(
     :param func: The function to be measured.
     :param identifier: A unique identifier for the function or block.
     :param output: The output/writer function to use. This defaults to sys.stdout.write.
+        If False, the time taken is not written (e.g. when only recorded into a histogram).
+    :param histogram: The (name of the) histogram to also record the time taken (in seconds) into.
+        Histograms given by name are registered in `helpers.metrics`, if not already.
 
     Example:
     ```python
@@ -80,17 +113,25 @@ def timeit(
         # Code block
 
     @timeit
+    def my_function():
+        # Function code
+
+    @timeit(histogram="my_function_duration_seconds", output=False)
     def my_function():
         # Function code
     ```
     """
     if isinstance(func, str):
-        context_decorator = _timeit(identifier=func, output=output)
+        context_decorator = _timeit(
+            identifier=func, output=output, histogram=histogram
+        )
         if identifier:
             return context_decorator(identifier)
         return context_decorator
 
-    context_decorator = _timeit(identifier=identifier, output=output)
+    context_decorator = _timeit(
+        identifier=identifier, output=output, histogram=histogram
+    )
     if func:
         return context_decorator(func)
     return context_decorator
@@ -0,0 +1,44 @@
+import hmac
+from django.http import HttpRequest, HttpResponse
+from django.views import View
+
+from helpers import metrics
+from helpers.config import settings
+
+
+class MetricsView(View):
+    """
+    Renders the metrics in the Prometheus text exposition format.
+
+    Available to staff users, and to scrapers presenting the token
+    in the `METRICS` helpers setting, as a bearer token.
+    """
+
+    http_method_names = ["get"]
+
+    def is_authorized(self, request: HttpRequest) -> bool:
+        if request.user.is_authenticated and request.user.is_staff:
+            return True
+
+        token = settings.METRICS.get("token", None)
+        scheme, _, credentials = request.headers.get("Authorization", "").partition(
+            " "
+        )
+        return bool(
+            token
+            and scheme.lower() == "bearer"
+            and hmac.compare_digest(credentials.strip(), token)
+        )
+
+    def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        if not self.is_authorized(request):
+            return HttpResponse(
+                "Unauthorized",
+                status=401,
+                content_type="text/plain",
+                headers={"WWW-Authenticate": 'Bearer realm="metrics"'},
+            )
+        return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+metrics_view = MetricsView.as_view()
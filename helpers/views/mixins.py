@@ -0,0 +1,27 @@
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import HttpRequest
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    """
+    `LoginRequiredMixin` that also supports views with async handlers.
+
+    For async views, the user is loaded with `request.auser()`, as accessing
+    `request.user` in an async context would query the database synchronously.
+    The loaded user is then set as `request.user`, for use by the handlers.
+
+    Views with sync handlers (e.g. subclasses overriding the handlers) are
+    dispatched as by `LoginRequiredMixin`.
+    """
+
+    def dispatch(self, request: HttpRequest, *args, **kwargs):
+        if not self.view_is_async:
+            return super().dispatch(request, *args, **kwargs)
+        return self.adispatch(request, *args, **kwargs)
+
+    async def adispatch(self, request: HttpRequest, *args, **kwargs):
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        # Skip `LoginRequiredMixin.dispatch`, as the user has been checked
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)